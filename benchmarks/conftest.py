@@ -0,0 +1,235 @@
+"""
+Shared fixtures of the benchmark suite: synthetic basins at every selected
+scale, the products of the earlier stages, and a runner that records peak
+memory next to the timings.
+"""
+
+import glob
+import os
+import tracemalloc
+
+import numpy as np
+import pytest
+import whitebox
+
+import streamkit
+from streamkit.mainstem import label_mainstem
+from streamkit.nhd import rasterize_nhd
+from streamkit.nx_convert import vector_streams_to_networkx
+from streamkit.streamlink import link_streams
+from streamkit.strahler import strahler_order
+from streamkit.upstream_length import upstream_length
+from streamkit.watershed import delineate_subbasins
+from streamkit.vectorize_streams import vectorize_streams
+from streamkit.xs import network_cross_sections
+
+from terrain import (
+    dendritic_dem,
+    fill_depressions,
+    fractal_dem,
+    hydrology,
+    v_valley_dem,
+)
+
+# DEM cells and stream links of every scale
+SCALES = {
+    "small": (10**5, 10**2),
+    "medium": (10**6, 10**3),
+    "large": (10**7, 10**4),
+    "xlarge": (10**8, 10**5),
+}
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("streamkit benchmarks")
+    group.addoption(
+        "--scale",
+        default="small",
+        help=f"Comma separated scales to run, from {', '.join(SCALES)}. "
+        "Default: small.",
+    )
+    group.addoption(
+        "--rounds",
+        type=int,
+        default=3,
+        help="Timed rounds of every benchmark. Default: 3.",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    if "scale" in metafunc.fixturenames:
+        scales = metafunc.config.getoption("scale").split(",")
+        unknown = [scale for scale in scales if scale not in SCALES]
+        if unknown:
+            raise pytest.UsageError(f"Unknown scales {unknown}")
+        metafunc.parametrize("scale", scales, scope="session")
+
+
+def pytest_benchmark_update_json(config, benchmarks, output_json):
+    output_json["streamkit_version"] = streamkit.__version__
+
+
+@pytest.fixture
+def run(benchmark, request):
+    """Benchmark func(*args, **kwargs).
+
+    A first, untimed call measures the peak memory allocated by numpy and
+    Python with tracemalloc (memory allocated by compiled code outside of
+    numpy is not seen), and also compiles any numba kernels. The call is
+    then timed over --rounds rounds. Peak memory and the scale of the inputs
+    are stored in the extra_info of the JSON report.
+    """
+
+    def run(func, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            func(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        benchmark.extra_info["peak_memory_mb"] = peak / 2**20
+        if "scale" in request.fixturenames:
+            scale = request.getfixturevalue("scale")
+            cells, links = SCALES[scale]
+            benchmark.extra_info.update(scale=scale, cells=cells, links=links)
+        return benchmark.pedantic(
+            func,
+            args=args,
+            kwargs=kwargs,
+            rounds=request.config.getoption("rounds"),
+            iterations=1,
+        )
+
+    return run
+
+
+@pytest.fixture(scope="session")
+def basin(scale):
+    """A dendritic basin: dem, flow_directions, flow_accumulation, and the
+    min_accumulation that gives the number of links of the scale."""
+    cells, links = SCALES[scale]
+    dem, min_accumulation = dendritic_dem(links, cells_per_link=cells // links)
+    flow_directions, flow_accumulation = hydrology(dem)
+    return {
+        "dem": dem,
+        "flow_directions": flow_directions,
+        "flow_accumulation": flow_accumulation,
+        "min_accumulation": min_accumulation,
+    }
+
+
+@pytest.fixture(scope="session")
+def valley(scale):
+    """A V-shaped valley (one stream) with the number of cells of the scale:
+    dem, flow_directions, flow_accumulation."""
+    cells, _ = SCALES[scale]
+    side = int(np.sqrt(cells))
+    dem = v_valley_dem((side, side + 1 - side % 2))
+    flow_directions, flow_accumulation = hydrology(dem)
+    return {
+        "dem": dem,
+        "flow_directions": flow_directions,
+        "flow_accumulation": flow_accumulation,
+    }
+
+
+@pytest.fixture(params=["basin", "valley"])
+def terrain(request, scale):
+    """The basin and the valley, in turn."""
+    return request.getfixturevalue(request.param)
+
+
+@pytest.fixture(scope="session")
+def rough_dem(scale):
+    """Fractal terrain with the number of cells of the scale, with its
+    depressions left unfilled."""
+    cells, _ = SCALES[scale]
+    side = int(np.sqrt(cells))
+    return fractal_dem((side, side), filled=False)
+
+
+@pytest.fixture(scope="session")
+def stream_mask(basin):
+    """Stream cells (1) of the basin."""
+    acc = basin["flow_accumulation"]
+    return acc.copy(data=(acc.data > basin["min_accumulation"]).astype(np.uint8))
+
+
+@pytest.fixture(scope="session")
+def streams(basin, stream_mask):
+    """Stream links of the basin."""
+    return link_streams(stream_mask, basin["flow_directions"])
+
+
+@pytest.fixture(scope="session")
+def subbasins(basin, streams):
+    return delineate_subbasins(
+        streams, basin["flow_directions"], basin["flow_accumulation"]
+    )
+
+
+@pytest.fixture(scope="session")
+def edited_basin(basin, stream_mask):
+    """The basin with a 2 m deep, 9 x 9 cell burn on the stream cell of
+    median flow accumulation: the edited dem, the window, and its
+    flow_directions and flow_accumulation."""
+    acc = basin["flow_accumulation"].data
+    rows, cols = np.nonzero(stream_mask.data)
+    k = np.argsort(acc[rows, cols])[len(rows) // 2]
+    row, col = rows[k], cols[k]
+    window = (max(row - 4, 0), row + 5, max(col - 4, 0), col + 5)
+    dem = basin["dem"].copy(deep=True)
+    dem.data[window[0] : window[1], window[2] : window[3]] -= 2
+    flow_directions, flow_accumulation = hydrology(fill_depressions(dem))
+    return {
+        "dem": dem,
+        "window": window,
+        "flow_directions": flow_directions,
+        "flow_accumulation": flow_accumulation,
+    }
+
+
+@pytest.fixture(scope="session")
+def stream_lines(basin, streams):
+    return vectorize_streams(
+        streams, basin["flow_directions"], basin["flow_accumulation"]
+    )
+
+
+@pytest.fixture(scope="session")
+def nhd_streams(basin, stream_lines):
+    """Stream links traced from the heads of the vectorized links, as with
+    NHD flowlines (links of less than 2 cells are dropped)."""
+    return rasterize_nhd(stream_lines, basin["dem"], basin["flow_directions"])
+
+
+@pytest.fixture(scope="session")
+def network(stream_lines):
+    graph = vector_streams_to_networkx(stream_lines)
+    graph = strahler_order(graph)
+    graph = upstream_length(graph)
+    return label_mainstem(graph)
+
+
+@pytest.fixture(scope="session")
+def cross_sections(stream_lines):
+    return network_cross_sections(
+        stream_lines.geometry,
+        100,
+        1000,
+        linestring_ids=stream_lines["stream_id"].values,
+    )
+
+
+@pytest.fixture(scope="session")
+def whitebox_tools():
+    """Skip benchmarks that need the WhiteboxTools binary if it has not been
+    downloaded, since WhiteboxTools would try to download it."""
+    if os.environ.get("WBT_PATH") is None:
+        package_dir = os.path.dirname(whitebox.__file__)
+        found = glob.glob(os.path.join(package_dir, "whitebox_tools*")) + glob.glob(
+            os.path.join(package_dir, "WBT", "whitebox_tools*")
+        )
+        if not [path for path in found if not path.endswith(".py")]:
+            pytest.skip("WhiteboxTools binary is not installed")
@@ -0,0 +1,260 @@
+"""
+Deterministic synthetic terrain for the benchmarks.
+
+Every generator returns a georeferenced DEM that is free of depressions and
+flats (unless asked otherwise), so its drainage can be derived offline with
+hydrology() without the WhiteboxTools conditioning step.
+"""
+
+import heapq
+
+from affine import Affine
+import numba
+import numpy as np
+import rioxarray  # noqa: F401
+import xarray as xr
+
+from streamkit._internal.adapters import from_pysheds, to_pysheds
+from streamkit._internal.dirmap import _make_esri_dirmap
+from streamkit.flowdir import normalize_flow_directions
+
+CRS = "EPSG:3310"
+
+
+def fractal_dem(
+    shape: tuple[int, int],
+    seed: int = 0,
+    hurst: float = 0.8,
+    relief: float = 100.0,
+    slope: float = 0.01,
+    resolution: float = 10.0,
+    filled: bool = True,
+) -> xr.DataArray:
+    """Fractal (fractional Brownian) terrain tilted towards the bottom edge.
+
+    The surface is made by spectral synthesis: white noise filtered in the
+    frequency domain so its power falls off with the Hurst exponent.
+
+    Args:
+        shape: (rows, cols) of the DEM.
+        seed: Seed of the random noise.
+        hurst: Hurst exponent in (0, 1); higher values give smoother terrain.
+        relief: Elevation range of the fractal surface, before the tilt.
+        slope: Regional slope towards the bottom edge.
+        resolution: Cell size in meters.
+        filled: Whether to fill depressions (see fill_depressions). Unfilled
+            DEMs have pits, like real DEMs.
+    Returns:
+        DEM raster (float64).
+    """
+    nrows, ncols = shape
+    rng = np.random.default_rng(seed)
+    spectrum = np.fft.rfft2(rng.standard_normal(shape))
+    ky = np.fft.fftfreq(nrows)[:, None]
+    kx = np.fft.rfftfreq(ncols)[None, :]
+    k = np.sqrt(kx**2 + ky**2)
+    k[0, 0] = np.inf
+    spectrum *= k ** -(hurst + 1)
+    z = np.fft.irfft2(spectrum, s=shape)
+    del spectrum, k
+
+    z -= z.min()
+    z *= relief / z.max()
+    z += slope * resolution * (nrows - 1 - np.arange(nrows))[:, None]
+    dem = _georeference(z, resolution)
+    return fill_depressions(dem) if filled else dem
+
+
+def v_valley_dem(
+    shape: tuple[int, int],
+    valley_slope: float = 0.01,
+    side_slope: float = 0.1,
+    resolution: float = 10.0,
+) -> xr.DataArray:
+    """A single V-shaped valley with known drainage.
+
+    Every hillslope cell drains straight across the slope to the center
+    column, which drains down to the bottom edge, so the valley is one
+    stream of nrows cells whose flow accumulation at row i is
+    (i + 1) * ncols.
+
+    Args:
+        shape: (rows, cols) of the DEM.
+        valley_slope: Slope of the valley floor.
+        side_slope: Slope of the valley sides, must be steeper than the
+            valley floor.
+        resolution: Cell size in meters.
+    Returns:
+        DEM raster (float64).
+    """
+    if side_slope <= valley_slope:
+        raise ValueError("side_slope must be greater than valley_slope")
+    nrows, ncols = shape
+    rows = np.arange(nrows)[:, None]
+    cols = np.arange(ncols)[None, :]
+    z = valley_slope * resolution * (nrows - 1 - rows) + side_slope * resolution * (
+        np.abs(cols - ncols // 2)
+    )
+    return _georeference(z, resolution)
+
+
+def dendritic_dem(
+    n_links: int,
+    seed: int = 0,
+    cells_per_link: int = 1000,
+    resolution: float = 10.0,
+) -> tuple[xr.DataArray, int]:
+    """Fractal terrain sized for a dendritic network of about n_links links.
+
+    Args:
+        n_links: Target number of stream links.
+        seed: Seed of the terrain.
+        cells_per_link: Number of DEM cells per link; the DEM has about
+            n_links * cells_per_link cells.
+        resolution: Cell size in meters.
+    Returns:
+        (dem, min_accumulation): the DEM and the flow accumulation above
+        which cells are streams, chosen so the network has close to n_links
+        links.
+    """
+    side = int(np.sqrt(n_links * cells_per_link))
+    dem = fractal_dem((side, side), seed=seed, resolution=resolution)
+    flow_directions, flow_accumulation = hydrology(dem)
+    return dem, count_links_threshold(flow_directions, flow_accumulation, n_links)
+
+
+def hydrology(dem: xr.DataArray) -> tuple[xr.DataArray, xr.DataArray]:
+    """Flow directions and accumulation of a depression-free DEM.
+
+    Same as flow_accumulation_workflow without the WhiteboxTools
+    conditioning, which the synthetic DEMs do not need.
+    """
+    pysheds_dem, grid = to_pysheds(dem)
+    flow_directions = grid.flowdir(pysheds_dem)
+    flow_accumulation = grid.accumulation(flow_directions)
+    return (
+        normalize_flow_directions(from_pysheds(flow_directions)),
+        from_pysheds(flow_accumulation),
+    )
+
+
+def fill_depressions(dem: xr.DataArray, epsilon: float = 1e-4) -> xr.DataArray:
+    """Fill depressions by priority flood from the edges, raising filled
+    cells epsilon above the cell they spill into so no flats remain."""
+    return dem.copy(data=_fill_depressions_numba(dem.data.astype(np.float64), epsilon))
+
+
+def count_links_threshold(
+    flow_directions: xr.DataArray, flow_accumulation: xr.DataArray, n_links: int
+) -> int:
+    """Find the flow accumulation threshold whose stream network
+    (accumulation > threshold) has the number of links closest to n_links.
+
+    A cell is a source if its accumulation is above the threshold but none of
+    its inflows is, and a confluence if at least two of its inflows are
+    above it. The number of links is the number of sources plus the number
+    of confluences, so it can be counted for any threshold from the two
+    largest inflow accumulations of every cell.
+    """
+    acc = flow_accumulation.data.ravel()
+    first, second = _largest_inflows_numba(
+        normalize_flow_directions(flow_directions).data,
+        flow_accumulation.data.astype(np.float64),
+        _make_esri_dirmap(),
+    )
+    acc, first, second = np.sort(acc), np.sort(first), np.sort(second)
+
+    def links(threshold):
+        above = [
+            len(a) - np.searchsorted(a, threshold, side="right")
+            for a in (acc, first, second)
+        ]
+        return above[0] - above[1] + above[2]
+
+    low, high = 1, int(acc[-1])
+    while high - low > 1:
+        mid = (low + high) // 2
+        if links(mid) > n_links:
+            low = mid
+        else:
+            high = mid
+    return min((low, high), key=lambda t: abs(links(t) - n_links))
+
+
+def _georeference(z, resolution):
+    nrows, ncols = z.shape
+    transform = Affine(resolution, 0, 500000, 0, -resolution, 4200000)
+    dem = xr.DataArray(
+        z,
+        dims=("y", "x"),
+        coords={
+            "y": transform.f + transform.e * (np.arange(nrows) + 0.5),
+            "x": transform.c + transform.a * (np.arange(ncols) + 0.5),
+        },
+    )
+    dem.rio.write_crs(CRS, inplace=True)
+    dem.rio.write_transform(transform, inplace=True)
+    dem.rio.write_nodata(np.nan, inplace=True)
+    return dem
+
+
+@numba.njit
+def _fill_depressions_numba(z, epsilon):
+    nrows, ncols = z.shape
+    filled = z.copy()
+    closed = np.zeros((nrows, ncols), dtype=np.bool_)
+    heap = [(0.0, 0)]
+    heap.pop()
+    for row in range(nrows):
+        for col in range(ncols):
+            if row == 0 or col == 0 or row == nrows - 1 or col == ncols - 1:
+                closed[row, col] = True
+                heap.append((filled[row, col], row * ncols + col))
+    heapq.heapify(heap)
+
+    while heap:
+        elevation, cell = heapq.heappop(heap)
+        row, col = cell // ncols, cell % ncols
+        for drow in range(-1, 2):
+            for dcol in range(-1, 2):
+                next_row = row + drow
+                next_col = col + dcol
+                if not (0 <= next_row < nrows and 0 <= next_col < ncols):
+                    continue
+                if closed[next_row, next_col]:
+                    continue
+                closed[next_row, next_col] = True
+                if filled[next_row, next_col] < elevation + epsilon:
+                    filled[next_row, next_col] = elevation + epsilon
+                heapq.heappush(
+                    heap, (filled[next_row, next_col], next_row * ncols + next_col)
+                )
+    return filled
+
+
+@numba.njit
+def _largest_inflows_numba(flow_directions_arr, acc_arr, dirmap):
+    """Largest and second largest flow accumulation of the inflows of every
+    cell (0 where there are none), flattened."""
+    nrows, ncols = flow_directions_arr.shape
+    first = np.zeros(nrows * ncols)
+    second = np.zeros(nrows * ncols)
+    for row in range(nrows):
+        for col in range(ncols):
+            current_direction = flow_directions_arr[row, col]
+            drow = dirmap[current_direction, 0]
+            dcol = dirmap[current_direction, 1]
+            if drow == 0 and dcol == 0:
+                continue
+            next_row = row + drow
+            next_col = col + dcol
+            if not (0 <= next_row < nrows and 0 <= next_col < ncols):
+                continue
+            target = next_row * ncols + next_col
+            value = acc_arr[row, col]
+            if value > first[target]:
+                second[target] = first[target]
+                first[target] = value
+            elif value > second[target]:
+                second[target] = value
+    return first, second
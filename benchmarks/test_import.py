@@ -0,0 +1,40 @@
+"""Benchmarks of the import time of streamkit, in fresh interpreters."""
+
+import subprocess
+import sys
+
+import pytest
+
+# dependencies that are slow to import and only needed by some entry points
+HEAVY_MODULES = ["pysheds", "py3dep", "pygeohydro", "pynhd", "whitebox", "ruptures"]
+
+
+def _import_in_subprocess(statement):
+    code = (
+        "import json, sys\n"
+        f"{statement}\n"
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    return result.stdout.strip().splitlines()[-1]
+
+
+@pytest.mark.parametrize(
+    "statement",
+    [
+        "import streamkit",
+        "from streamkit import strahler_order",
+        "from streamkit import vectorize_streams",
+        "from streamkit import flow_accumulation_workflow",
+    ],
+)
+def test_import_time(benchmark, request, statement):
+    rounds = request.config.getoption("rounds")
+    loaded = benchmark.pedantic(
+        _import_in_subprocess, args=(statement,), rounds=rounds, iterations=1
+    )
+    benchmark.extra_info["heavy_modules"] = loaded
+    if statement == "import streamkit":
+        assert loaded == "[]"
@@ -0,0 +1,78 @@
+"""Benchmarks of the vector network stages."""
+
+import numpy as np
+import xarray as xr
+
+from streamkit.mainstem import label_mainstem
+from streamkit.networkindex import NetworkIndex
+from streamkit.nx_convert import networkx_to_gdf, vector_streams_to_networkx
+from streamkit.profile import cross_section_metrics, sample_cross_sections
+from streamkit.strahler import strahler_order
+from streamkit.upstream_length import upstream_length
+from streamkit.xs import network_cross_sections
+
+
+def test_vector_streams_to_networkx(run, stream_lines):
+    run(vector_streams_to_networkx, stream_lines)
+
+
+def test_networkx_to_gdf(run, network):
+    run(networkx_to_gdf, network)
+
+
+def test_strahler_order(run, stream_lines):
+    graph = vector_streams_to_networkx(stream_lines)
+    run(strahler_order, graph)
+
+
+def test_upstream_length(run, stream_lines):
+    graph = vector_streams_to_networkx(stream_lines)
+    run(upstream_length, graph)
+
+
+def test_label_mainstem(run, stream_lines):
+    graph = upstream_length(strahler_order(vector_streams_to_networkx(stream_lines)))
+    run(label_mainstem, graph)
+
+
+def test_network_cross_sections(run, stream_lines):
+    run(
+        network_cross_sections,
+        stream_lines.geometry,
+        100,
+        1000,
+        linestring_ids=stream_lines["stream_id"].values,
+    )
+
+
+def test_sample_cross_sections(run, cross_sections):
+    run(sample_cross_sections, cross_sections, 10)
+
+
+def test_cross_section_metrics(run, basin, cross_sections):
+    profiles = sample_cross_sections(cross_sections, 10)
+    profiles["elevation"] = (
+        basin["dem"]
+        .sel(
+            x=xr.DataArray(profiles.geometry.x.values),
+            y=xr.DataArray(profiles.geometry.y.values),
+            method="nearest",
+        )
+        .values
+    )
+    run(cross_section_metrics, profiles, [1, 2, 5], value_column="elevation")
+
+
+def test_network_index_snap(run, basin, streams, stream_lines):
+    # a point per link, as for gauges
+    x0, y0, x1, y1 = stream_lines.total_bounds
+    points = np.random.default_rng(0).uniform(
+        (x0, y0), (x1, y1), (len(stream_lines), 2)
+    )
+    index = NetworkIndex(
+        streams,
+        basin["flow_directions"],
+        basin["flow_accumulation"],
+        flowlines=stream_lines,
+    )
+    run(index.snap, points, basin["min_accumulation"] * 10)
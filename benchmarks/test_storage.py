@@ -0,0 +1,27 @@
+"""Benchmarks of raster and vector storage."""
+
+from streamkit.geoparquet import read_geoparquet, write_geoparquet
+from streamkit.rasterstore import read_raster, write_raster
+
+
+def test_write_raster(run, basin, tmp_path):
+    run(write_raster, str(tmp_path / "dem.npy"), basin["dem"])
+
+
+def test_read_raster(run, basin, tmp_path):
+    path = str(tmp_path / "dem.npy")
+    write_raster(path, basin["dem"])
+    # reading the values, not only mapping the file
+    run(lambda: read_raster(path).values.sum())
+
+
+def test_write_geoparquet(run, cross_sections, tmp_path):
+    run(write_geoparquet, [cross_sections], tmp_path / "xs.parquet")
+
+
+def test_read_geoparquet_bbox(run, cross_sections, tmp_path):
+    path = tmp_path / "xs.parquet"
+    write_geoparquet([cross_sections], path, batch_size=1000)
+    xmin, ymin, xmax, ymax = cross_sections.total_bounds
+    bbox = (xmin, ymin, (xmin + xmax) / 2, (ymin + ymax) / 2)
+    run(read_geoparquet, path, bbox=bbox)
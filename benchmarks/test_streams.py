@@ -0,0 +1,58 @@
+"""Benchmarks of the stream raster and vectorization stages."""
+
+import numpy as np
+
+from streamkit.geoparquet import write_geoparquet
+from streamkit.nhd import rasterize_nhd
+from streamkit.reach import delineate_reaches
+from streamkit.streamlink import link_streams, trace_stream_links
+from streamkit.streamnodes import find_stream_nodes
+from streamkit.vectorize_streams import iter_vectorize_streams, vectorize_streams
+
+
+def test_find_stream_nodes(run, basin, stream_mask):
+    run(find_stream_nodes, stream_mask, basin["flow_directions"])
+
+
+def test_link_streams(run, basin, stream_mask):
+    run(link_streams, stream_mask, basin["flow_directions"])
+
+
+def test_trace_stream_links(run, basin, stream_mask):
+    # channel heads of the basin's streams
+    heads = find_stream_nodes(stream_mask, basin["flow_directions"])[0]
+    run(trace_stream_links, np.array(heads), basin["flow_directions"])
+
+
+def test_rasterize_nhd(run, basin, stream_lines):
+    # the vectorized links stand in for NHD flowlines
+    run(rasterize_nhd, stream_lines, basin["dem"], basin["flow_directions"])
+
+
+def test_vectorize_streams(run, basin, streams):
+    run(
+        vectorize_streams,
+        streams,
+        basin["flow_directions"],
+        basin["flow_accumulation"],
+    )
+
+
+def test_vectorize_streams_to_geoparquet(run, basin, streams, tmp_path):
+    def vectorize_to_file():
+        frames = iter_vectorize_streams(
+            streams, basin["flow_directions"], basin["flow_accumulation"]
+        )
+        write_geoparquet(frames, tmp_path / "streams.parquet")
+
+    run(vectorize_to_file)
+
+
+def test_delineate_reaches(run, basin, nhd_streams):
+    run(
+        delineate_reaches,
+        nhd_streams,
+        basin["dem"],
+        flow_directions=basin["flow_directions"],
+        flow_accumulation=basin["flow_accumulation"],
+    )
@@ -0,0 +1,96 @@
+"""Benchmarks of the raster stages."""
+
+import numpy as np
+
+from streamkit.flow_length import flow_length
+from streamkit.incremental import update_hydrology, update_streams
+from streamkit.labelstats import label_statistics
+from streamkit.smooth import gaussian_smooth_raster
+from streamkit.upstream_length import upstream_length_raster
+from streamkit.upstreamindex import UpstreamIndex
+from streamkit.watershed import (
+    compute_hand,
+    delineate_subbasins,
+    flow_accumulation_workflow,
+)
+
+
+def test_flow_accumulation_workflow(run, rough_dem, whitebox_tools):
+    run(flow_accumulation_workflow, rough_dem, cache=False)
+
+
+def test_compute_hand(run, terrain):
+    streams = terrain["flow_accumulation"] > terrain["flow_accumulation"].max() / 100
+    run(compute_hand, terrain["dem"], terrain["flow_directions"], streams)
+
+
+def test_delineate_subbasins(run, basin, streams):
+    run(
+        delineate_subbasins,
+        streams,
+        basin["flow_directions"],
+        basin["flow_accumulation"],
+    )
+
+
+def test_label_statistics(run, basin, subbasins):
+    run(
+        label_statistics,
+        subbasins,
+        {"elevation": basin["dem"], "flow_accumulation": basin["flow_accumulation"]},
+        stats=("mean", "max", "argmax"),
+        percentiles=(10, 50, 90),
+    )
+
+
+def test_upstream_index(run, terrain):
+    run(UpstreamIndex, terrain["flow_directions"])
+
+
+def test_upstream_index_catchments(run, basin):
+    # a thousand ad-hoc pour points
+    index = UpstreamIndex(basin["flow_directions"])
+    rng = np.random.default_rng(0)
+    rows, cols = (rng.integers(0, n, 1000) for n in index.shape)
+
+    def catchments():
+        for row, col in zip(rows, cols):
+            index.catchment_cells(row, col)
+
+    run(catchments)
+
+
+def test_update_hydrology(run, basin, edited_basin, whitebox_tools):
+    run(
+        update_hydrology,
+        edited_basin["dem"],
+        basin["dem"],
+        basin["flow_directions"],
+        basin["flow_accumulation"],
+        edited_basin["window"],
+    )
+
+
+def test_update_streams(run, basin, edited_basin, streams, subbasins):
+    run(
+        update_streams,
+        streams,
+        subbasins,
+        edited_basin["flow_directions"],
+        edited_basin["flow_accumulation"],
+        basin["flow_directions"],
+        basin["flow_accumulation"],
+        basin["min_accumulation"],
+    )
+
+
+def test_upstream_length_raster(run, basin, stream_mask):
+    run(upstream_length_raster, stream_mask, basin["flow_directions"])
+
+
+def test_flow_length(run, terrain):
+    run(flow_length, terrain["flow_directions"])
+
+
+def test_gaussian_smooth_raster(run, terrain):
+    run(gaussian_smooth_raster, terrain["dem"], spatial_radius=50, sigma=2)
@@ -2,69 +2,113 @@
 streamkit
 """
 
+from importlib import import_module
+import sys
+import types
+
 __version__ = "0.1.0"
 
-# Core watershed functions
-from streamkit.watershed import (
-    compute_hand,
-    flow_accumulation_workflow,
-    delineate_subbasins,
-)
+# Public names and the modules defining them. They are imported on first
+# access (PEP 562), so `import streamkit` does not import pysheds, the
+# HyRiver clients, or any other heavy dependency that the caller never uses.
+_LAZY_IMPORTS = {
+    # Core watershed functions
+    "compute_hand": "streamkit.watershed",
+    "flow_accumulation_workflow": "streamkit.watershed",
+    "delineate_subbasins": "streamkit.watershed",
+    "normalize_flow_directions": "streamkit.flowdir",
+    "update_hydrology": "streamkit.incremental",
+    "update_streams": "streamkit.incremental",
+    "UpstreamIndex": "streamkit.upstreamindex",
+    # Stream vectorization and network conversion
+    "vectorize_streams": "streamkit.vectorize_streams",
+    "iter_vectorize_streams": "streamkit.vectorize_streams",
+    "vector_streams_to_networkx": "streamkit.nx_convert",
+    "networkx_to_gdf": "streamkit.nx_convert",
+    # Network analysis
+    "strahler_order": "streamkit.strahler",
+    "upstream_length": "streamkit.upstream_length",
+    "label_mainstem": "streamkit.mainstem",
+    "network_cross_sections": "streamkit.xs",
+    "iter_network_cross_sections": "streamkit.xs",
+    "sample_cross_sections": "streamkit.profile",
+    "iter_sample_cross_sections": "streamkit.profile",
+    "cross_section_metrics": "streamkit.profile",
+    "NetworkIndex": "streamkit.networkindex",
+    # Terrain analysis
+    "gaussian_smooth_raster": "streamkit.smooth",
+    "upstream_length_raster": "streamkit.upstream_length",
+    "flow_length": "streamkit.flow_length",
+    "label_statistics": "streamkit.labelstats",
+    # Reach delineation
+    "delineate_reaches": "streamkit.reach",
+    # Data download utilities
+    "get_huc_data": "streamkit.data",
+    "iter_huc_data": "streamkit.data",
+    "download_huc_bounds": "streamkit.data",
+    "download_flowlines": "streamkit.data",
+    "download_dem": "streamkit.data",
+    "DataCache": "streamkit.datacache",
+    # GeoParquet output
+    "GeoParquetWriter": "streamkit.geoparquet",
+    "write_geoparquet": "streamkit.geoparquet",
+    "read_geoparquet": "streamkit.geoparquet",
+    "iter_geoparquet": "streamkit.geoparquet",
+    # Raster storage
+    "RasterStore": "streamkit.rasterstore",
+    "read_raster": "streamkit.rasterstore",
+    "write_raster": "streamkit.rasterstore",
+    # NHD-specific utilities
+    "rasterize_nhd": "streamkit.nhd",
+    # Pipelines
+    "Pipeline": "streamkit.pipeline",
+    "Stage": "streamkit.pipeline",
+    "huc_pipeline": "streamkit.pipeline",
+    "dem_pipeline": "streamkit.pipeline",
+    "run_basins": "streamkit.batch",
+    # Instrumentation
+    "Profiler": "streamkit.instrument",
+    "StageRecord": "streamkit.instrument",
+    "progress_callback": "streamkit.instrument",
+    "Cancelled": "streamkit.instrument",
+    # Compilation
+    "warmup": "streamkit.jit",
+}
 
-# Stream vectorization and network conversion
-from streamkit.vectorize_streams import vectorize_streams
-from streamkit.nx_convert import vector_streams_to_networkx, networkx_to_gdf
+__all__ = list(_LAZY_IMPORTS)
 
-# Network analysis
-from streamkit.strahler import strahler_order
-from streamkit.upstream_length import upstream_length
-from streamkit.mainstem import label_mainstem
-from streamkit.xs import network_cross_sections
-from streamkit.profile import sample_cross_sections
 
-# Terrain analysis
-from streamkit.smooth import gaussian_smooth_raster
-from streamkit.upstream_length import upstream_length_raster
+def __getattr__(name):
+    if name in _LAZY_IMPORTS:
+        value = getattr(import_module(_LAZY_IMPORTS[name]), name)
+    else:
+        # submodules, e.g. streamkit.xs, as when every module was imported
+        # eagerly
+        try:
+            value = import_module(f"{__name__}.{name}")
+        except ModuleNotFoundError as e:
+            if e.name != f"{__name__}.{name}":
+                raise
+            raise AttributeError(
+                f"module {__name__!r} has no attribute {name!r}"
+            ) from None
+    # cache it, so later lookups don't go through __getattr__
+    globals()[name] = value
+    return value
 
-# Reach delineation
-from streamkit.reach import delineate_reaches
 
-# Data download utilities
-from streamkit.data import (
-    get_huc_data,
-    download_huc_bounds,
-    download_flowlines,
-    download_dem,
-)
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
 
-# NHD-specific utilities
-from streamkit.nhd import rasterize_nhd
 
-__all__ = [
-    # Watershed
-    "compute_hand",
-    "flow_accumulation_workflow",
-    "delineate_subbasins",
-    # Conversion Utilities
-    "vectorize_streams",
-    "vector_streams_to_networkx",
-    "networkx_to_gdf",
-    # Network analysis
-    "strahler_order",
-    "upstream_length",
-    "label_mainstem",
-    "network_cross_sections",
-    "sample_cross_sections",
-    # Terrain
-    "upstream_length_raster",
-    "gaussian_smooth_raster",
-    # Reaches
-    "delineate_reaches",
-    # Data
-    "get_huc_data",
-    "download_huc_bounds",
-    "download_flowlines",
-    "download_dem",
-    # NHD
-    "rasterize_nhd",
-]
+class _LazyModule(types.ModuleType):
+    def __setattr__(self, name, value):
+        # importing streamkit.upstream_length or streamkit.vectorize_streams
+        # binds the submodule on the package, which would shadow the function
+        # of the same name
+        if name in _LAZY_IMPORTS and isinstance(value, types.ModuleType):
+            return
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _LazyModule
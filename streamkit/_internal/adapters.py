@@ -2,12 +2,15 @@
 
 import rioxarray as rxr
 import xarray as xr
-from pysheds.grid import Grid
-from pysheds.view import Raster, ViewFinder
 
 
 def to_pysheds(raster_xr):
     """Convert rioxarray DataArray to pysheds Grid."""
+    # pysheds compiles its numba kernels at import, so it is only imported
+    # when needed
+    from pysheds.grid import Grid
+    from pysheds.view import Raster, ViewFinder
+
     affine = raster_xr.rio.transform()
     crs = raster_xr.rio.crs
     nodata = raster_xr.rio.nodata
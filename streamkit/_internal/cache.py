@@ -0,0 +1,45 @@
+"""Helpers for memoizing expensive raster computations."""
+
+from collections import OrderedDict
+import hashlib
+
+import numpy as np
+
+
+def raster_key(raster, *extra):
+    """Content hash of a raster's values and georeferencing (plus any extra
+    parameters that affect the result)."""
+    h = hashlib.blake2b(digest_size=16)
+    data = np.ascontiguousarray(raster.data)
+    h.update(str((data.shape, data.dtype.str)).encode())
+    h.update(memoryview(data).cast("B"))
+    h.update(str(tuple(raster.rio.transform())).encode())
+    crs = raster.rio.crs
+    h.update((crs.to_wkt() if crs is not None else "").encode())
+    h.update(repr(raster.rio.nodata).encode())
+    for item in extra:
+        h.update(repr(item).encode())
+    return h.hexdigest()
+
+
+class MemoCache:
+    """Small least-recently-used in-process cache."""
+
+    def __init__(self, maxsize=2):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def get(self, key):
+        if key not in self._items:
+            return None
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
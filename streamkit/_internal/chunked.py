@@ -0,0 +1,319 @@
+"""Helpers for running flow path kernels over chunked (dask-backed) rasters.
+
+Flow paths cross chunk boundaries, so chunked kernels work in two passes. The
+first pass loads one chunk at a time and records where the paths starting in
+that chunk leave it. Those exits form a small graph between chunks, which is
+resolved in memory. The second pass is lazy: each output chunk is computed
+from its input chunks and the paths that enter it.
+"""
+
+from numba import types
+import numpy as np
+import xarray as xr
+
+from streamkit.jit import DIRMAP, FLOW_DIRECTIONS, INDICES, LENGTHS, MASK, _kernel
+
+# local exit (row, col) of paths that end inside their block. Paths leave a
+# block by one cell, so exits are never further than -1 from it.
+NO_EXIT = -2
+
+
+def is_chunked(raster: xr.DataArray) -> bool:
+    """Return True if the raster is backed by a chunked (dask) array."""
+    return raster.chunks is not None
+
+
+def align_chunks(raster: xr.DataArray, like: xr.DataArray) -> xr.DataArray:
+    """Chunk raster like the chunked raster like."""
+    return raster.chunk(dict(zip(like.dims, like.chunks)))
+
+
+def chunk_windows(chunks):
+    """Yield ((i, j), (row0, row1, col0, col1)) for every chunk of a 2D
+    array with the given chunks."""
+    row_bounds = np.cumsum((0,) + tuple(chunks[0]))
+    col_bounds = np.cumsum((0,) + tuple(chunks[1]))
+    for i in range(len(row_bounds) - 1):
+        for j in range(len(col_bounds) - 1):
+            yield (i, j), (
+                int(row_bounds[i]),
+                int(row_bounds[i + 1]),
+                int(col_bounds[j]),
+                int(col_bounds[j + 1]),
+            )
+
+
+def read_window(arr, window, halo=0):
+    """Load a window of a (dask) array, padded by up to halo cells on every
+    side that is not on the edge of the array.
+
+    Returns:
+        (block, top, left): the loaded block and the number of halo rows and
+        columns before the window.
+    """
+    row0, row1, col0, col1 = window
+    nrows, ncols = arr.shape
+    top = min(halo, row0)
+    left = min(halo, col0)
+    bottom = min(halo, nrows - row1)
+    right = min(halo, ncols - col1)
+    block = np.asarray(arr[row0 - top : row1 + bottom, col0 - left : col1 + right])
+    return block, top, left
+
+
+def chunk_index(rows, cols, chunks):
+    """Return the (i, j) chunk indices of global cells."""
+    row_bounds = np.cumsum(tuple(chunks[0]))
+    col_bounds = np.cumsum(tuple(chunks[1]))
+    return (
+        np.searchsorted(row_bounds, rows, side="right"),
+        np.searchsorted(col_bounds, cols, side="right"),
+    )
+
+
+def group_by_chunk(rows, cols, chunks):
+    """Group global cells by chunk.
+
+    Returns:
+        Dictionary of (i, j) chunk index to (rows, cols) arrays of the cells
+        in that chunk, in their original order.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    ci, cj = chunk_index(rows, cols, chunks)
+    groups = {}
+    for key in set(zip(ci.tolist(), cj.tolist())):
+        mask = (ci == key[0]) & (cj == key[1])
+        groups[key] = (rows[mask], cols[mask])
+    return groups
+
+
+def perimeter_cells(nrows, ncols):
+    """Return the (rows, cols) of the cells on the edge of a block."""
+    edge = np.zeros((nrows, ncols), dtype=bool)
+    edge[0, :] = edge[-1, :] = True
+    edge[:, 0] = edge[:, -1] = True
+    rows, cols = np.nonzero(edge)
+    return rows.astype(np.int64), cols.astype(np.int64)
+
+
+def cell_ids(rows, cols, shape):
+    """Return global cell ids (row-major flat indices), with -1 for cells
+    outside of the array."""
+    nrows, ncols = shape
+    inside = (rows >= 0) & (rows < nrows) & (cols >= 0) & (cols < ncols)
+    return np.where(inside, rows * ncols + cols, -1)
+
+
+def exit_ids(exit_rows, exit_cols, window, shape):
+    """Return the global cell ids of the local exits of a block, with -1 for
+    paths that end inside it (NO_EXIT) or leave the array."""
+    row0, _, col0, _ = window
+    ids = cell_ids(exit_rows + row0, exit_cols + col0, shape)
+    ids[exit_rows == NO_EXIT] = -1
+    return ids
+
+
+@_kernel((FLOW_DIRECTIONS, MASK, INDICES, INDICES, DIRMAP, types.boolean))
+def _walk_to_exit_numba(flow_directions_arr, stream_mask, rows, cols, dirmap, streams):
+    """Follow the flow path from each start cell until it leaves the block.
+
+    If streams is True, paths also stop before entering a cell that is not
+    in stream_mask (which is not read otherwise).
+    Returns the local (row, col) of the first cell outside of the block
+    (NO_EXIT if the path ends inside it) and the length of the path in cells.
+    """
+    nrows, ncols = flow_directions_arr.shape
+    n = len(rows)
+    exit_rows = np.full(n, NO_EXIT, dtype=np.int64)
+    exit_cols = np.full(n, NO_EXIT, dtype=np.int64)
+    lengths = np.zeros(n, dtype=np.float64)
+
+    for k in range(n):
+        row, col = rows[k], cols[k]
+        length = 0.0
+        # a valid D8 path visits every cell at most once
+        for _ in range(nrows * ncols):
+            current_direction = flow_directions_arr[row, col]
+            drow = dirmap[current_direction, 0]
+            dcol = dirmap[current_direction, 1]
+            if drow == 0 and dcol == 0:
+                break
+
+            next_row = row + drow
+            next_col = col + dcol
+            length += np.sqrt(drow**2 + dcol**2)
+
+            if not (0 <= next_row < nrows and 0 <= next_col < ncols):
+                exit_rows[k] = next_row
+                exit_cols[k] = next_col
+                break
+
+            if streams and not stream_mask[next_row, next_col]:
+                break
+
+            row, col = next_row, next_col
+        lengths[k] = length
+
+    return exit_rows, exit_cols, lengths
+
+
+@_kernel((MASK, FLOW_DIRECTIONS, DIRMAP) + (types.int64,) * 4)
+def _block_nodes_numba(
+    stream_mask, flow_directions_arr, dirmap, top, left, nrows, ncols
+):
+    """Find the stream nodes of the block [top:top + nrows, left:left + ncols]
+    of a haloed block.
+
+    Returns (rows, cols, kinds) in block coordinates, row-major, where kind
+    is 0 for sources, 1 for confluences, 2 for outlets, and 3 for entries
+    (cells with exactly one inflow, which comes from outside the block).
+    """
+    hrows, hcols = flow_directions_arr.shape
+    inflow_count = np.zeros((nrows, ncols), dtype=np.uint8)
+    outside_inflow = np.zeros((nrows, ncols), dtype=np.uint8)
+
+    for row in range(hrows):
+        for col in range(hcols):
+            if not stream_mask[row, col]:
+                continue
+
+            current_direction = flow_directions_arr[row, col]
+            drow = dirmap[current_direction, 0]
+            dcol = dirmap[current_direction, 1]
+            if drow == 0 and dcol == 0:
+                continue
+
+            next_row = row + drow - top
+            next_col = col + dcol - left
+            if not (0 <= next_row < nrows and 0 <= next_col < ncols):
+                continue
+            if not stream_mask[next_row + top, next_col + left]:
+                continue
+
+            inflow_count[next_row, next_col] += 1
+            inside = top <= row < top + nrows and left <= col < left + ncols
+            if not inside:
+                outside_inflow[next_row, next_col] += 1
+
+    node_rows = []
+    node_cols = []
+    kinds = []
+    for row in range(nrows):
+        for col in range(ncols):
+            if not stream_mask[row + top, col + left]:
+                continue
+
+            if inflow_count[row, col] == 0:
+                kind = 0
+            elif inflow_count[row, col] > 1:
+                kind = 1
+            elif outside_inflow[row, col] == 1:
+                kind = 3
+            else:
+                kind = -1
+            if kind >= 0:
+                node_rows.append(row)
+                node_cols.append(col)
+                kinds.append(kind)
+
+            current_direction = flow_directions_arr[row + top, col + left]
+            if dirmap[current_direction, 0] == 0 and dirmap[current_direction, 1] == 0:
+                node_rows.append(row)
+                node_cols.append(col)
+                kinds.append(2)
+
+    return np.array(node_rows), np.array(node_cols), np.array(kinds)
+
+
+def stream_nodes(stream_raster, flow_directions, dirmap):
+    """Find the stream nodes of chunked rasters, one chunk at a time.
+
+    Returns:
+        Tuple of per chunk node tables and global (rows, cols) arrays of
+        sources, confluences, and outlets in row-major order. The per chunk
+        tables map the chunk index to the window and the local (rows, cols,
+        kinds) of its nodes, see _block_nodes_numba.
+    """
+    streams = stream_raster.data
+    fdir = flow_directions.data
+    tables = {}
+    found = {0: [], 1: [], 2: []}
+    for index, window in chunk_windows(fdir.chunks):
+        row0, row1, col0, col1 = window
+        stream_block, top, left = read_window(streams, window, halo=1)
+        fdir_block, _, _ = read_window(fdir, window, halo=1)
+        rows, cols, kinds = _block_nodes_numba(
+            stream_block != 0, fdir_block, dirmap, top, left, row1 - row0, col1 - col0
+        )
+        tables[index] = (window, rows, cols, kinds)
+        for kind in found:
+            mask = kinds == kind
+            found[kind].append(
+                cell_ids(rows[mask] + row0, cols[mask] + col0, fdir.shape)
+            )
+
+    ncols = fdir.shape[1]
+    nodes = []
+    for kind in (0, 1, 2):
+        ids = np.sort(np.concatenate(found[kind])) if found[kind] else np.array([])
+        ids = ids.astype(np.int64)
+        nodes.append((ids // ncols, ids % ncols))
+    return tables, nodes[0], nodes[1], nodes[2]
+
+
+@_kernel((INDICES, INDICES, INDICES))
+def _follow_exits_numba(keys, exits, starts):
+    """Mark every key reached by following exits from the start ids.
+
+    keys must be sorted; exits[k] is the id reached from keys[k] (or -1).
+    """
+    reached = np.zeros(len(keys), dtype=np.bool_)
+    for start in starts:
+        cell = start
+        while cell >= 0:
+            k = np.searchsorted(keys, cell)
+            if k >= len(keys) or keys[k] != cell or reached[k]:
+                break
+            reached[k] = True
+            cell = exits[k]
+    return reached
+
+
+@_kernel((INDICES, INDICES, LENGTHS, INDICES, LENGTHS))
+def _longest_paths_numba(keys, exits, lengths, start_exits, start_lengths):
+    """Longest path from any start to every key, following exits.
+
+    keys must be sorted; exits[k] is the id reached from keys[k] (or -1)
+    after a path of lengths[k]. Paths start with start_lengths at the ids in
+    start_exits. Keys that are not reached are -inf. The keys and exits must
+    form a directed acyclic graph, as D8 flow paths do.
+    """
+    n = len(keys)
+    targets = np.full(n, -1, dtype=np.int64)
+    indegree = np.zeros(n, dtype=np.int64)
+    for k in range(n):
+        t = np.searchsorted(keys, exits[k])
+        if exits[k] >= 0 and t < n and keys[t] == exits[k]:
+            targets[k] = t
+            indegree[t] += 1
+
+    distance = np.full(n, -np.inf)
+    for s in range(len(start_exits)):
+        t = np.searchsorted(keys, start_exits[s])
+        if start_exits[s] >= 0 and t < n and keys[t] == start_exits[s]:
+            distance[t] = max(distance[t], start_lengths[s])
+
+    # Kahn's algorithm, relaxing each key once all of its inflows are known
+    queue = [k for k in range(n) if indegree[k] == 0]
+    while queue:
+        k = queue.pop()
+        t = targets[k]
+        if t < 0:
+            continue
+        if distance[k] > -np.inf:
+            distance[t] = max(distance[t], distance[k] + lengths[k])
+        indegree[t] -= 1
+        if indegree[t] == 0:
+            queue.append(t)
+    return distance
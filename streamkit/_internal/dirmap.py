@@ -1,8 +1,12 @@
-from numba.typed import Dict
-from numba import types
+import numpy as np
 
 
-def _make_numba_esri_dirmap():
+def _make_esri_dirmap():
+    """Lookup table of (row, col) offsets indexed by uint8 ESRI D8 code.
+
+    Code 0, and any value that is not a D8 code, maps to (0, 0): the cell
+    has no downstream neighbour (pit, outlet, or nodata).
+    """
     # ESRI direction mapping
     dirmap = {
         64: (-1, 0),  # North
@@ -13,17 +17,10 @@ def _make_numba_esri_dirmap():
         8: (1, -1),  # Southwest
         16: (0, -1),  # West
         32: (-1, -1),  # Northwest
-        -1: (0, 0),  # outlet/terminal
-        -2: (0, 0),
-        0: (0, 0),
     }
 
-    # Create Numba-typed dictionary
-    dirmap_numba = Dict.empty(
-        key_type=types.int64, value_type=types.UniTuple(types.int64, 2)
-    )
-
+    dirmap_arr = np.zeros((256, 2), dtype=np.int64)
     for k, v in dirmap.items():
-        dirmap_numba[k] = v
+        dirmap_arr[k] = v
 
-    return dirmap_numba
+    return dirmap_arr
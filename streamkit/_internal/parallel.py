@@ -0,0 +1,15 @@
+"""Helpers for running work across processes."""
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+
+def process_pool(max_workers=None):
+    """Create a process pool whose workers are fresh interpreters.
+
+    Forking a process after numba's threading layer has started (pysheds
+    starts it at import) can deadlock, so workers are spawned instead.
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    )
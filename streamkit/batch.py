@@ -0,0 +1,195 @@
+"""
+Run the stream network pipeline for many basins across processes.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import inspect
+import os
+import traceback
+from typing import Iterable, Optional, Sequence, Tuple
+
+import rasterio
+import rioxarray as rxr
+from shapely.geometry import box
+
+from streamkit._internal.parallel import process_pool
+from streamkit.data import download_huc_bounds
+from streamkit.datacache import DataCache
+from streamkit.jit import warmup
+from streamkit.pipeline import dem_pipeline, huc_pipeline
+
+# concurrent boundary downloads when estimating the size of HUC basins
+_MAX_BOUNDARY_REQUESTS = 8
+
+
+def run_basins(
+    basins: Iterable[str],
+    workdir: str,
+    max_workers: Optional[int] = None,
+    max_cells: Optional[int] = None,
+    targets: Optional[Sequence[str]] = None,
+    cache: Optional[DataCache] = None,
+    **pipeline_kwargs,
+) -> Tuple[dict, dict]:
+    """Run the stream network pipeline for many basins in parallel.
+
+    Each basin is either a HUC ID, processed with huc_pipeline, or the path
+    of a DEM file, processed with dem_pipeline. Basins run in separate
+    processes, each with its own pipeline workdir under workdir, so finished
+    stages are reused when run_basins is called again.
+
+    Basins are started largest first. The size of a HUC basin is estimated
+    from the area of its boundary, downloaded beforehand. When max_cells is
+    given, a basin is only started while the total number of DEM cells of
+    the running basins stays below max_cells, which bounds peak memory
+    independently of max_workers. A basin larger than max_cells still runs,
+    on its own.
+
+    Rasters are not sent back to the calling process. Every stage output is
+    written to disk by the workers; rasters are stored as .npy files that
+    read_raster memory-maps without copying.
+
+    Args:
+        basins: HUC IDs and/or DEM file paths.
+        workdir: Directory where the outputs of every basin are stored.
+        max_workers: Maximum number of basins processed at the same time.
+            Defaults to the number of CPUs.
+        max_cells: Maximum total number of DEM cells processed at the same
+            time. If None, only max_workers limits concurrency.
+        targets: Names of the pipeline artifacts to return. If None, all
+            artifacts are returned.
+        cache: An optional DataCache for the HUC downloads. It is also used
+            to look up HUC boundaries when estimating their size.
+        **pipeline_kwargs: Keyword arguments of huc_pipeline and
+            dem_pipeline. Each pipeline only receives the ones it accepts,
+            so e.g. dem_resolution only applies to HUC basins and
+            min_accumulation only to DEM basins.
+    Returns:
+        (outputs, failures): outputs maps each basin that succeeded to a
+        dictionary of artifact name to file path; failures maps each basin
+        that failed to its formatted traceback.
+    Raises:
+        TypeError: If a keyword argument is accepted by neither pipeline.
+    """
+    accepted = _PIPELINE_PARAMS["huc"] | _PIPELINE_PARAMS["dem"]
+    unknown = set(pipeline_kwargs) - accepted
+    if unknown:
+        raise TypeError(
+            f"Unknown pipeline arguments {sorted(unknown)}, "
+            f"expected some of {sorted(accepted)}"
+        )
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    outputs = {}
+    failures = {}
+    # HUC sizes come from their boundaries, downloaded concurrently
+    queue = []
+    with ThreadPoolExecutor(max_workers=_MAX_BOUNDARY_REQUESTS) as estimator:
+        estimates = []
+        for basin in basins:
+            basin = str(basin)
+            kind = "dem" if os.path.isfile(basin) else "huc"
+            future = estimator.submit(
+                _estimate_cells, basin, kind, cache, pipeline_kwargs
+            )
+            estimates.append((future, basin, kind))
+        for future, basin, kind in estimates:
+            try:
+                cells = future.result()
+            except Exception:
+                failures[basin] = traceback.format_exc()
+                continue
+            queue.append((cells, basin, kind))
+    queue.sort(key=lambda item: item[0], reverse=True)
+
+    # fill the on-disk kernel cache once, so workers load the kernels
+    # instead of each compiling them
+    warmup()
+    with process_pool(max_workers) as executor:
+        running = {}
+
+        def admit():
+            while queue and len(running) < max_workers:
+                used = sum(cells for cells, _ in running.values())
+                for i, (cells, basin, kind) in enumerate(queue):
+                    if not running or max_cells is None or used + cells <= max_cells:
+                        break
+                else:
+                    return
+                cells, basin, kind = queue.pop(i)
+                basin_workdir = os.path.join(workdir, _basin_dirname(basin, kind))
+                future = executor.submit(
+                    _run_basin,
+                    basin,
+                    kind,
+                    basin_workdir,
+                    targets,
+                    cache,
+                    pipeline_kwargs,
+                )
+                running[future] = (cells, basin)
+
+        admit()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                _, basin = running.pop(future)
+                try:
+                    outputs[basin] = future.result()
+                except Exception:
+                    failures[basin] = traceback.format_exc()
+            admit()
+
+    return outputs, failures
+
+
+def _pipeline_params(builder):
+    return set(inspect.signature(builder).parameters) - {"workdir", "cache"}
+
+
+# keyword arguments run_basins passes on to the pipeline of each kind of basin
+_PIPELINE_PARAMS = {
+    "huc": _pipeline_params(huc_pipeline),
+    "dem": _pipeline_params(dem_pipeline),
+}
+
+
+def _run_basin(basin, kind, workdir, targets, cache, pipeline_kwargs):
+    pipeline_kwargs = {
+        name: value
+        for name, value in pipeline_kwargs.items()
+        if name in _PIPELINE_PARAMS[kind]
+    }
+    if kind == "dem":
+        pipeline = dem_pipeline(workdir, **pipeline_kwargs)
+        dem = rxr.open_rasterio(basin, masked=True).squeeze().load()
+        pipeline.run(targets=[], dem=dem)
+    else:
+        pipeline = huc_pipeline(workdir, cache=cache, **pipeline_kwargs)
+        pipeline.run(targets=[], hucid=basin)
+
+    paths = dict(pipeline.paths)
+    if kind == "dem":
+        paths["dem"] = basin
+    if targets is None:
+        return paths
+    return {name: paths[name] for name in targets}
+
+
+def _estimate_cells(basin, kind, cache, pipeline_kwargs):
+    if kind == "dem":
+        with rasterio.open(basin) as src:
+            return src.width * src.height
+    resolution = pipeline_kwargs.get("dem_resolution", 10)
+    boundary = download_huc_bounds(basin, cache=cache).to_crs("EPSG:4326")
+    # equal area projection centered on the basin, wherever it is
+    lon, lat = box(*boundary.total_bounds).centroid.coords[0]
+    area = boundary.to_crs(f"+proj=laea +lat_0={lat} +lon_0={lon} +datum=WGS84")
+    return int(area.area.sum() / resolution**2)
+
+
+def _basin_dirname(basin, kind):
+    if kind == "dem":
+        return os.path.splitext(os.path.basename(basin))[0]
+    return f"huc{basin}"
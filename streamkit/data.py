@@ -2,24 +2,48 @@
 Code for downloading wbd boundaries, flowlines, and dems, for a given HUC ID from usgs using pygeohydro methods.
 """
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import contextlib
+import hashlib
+import math
+import os
+import tempfile
+import threading
+import time
+import warnings
+
+import numpy as np
 import rasterio
-import py3dep
-from pygeohydro import WBD
-from pynhd import NHD
-import pandas as pd
-from rioxarray.merge import merge_arrays
-from typing import Optional, Tuple
+from rasterio.merge import merge
+import pyproj
+import rioxarray as rxr
+from shapely.geometry import box
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, Tuple
 import xarray as xr
 import geopandas as gpd
 
+from streamkit.datacache import DataCache
+
+if TYPE_CHECKING:
+    # the HyRiver clients are slow to import, so they are only imported when
+    # a download is made
+    from pygeohydro import WBD
+    from pynhd import NHD
+
+# used to convert the requested resolution to degrees for geographic crs
+_METERS_PER_DEGREE = 111_320
+
 
 def get_huc_data(
     hucid: str,
     nhd_layer: str = "flowline_mr",
     crs: str = "EPSG:4326",
     dem_resolution: int = 10,
-    wbd: Optional[WBD] = None,
-    nhd: Optional[NHD] = None,
+    wbd: Optional["WBD"] = None,
+    nhd: Optional["NHD"] = None,
+    cache: Optional[DataCache] = None,
+    dem_client=None,
+    request_limit: Optional[threading.Semaphore] = None,
 ) -> Tuple[gpd.GeoDataFrame, xr.DataArray]:
     """Download hydrological and topographic data for a given HUC ID.
 
@@ -33,109 +57,355 @@ def get_huc_data(
         crs: The coordinate reference system for the output data as an EPSG code
             or other CRS string. Defaults to "EPSG:4326" (WGS84).
         dem_resolution: The spatial resolution of the DEM in meters. Defaults to 10.
-        wbd: An existing Watershed Boundary Dataset object. If None, a new WBD
-            instance will be created.
-        nhd: An existing National Hydrography Dataset object. If None, a new NHD
-            instance will be created.
+        wbd: An existing Watershed Boundary Dataset object. If None, a WBD
+            instance for the HUC level, shared by the calls made from the same
+            thread, is used.
+        nhd: An existing National Hydrography Dataset object. If None, an NHD
+            instance for the layer, shared by the calls made from the same
+            thread, is used.
+        cache: An optional DataCache. Boundaries, flowlines, and the DEM are
+            read from the cache when present and stored in it after download.
+        dem_client: Module or object providing static_3dep_dem. Defaults to
+            py3dep.
+        request_limit: An optional semaphore held during every DEM tile
+            request, to share a limit on concurrent requests between calls.
 
     Returns:
         (flowlines gdf, dem raster):
     """
 
-    huc_bounds = download_huc_bounds(hucid, wbd)
-    flowlines = download_flowlines(huc_bounds, nhd, nhd_layer, True, crs)
-    dem = download_dem(huc_bounds, dem_resolution, crs)
+    huc_bounds = download_huc_bounds(hucid, wbd, cache=cache)
+    flowlines = download_flowlines(huc_bounds, nhd, nhd_layer, True, crs, cache=cache)
+    dem = download_dem(
+        huc_bounds,
+        dem_resolution,
+        crs,
+        cache=cache,
+        client=dem_client,
+        request_limit=request_limit,
+    )
 
     return flowlines, dem
 
 
-def download_huc_bounds(huc, wbd=None):
+def iter_huc_data(
+    hucids: Iterable[str],
+    nhd_layer: str = "flowline_mr",
+    crs: str = "EPSG:4326",
+    dem_resolution: int = 10,
+    max_workers: int = 4,
+    cache: Optional[DataCache] = None,
+    dem_client=None,
+    errors: str = "raise",
+    max_requests: int = 8,
+) -> Iterator[Tuple[str, gpd.GeoDataFrame, xr.DataArray]]:
+    """Download flowlines and DEMs for many HUC IDs concurrently.
+
+    HUCs are fetched on a pool of threads, each with its own WBD and NHD
+    clients (the HyRiver clients are not known to be thread-safe). Results are
+    yielded as soon as each HUC completes, so processing one HUC can overlap
+    with downloading the next. At most max_workers HUCs are in flight, which
+    also bounds how many downloaded results wait in memory to be consumed.
+    The DEM of each HUC is downloaded in tiles, and at most max_requests tile
+    requests are made at the same time across all HUCs.
+
+    Args:
+        hucids: The Hydrologic Unit Code identifiers to download.
+        nhd_layer: The National Hydrography Dataset layer name for flowlines.
+        crs: The coordinate reference system for the output data.
+        dem_resolution: The spatial resolution of the DEM in meters.
+        max_workers: Maximum number of HUCs downloaded at the same time.
+        cache: An optional DataCache shared by all downloads.
+        dem_client: Module or object providing static_3dep_dem. Defaults to
+            py3dep.
+        errors: "raise" to stop at the first failed HUC, or "warn" to emit a
+            warning and continue with the remaining HUCs.
+        max_requests: Maximum number of 3DEP DEM tile requests made at the
+            same time, across all HUCs.
+
+    Yields:
+        (hucid, flowlines gdf, dem raster) in order of completion.
+    """
+    if errors not in ("raise", "warn"):
+        raise ValueError("errors must be 'raise' or 'warn'")
+
+    hucids = iter(hucids)
+    request_limit = threading.BoundedSemaphore(max_requests)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+
+        def submit_next():
+            hucid = next(hucids, None)
+            if hucid is not None:
+                future = executor.submit(
+                    get_huc_data,
+                    hucid,
+                    nhd_layer,
+                    crs,
+                    dem_resolution,
+                    cache=cache,
+                    dem_client=dem_client,
+                    request_limit=request_limit,
+                )
+                pending[future] = hucid
+
+        for _ in range(max_workers):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                hucid = pending.pop(future)
+                submit_next()
+                try:
+                    flowlines, dem = future.result()
+                except Exception as e:
+                    if errors == "raise":
+                        raise
+                    warnings.warn(f"Failed to download HUC {hucid}, skipping: {e}")
+                    continue
+                yield hucid, flowlines, dem
+
+
+# the HyRiver clients are not known to be thread-safe, so every thread
+# creates and reuses its own
+_thread_clients = threading.local()
+
+
+def _wbd_client(level):
+    clients = _thread_clients.__dict__.setdefault("wbd", {})
+    if level not in clients:
+        from pygeohydro import WBD
+
+        clients[level] = WBD(level)
+    return clients[level]
+
+
+def _nhd_client(layer):
+    clients = _thread_clients.__dict__.setdefault("nhd", {})
+    if layer not in clients:
+        from pynhd import NHD
+
+        clients[layer] = NHD(layer)
+    return clients[layer]
+
+
+def download_huc_bounds(huc, wbd=None, cache=None):
     huc = str(huc)
     level = f"huc{str(len(huc))}"
 
-    if wbd is None:
-        wbd = WBD(level)
+    def download():
+        client = wbd if wbd is not None else _wbd_client(level)
+        return client.byids(level, huc)
 
-    huc_wbd = wbd.byids(level, huc)
-    return huc_wbd
+    if cache is None:
+        return download()
+    return cache.fetch("huc_bounds", {"huc": huc}, download)
 
 
 def download_flowlines(
-    gdf, nhd=None, layer="flowline_mr", linestring_only=True, crs="EPSG:4326"
+    gdf,
+    nhd=None,
+    layer="flowline_mr",
+    linestring_only=True,
+    crs="EPSG:4326",
+    cache=None,
 ):
-    if nhd is None:
-        nhd = NHD(layer)
+    def download():
+        client = nhd if nhd is not None else _nhd_client(layer)
 
-    boundary = gdf.union_all()
-    flowlines = nhd.bygeom(boundary)
-    flowlines = flowlines.clip(boundary)
-    flowlines = flowlines.explode()
+        boundary = gdf.union_all()
+        flowlines = client.bygeom(boundary)
+        flowlines = flowlines.clip(boundary)
+        flowlines = flowlines.explode()
+
+        if linestring_only:
+            flowlines = flowlines[flowlines.geometry.type == "LineString"]
+
+        flowlines = flowlines.to_crs(crs)
+        return flowlines
+
+    if cache is None:
+        return download()
+    params = {
+        **_boundary_key(gdf),
+        "layer": layer,
+        "linestring_only": linestring_only,
+        "crs": str(crs),
+    }
+    return cache.fetch("flowlines", params, download)
+
+
+def download_dem(
+    gdf,
+    resolution,
+    crs="EPSG:4326",
+    cache=None,
+    client=None,
+    max_workers=4,
+    tile_size=2048,
+    min_tile_size=256,
+    retries=3,
+    request_limit=None,
+):
+    """Download a 3DEP DEM covering the geometries in gdf.
+
+    The bounding box of the boundary is split up front into tiles of at most
+    tile_size x tile_size pixels at the requested resolution. Tiles that
+    intersect the boundary are fetched concurrently, each retried with
+    exponential backoff; a tile that still fails is split into four smaller
+    tiles (down to min_tile_size). Fetched tiles are written to disk and
+    mosaicked there, so they are never all held in memory at once. A
+    boundary without area (e.g. lines or points) raises a ValueError.
+
+    At most max_workers tiles are requested at the same time. request_limit
+    is an optional semaphore held during every tile request, to also limit
+    the requests of concurrent downloads together (see iter_huc_data).
+    """
+    if client is None:
+        import py3dep
+
+        client = py3dep
+
+    def download():
+        boundary = gdf.union_all()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tiles = _download_dem_tiles(
+                boundary,
+                gdf.crs,
+                resolution,
+                client,
+                tmpdir,
+                max_workers=max_workers,
+                tile_size=tile_size,
+                min_tile_size=min_tile_size,
+                retries=retries,
+                request_limit=request_limit,
+            )
+            mosaic_path = os.path.join(tmpdir, "mosaic.tif")
+            merge(tiles, dst_path=mosaic_path)
+            dem = rxr.open_rasterio(mosaic_path, masked=True).squeeze()
+            dem = dem.rio.clip([boundary], crs=gdf.crs, drop=True).load()
 
-    if linestring_only:
-        flowlines = flowlines[flowlines.geometry.type == "LineString"]
+        if dem.rio.crs != crs:
+            dem = dem.rio.reproject(crs, resampling=rasterio.enums.Resampling.bilinear)
+        return dem
 
-    flowlines = flowlines.to_crs(crs)
-    return flowlines
+    if cache is None:
+        return download()
+    params = {**_boundary_key(gdf), "resolution": resolution, "crs": str(crs)}
+    return cache.fetch("dem", params, download)
 
 
-def download_dem(gdf, resolution, crs="EPSG:4326"):
+def _boundary_key(gdf):
+    # identify a download area by the content of its boundary geometry
     boundary = gdf.union_all()
-    try:
-        dem = py3dep.static_3dep_dem(boundary, resolution=resolution, crs=gdf.crs)
-    except:
-        dem = retry_on_smaller(boundary)
-
-    if dem.rio.crs != crs:
-        dem = dem.rio.reproject(crs, resampling=rasterio.enums.Resampling.bilinear)
-    return dem
-
-
-def retry_on_smaller(boundary):
-    bbox = pd.DataFrame(
-        {
-            "minx": [boundary.bounds[0]],
-            "miny": [boundary.bounds[1]],
-            "maxx": [boundary.bounds[2]],
-            "maxy": [boundary.bounds[3]],
-        }
-    )
-    bbox["mid_x"] = (bbox["minx"] + bbox["maxx"]) / 2
-    bbox["mid_y"] = (bbox["miny"] + bbox["maxy"]) / 2
-
-    # Create four smaller bounding boxes
-    split_bboxes = pd.DataFrame(
-        [
-            {
-                "minx": bbox.iloc[0]["minx"],
-                "miny": bbox.iloc[0]["miny"],
-                "maxx": bbox.iloc[0]["mid_x"],
-                "maxy": bbox.iloc[0]["mid_y"],
-            },  # Bottom-left
-            {
-                "minx": bbox.iloc[0]["mid_x"],
-                "miny": bbox.iloc[0]["miny"],
-                "maxx": bbox.iloc[0]["maxx"],
-                "maxy": bbox.iloc[0]["mid_y"],
-            },  # Bottom-right
-            {
-                "minx": bbox.iloc[0]["minx"],
-                "miny": bbox.iloc[0]["mid_y"],
-                "maxx": bbox.iloc[0]["mid_x"],
-                "maxy": bbox.iloc[0]["maxy"],
-            },  # Top-left
-            {
-                "minx": bbox.iloc[0]["mid_x"],
-                "miny": bbox.iloc[0]["mid_y"],
-                "maxx": bbox.iloc[0]["maxx"],
-                "maxy": bbox.iloc[0]["maxy"],
-            },  # Top-right
-        ]
-    )
+    return {
+        "boundary": hashlib.sha256(boundary.wkb).hexdigest(),
+        "boundary_crs": gdf.crs.to_string() if gdf.crs is not None else None,
+    }
+
+
+def _download_dem_tiles(
+    boundary,
+    boundary_crs,
+    resolution,
+    client,
+    tmpdir,
+    max_workers,
+    tile_size,
+    min_tile_size,
+    retries,
+    request_limit=None,
+):
+    """Fetch the DEM tiles covering boundary, returning the paths of the tile
+    GeoTIFFs written to tmpdir."""
+    # tile extent in the units of the boundary crs
+    pixel_size = resolution
+    if boundary_crs is not None and pyproj.CRS(boundary_crs).is_geographic:
+        pixel_size = resolution / _METERS_PER_DEGREE
+    tiles = _tile_bounds(boundary, tile_size * pixel_size)
+    if not tiles:
+        raise ValueError("The boundary has no area, there are no DEM tiles to download")
+
+    if request_limit is None:
+        request_limit = contextlib.nullcontext()
+
+    def fetch(bounds, path):
+        for attempt in range(retries):
+            try:
+                with request_limit:
+                    dem = client.static_3dep_dem(
+                        box(*bounds), resolution=resolution, crs=boundary_crs
+                    )
+                dem.rio.to_raster(path)
+                return path
+            except Exception:
+                if attempt == retries - 1:
+                    raise
+                time.sleep(2**attempt)
+
+    paths = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        for bounds in tiles:
+            path = os.path.join(tmpdir, f"tile_{len(pending)}.tif")
+            pending[executor.submit(fetch, bounds, path)] = (bounds, path)
+        n_submitted = len(pending)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                bounds, path = pending.pop(future)
+                try:
+                    paths.append(future.result())
+                    continue
+                except Exception:
+                    minx, miny, maxx, maxy = bounds
+                    if max(maxx - minx, maxy - miny) / 2 < min_tile_size * pixel_size:
+                        raise
+                # split the failing tile into quarters and try those instead
+                for sub_bounds in _quadrants(bounds):
+                    if not _overlaps(boundary, sub_bounds):
+                        continue
+                    path = os.path.join(tmpdir, f"tile_{n_submitted}.tif")
+                    pending[executor.submit(fetch, sub_bounds, path)] = (
+                        sub_bounds,
+                        path,
+                    )
+                    n_submitted += 1
+    return paths
+
+
+def _tile_bounds(boundary, tile_extent):
+    """Split the bounding box of boundary into square tiles of at most
+    tile_extent, keeping only those that overlap the boundary."""
+    minx, miny, maxx, maxy = boundary.bounds
+    nx = max(1, math.ceil((maxx - minx) / tile_extent))
+    ny = max(1, math.ceil((maxy - miny) / tile_extent))
+    xs = np.linspace(minx, maxx, nx + 1)
+    ys = np.linspace(miny, maxy, ny + 1)
+    tiles = []
+    for i in range(nx):
+        for j in range(ny):
+            bounds = (xs[i], ys[j], xs[i + 1], ys[j + 1])
+            if _overlaps(boundary, bounds):
+                tiles.append(bounds)
+    return tiles
+
+
+def _quadrants(bounds):
+    minx, miny, maxx, maxy = bounds
+    midx, midy = (minx + maxx) / 2, (miny + maxy) / 2
+    return [
+        (minx, miny, midx, midy),
+        (midx, miny, maxx, midy),
+        (minx, midy, midx, maxy),
+        (midx, midy, maxx, maxy),
+    ]
 
-    dems = []
-    for _, box in split_bboxes.iterrows():
-        dems.append(py3dep.get_dem(tuple(box), crs="EPSG:4326", resolution=10))
 
-    mosaic = merge_arrays(dems)
-    clipped = mosaic.rio.clip(boundary)
-    return clipped
+def _overlaps(boundary, bounds):
+    # tiles that only touch the boundary along an edge or at a point have
+    # nothing to download
+    return boundary.intersection(box(*bounds)).area > 0
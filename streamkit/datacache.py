@@ -0,0 +1,167 @@
+"""
+On-disk cache for downloaded HUC boundaries, flowlines, and DEMs.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Callable, Optional
+
+import geopandas as gpd
+import rioxarray as rxr
+import xarray as xr
+
+_SUFFIXES = {"vector": ".parquet", "raster": ".tif"}
+
+
+class DataCache:
+    """Content-addressed local cache for the data download utilities.
+
+    Entries are keyed on a hash of everything that determines the download
+    (e.g. HUC ID, layer, resolution, CRS, geometry). Boundaries and flowlines
+    are stored as GeoParquet, DEMs as tiled Cloud Optimized GeoTIFFs. When the
+    total size exceeds max_size, the least recently used entries are evicted,
+    except the entry just stored, so a single entry larger than max_size is
+    kept until the next one is stored.
+
+    A cache can be shared by threads (e.g. the workers of iter_huc_data), and
+    its directory by processes.
+
+    Args:
+        directory: Directory where cached entries are stored.
+        max_size: Maximum total size of the cache in bytes. If None, entries
+            are never evicted.
+        offline: If True, never download; requesting data that is not in the
+            cache raises a LookupError.
+    """
+
+    def __init__(
+        self, directory: str, max_size: Optional[int] = None, offline: bool = False
+    ):
+        self.directory = directory
+        self.max_size = max_size
+        self.offline = offline
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        # sent to worker processes without the lock
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return (
+            f"DataCache({self.directory!r}, max_size={self.max_size}, "
+            f"offline={self.offline})"
+        )
+
+    def key(self, kind: str, **params) -> str:
+        """Return the cache key for a kind of data and its parameters."""
+        payload = json.dumps({"kind": kind, **params}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def fetch(self, kind: str, params: dict, download: Callable):
+        """Return the cached entry for kind/params, calling download() and
+        storing the result on a miss."""
+        key = self.key(kind, **params)
+        value = self.load(key)
+        if value is not None:
+            return value
+        if self.offline:
+            raise LookupError(
+                f"{kind} {params} is not in the cache and offline mode is enabled"
+            )
+        value = download()
+        self.store(key, value)
+        return value
+
+    def load(self, key: str):
+        """Return the entry stored under key, or None if there is none."""
+        for path in self._paths(key):
+            if os.path.exists(path):
+                # touch the entry so eviction is least recently used
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    # evicted in the meantime
+                    return None
+                if path.endswith(_SUFFIXES["vector"]):
+                    return gpd.read_parquet(path)
+                return rxr.open_rasterio(path, masked=True).squeeze()
+        return None
+
+    def store(self, key: str, value):
+        """Write value to the cache under key."""
+        if isinstance(value, gpd.GeoDataFrame):
+            path = self._path(key, "vector")
+        elif isinstance(value, xr.DataArray):
+            path = self._path(key, "raster")
+        else:
+            raise TypeError(f"Cannot cache values of type {type(value).__name__}")
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename so an interrupted download never leaves a partial
+        # entry behind. The temporary name is unique to the thread, in case
+        # several store the same entry.
+        tmp_path = os.path.join(
+            os.path.dirname(path),
+            f".{os.getpid()}-{threading.get_ident()}-{os.path.basename(path)}",
+        )
+        if isinstance(value, gpd.GeoDataFrame):
+            value.to_parquet(tmp_path)
+        else:
+            value.rio.to_raster(tmp_path, driver="COG")
+        with self._lock:
+            os.replace(tmp_path, path)
+            self._evict(self.max_size, keep=path)
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_size."""
+        with self._lock:
+            self._evict(self.max_size)
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        with self._lock:
+            self._evict(0)
+
+    def _evict(self, max_size, keep=None):
+        if max_size is None:
+            return
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith("."):
+                    continue
+                path = os.path.join(root, name)
+                # entries can disappear at any time when other processes
+                # share the directory
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_size:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _path(self, key, kind):
+        return os.path.join(self.directory, key[:2], key + _SUFFIXES[kind])
+
+    def _paths(self, key):
+        return [self._path(key, kind) for kind in _SUFFIXES]
@@ -0,0 +1,115 @@
+"""
+Upstream and downstream flow lengths of every cell of a D8 flow grid.
+"""
+
+import numpy as np
+import xarray as xr
+
+from streamkit._internal.dirmap import _make_esri_dirmap
+from streamkit.flowdir import normalize_flow_directions
+from streamkit.instrument import _stage
+from streamkit.jit import DIRMAP, FLOW_DIRECTIONS, LENGTHS, _kernel
+
+
+@_stage("flow_length")
+def flow_length(flow_directions: xr.DataArray) -> tuple[xr.DataArray, xr.DataArray]:
+    """Compute the longest upstream flow length and the downstream flow
+    length to the outlet of every cell.
+
+    Both are computed in two linear passes over a topological order of the
+    flow directions, instead of walking a path from every cell. Steps
+    between cells are measured from the raster resolution, so diagonal
+    steps and non-square cells have their true length. Chunked
+    (dask-backed) flow directions are loaded in full.
+
+    Args:
+        flow_directions: Flow direction raster (ESRI D8 encoding).
+    Returns:
+        (upstream, downstream) float32 rasters in map units: the length of
+        the longest flow path draining into each cell (0 for cells nothing
+        flows into), and the length of the flow path from each cell to
+        where it ends at a pit, an outlet, or the edge of the raster (0
+        there). Flow direction cycles, which valid D8 grids do not have,
+        give NaN lengths.
+    """
+    flow_directions = normalize_flow_directions(flow_directions)
+    dx, dy = np.abs(flow_directions.rio.resolution())
+    dirmap = _make_esri_dirmap()
+    step_lengths = np.hypot(dirmap[:, 0] * dy, dirmap[:, 1] * dx)
+    upstream, downstream = _flow_length_numba(
+        np.ascontiguousarray(flow_directions.values), dirmap, step_lengths
+    )
+    return (
+        flow_directions.copy(data=upstream),
+        flow_directions.copy(data=downstream),
+    )
+
+
+@_kernel((FLOW_DIRECTIONS, DIRMAP, LENGTHS))
+def _flow_length_numba(flow_directions_arr, dirmap, step_lengths):
+    """Longest upstream and downstream flow lengths of every cell.
+
+    The cells are put in topological order (every cell before the cell it
+    flows to) with Kahn's algorithm, which also carries the upstream lengths
+    downstream. The downstream lengths are then filled in reverse order.
+    """
+    nrows, ncols = flow_directions_arr.shape
+    n = nrows * ncols
+    fdir = flow_directions_arr.ravel()
+
+    # flat index of the cell each cell flows to, -1 if none
+    target = np.full(n, -1, dtype=np.int64)
+    indegree = np.zeros(n, dtype=np.uint8)
+    for cell in range(n):
+        drow = dirmap[fdir[cell], 0]
+        dcol = dirmap[fdir[cell], 1]
+        if drow == 0 and dcol == 0:
+            continue
+        next_row = cell // ncols + drow
+        next_col = cell % ncols + dcol
+        if 0 <= next_row < nrows and 0 <= next_col < ncols:
+            target[cell] = next_row * ncols + next_col
+            indegree[target[cell]] += 1
+
+    upstream = np.zeros(n, dtype=np.float32)
+    order = np.empty(n, dtype=np.int64)
+    tail = 0
+    for cell in range(n):
+        if indegree[cell] == 0:
+            order[tail] = cell
+            tail += 1
+    head = 0
+    while head < tail:
+        cell = order[head]
+        head += 1
+        next_cell = target[cell]
+        if next_cell < 0:
+            continue
+        length = upstream[cell] + step_lengths[fdir[cell]]
+        if length > upstream[next_cell]:
+            upstream[next_cell] = length
+        indegree[next_cell] -= 1
+        if indegree[next_cell] == 0:
+            order[tail] = next_cell
+            tail += 1
+
+    # cells left out of the order are on, or downstream of, a cycle. NaN
+    # marks them and, through the downstream pass, the cells draining into
+    # them.
+    downstream = np.zeros(n, dtype=np.float32)
+    if tail < n:
+        ordered = np.zeros(n, dtype=np.bool_)
+        for k in range(tail):
+            ordered[order[k]] = True
+        for cell in range(n):
+            if not ordered[cell]:
+                upstream[cell] = np.nan
+                downstream[cell] = np.nan
+
+    for k in range(tail - 1, -1, -1):
+        cell = order[k]
+        next_cell = target[cell]
+        if next_cell >= 0:
+            downstream[cell] = downstream[next_cell] + step_lengths[fdir[cell]]
+
+    return upstream.reshape((nrows, ncols)), downstream.reshape((nrows, ncols))
@@ -0,0 +1,34 @@
+"""
+Compact encoding of D8 flow directions.
+"""
+
+import numpy as np
+import xarray as xr
+
+# ESRI D8 codes: E, SE, S, SW, W, NW, N, NE
+ESRI_CODES = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+def normalize_flow_directions(flow_directions: xr.DataArray) -> xr.DataArray:
+    """Convert flow directions to streamkit's uint8 ESRI D8 encoding.
+
+    ESRI D8 codes are kept as they are. Every other value (e.g. the -1 and -2
+    pysheds uses for pits and flats, nodata, or NaN after masking) becomes 0,
+    the code streamkit uses for cells without a downstream neighbour. The
+    result is also the raster's nodata value. At one byte per cell this is
+    8x smaller than the int64 rasters pysheds returns.
+
+    Args:
+        flow_directions: Flow direction raster (ESRI D8 encoding) of any
+            numeric dtype.
+    Returns:
+        The flow directions as uint8. Rasters that are already uint8 are
+        returned unchanged.
+    """
+    if flow_directions.dtype == np.uint8:
+        return flow_directions
+
+    valid = flow_directions.isin(ESRI_CODES)
+    normalized = flow_directions.where(valid, 0).astype(np.uint8)
+    normalized.rio.write_nodata(0, inplace=True)
+    return normalized
@@ -0,0 +1,215 @@
+"""
+Streaming GeoParquet output for large vector results, and lazy bbox-filtered
+reading.
+"""
+
+import json
+from typing import Iterable, Iterator, Optional, Sequence
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pyproj
+import shapely
+
+_BBOX_FIELDS = ("xmin", "ymin", "xmax", "ymax")
+
+
+class GeoParquetWriter:
+    """Write GeoDataFrames to a GeoParquet file batch by batch.
+
+    Frames passed to write() are buffered until batch_size rows have
+    accumulated and then written as one row group, so memory is bounded by
+    the batch size rather than by the size of the output. Geometries are
+    stored as WKB, with a bbox covering column (GeoParquet 1.1) that lets
+    readers skip row groups outside a bounding box.
+
+    Every frame must have the same columns and dtypes. Use as a context
+    manager, or call close() when done.
+
+    Args:
+        path: Path of the output file.
+        crs: CRS of the geometries. If None, the CRS of the first frame.
+        batch_size: Number of rows per row group.
+    """
+
+    def __init__(self, path: str, crs=None, batch_size: int = 65536):
+        self.path = path
+        self.crs = crs
+        self.batch_size = batch_size
+        self.rows_written = 0
+        self._pending = []
+        self._pending_rows = 0
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, frame: gpd.GeoDataFrame):
+        """Add a frame to the output."""
+        if len(frame) == 0:
+            return
+        if self.crs is None:
+            self.crs = frame.crs
+        self._pending.append(frame)
+        self._pending_rows += len(frame)
+        if self._pending_rows >= self.batch_size:
+            self._flush()
+
+    def close(self):
+        """Write any buffered rows and finish the file."""
+        self._flush()
+        if self._writer is None:
+            # nothing was written, still produce a valid (empty) file
+            bbox = pa.struct([(name, pa.float64()) for name in _BBOX_FIELDS])
+            self._open(pa.schema([("geometry", pa.binary()), ("bbox", bbox)]))
+        self._writer.close()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        frame = pd.concat(self._pending, ignore_index=True)
+        self._pending = []
+        self._pending_rows = 0
+
+        table = _to_arrow(frame)
+        if self._writer is None:
+            self._open(table.schema)
+        else:
+            table = table.cast(self._writer.schema)
+        self._writer.write_table(table, row_group_size=self.batch_size)
+        self.rows_written += len(frame)
+
+    def _open(self, schema):
+        # the geo metadata has to be in the schema before the first row group
+        # is written, so geometry types are left unspecified
+        crs = None if self.crs is None else pyproj.CRS.from_user_input(self.crs)
+        metadata = {
+            "version": "1.1.0",
+            "primary_column": "geometry",
+            "columns": {
+                "geometry": {
+                    "encoding": "WKB",
+                    "geometry_types": [],
+                    "crs": None if crs is None else crs.to_json_dict(),
+                    "covering": {
+                        "bbox": {name: ["bbox", name] for name in _BBOX_FIELDS}
+                    },
+                }
+            },
+        }
+        schema = schema.with_metadata(
+            {**(schema.metadata or {}), b"geo": json.dumps(metadata).encode()}
+        )
+        self._writer = pq.ParquetWriter(self.path, schema)
+
+
+def write_geoparquet(
+    frames: Iterable[gpd.GeoDataFrame],
+    path: str,
+    crs=None,
+    batch_size: int = 65536,
+) -> int:
+    """Stream GeoDataFrames (e.g. from iter_vectorize_streams) to GeoParquet.
+
+    Args:
+        frames: GeoDataFrames with the same columns, e.g. a generator.
+        path: Path of the output file.
+        crs: CRS of the geometries. If None, the CRS of the first frame.
+        batch_size: Number of rows per row group.
+    Returns:
+        Number of rows written.
+    """
+    with GeoParquetWriter(path, crs=crs, batch_size=batch_size) as writer:
+        for frame in frames:
+            writer.write(frame)
+    return writer.rows_written
+
+
+def iter_geoparquet(
+    path: str,
+    bbox: Optional[Sequence[float]] = None,
+    columns: Optional[Sequence[str]] = None,
+    batch_size: int = 65536,
+) -> Iterator[gpd.GeoDataFrame]:
+    """Read a GeoParquet file lazily, one batch of rows at a time.
+
+    Args:
+        path: Path of the GeoParquet file, as written by GeoParquetWriter.
+        bbox: Optional (xmin, ymin, xmax, ymax). Only rows whose bounding
+            box intersects it are read; row groups entirely outside of it
+            are skipped without being decoded.
+        columns: Columns to read besides geometry. If None, all columns.
+        batch_size: Maximum number of rows per yielded frame.
+    Yields:
+        GeoDataFrames of at most batch_size rows.
+    """
+    dataset, crs = _open_dataset(path)
+
+    row_filter = None
+    if bbox is not None:
+        xmin, ymin, xmax, ymax = bbox
+        row_filter = (
+            (ds.field("bbox", "xmin") <= xmax)
+            & (ds.field("bbox", "xmax") >= xmin)
+            & (ds.field("bbox", "ymin") <= ymax)
+            & (ds.field("bbox", "ymax") >= ymin)
+        )
+    if columns is not None:
+        columns = [name for name in columns if name != "geometry"] + ["geometry"]
+    else:
+        columns = [name for name in dataset.schema.names if name != "bbox"]
+
+    for batch in dataset.to_batches(
+        columns=columns, filter=row_filter, batch_size=batch_size
+    ):
+        if batch.num_rows == 0:
+            continue
+        frame = batch.to_pandas()
+        geometry = shapely.from_wkb(frame.pop("geometry"))
+        yield gpd.GeoDataFrame(frame, geometry=geometry, crs=crs)
+
+
+def read_geoparquet(
+    path: str,
+    bbox: Optional[Sequence[float]] = None,
+    columns: Optional[Sequence[str]] = None,
+) -> gpd.GeoDataFrame:
+    """Read a GeoParquet file written by GeoParquetWriter, optionally only
+    the rows intersecting a bounding box. See iter_geoparquet."""
+    frames = list(iter_geoparquet(path, bbox=bbox, columns=columns))
+    if frames:
+        return pd.concat(frames, ignore_index=True)
+
+    dataset, crs = _open_dataset(path)
+    names = [name for name in dataset.schema.names if name not in ("bbox", "geometry")]
+    if columns is not None:
+        names = [name for name in names if name in columns]
+    empty = dataset.schema.empty_table().select(names).to_pandas()
+    return gpd.GeoDataFrame(empty, geometry=gpd.GeoSeries([], crs=crs))
+
+
+def _open_dataset(path):
+    dataset = ds.dataset(path, format="parquet")
+    metadata = json.loads(dataset.schema.metadata[b"geo"])
+    return dataset, metadata["columns"]["geometry"]["crs"]
+
+
+def _to_arrow(frame):
+    geometry = frame.geometry.values
+    bounds = geometry.bounds
+    table = pa.Table.from_pandas(
+        pd.DataFrame(frame.drop(columns=frame.geometry.name)), preserve_index=False
+    )
+    table = table.append_column(
+        "geometry", pa.array(shapely.to_wkb(geometry), type=pa.binary())
+    )
+    bbox = pa.StructArray.from_arrays(
+        [pa.array(bounds[:, i]) for i in range(4)], names=list(_BBOX_FIELDS)
+    )
+    return table.append_column("bbox", bbox)
@@ -0,0 +1,644 @@
+"""
+Incremental updates of the hydrology and the stream network after local
+edits of a DEM (e.g. culvert burns or road-fill corrections), recomputing
+only the cells the edits can affect.
+"""
+
+from numba import types
+import numpy as np
+import xarray as xr
+
+from streamkit._internal.adapters import from_pysheds, to_pysheds
+from streamkit._internal.dirmap import _make_esri_dirmap
+from streamkit.flowdir import normalize_flow_directions
+from streamkit.instrument import _stage
+from streamkit.jit import DIRMAP, FLOW_DIRECTIONS, INDICES, _kernel
+from streamkit.watershed import condition_dem
+
+# dtypes of the rasters the kernels are compiled for by warmup
+_ELEVATION_DTYPES = (types.float32, types.float64)
+_LINK_DTYPES = (types.uint16, types.uint32)
+
+
+@_stage("update_hydrology")
+def update_hydrology(
+    dem: xr.DataArray,
+    conditioned_dem: xr.DataArray,
+    flow_directions: xr.DataArray,
+    flow_accumulation: xr.DataArray,
+    window: tuple[int, int, int, int],
+) -> tuple[xr.DataArray, xr.DataArray, xr.DataArray]:
+    """
+    Update the results of flow_accumulation_workflow after editing a window
+    of the DEM, e.g. to burn a culvert or correct a road fill.
+
+    The DEM is conditioned again in a region around the window, with the
+    cells on the edge of the region held at their previous conditioned
+    elevations, and flow directions are recomputed in that region. The
+    region covers the depressions filled by the previous conditioning that
+    touch the window, which the edit may drain, and grows until no cell on
+    its edge loses its outflow, as happens when the edit dams a valley into
+    a depression reaching beyond the region. Flow accumulation is then only
+    updated along the flow paths downstream of the cells whose flow
+    direction changed.
+
+    The result is the same as rerunning flow_accumulation_workflow on the
+    edited DEM, except where the conditioning drains flats with slightly
+    different elevation increments. Chunked (dask-backed) rasters are
+    loaded in full.
+
+    Args:
+        dem: The edited DEM.
+        conditioned_dem: Conditioned DEM of the DEM before the edit, from
+            flow_accumulation_workflow (or an earlier update_hydrology).
+        flow_directions: Flow directions before the edit (ESRI D8
+            encoding).
+        flow_accumulation: Flow accumulation before the edit.
+        window: (row0, row1, col0, col1) bounds of the edited cells, with
+            row1 and col1 excluded.
+    Returns:
+        (conditioned DEM, flow directions, and flow accumulation) of the
+        edited DEM.
+    """
+    nrows, ncols = dem.shape
+    row0, row1, col0, col1 = window
+    if not (0 <= row0 < row1 <= nrows and 0 <= col0 < col1 <= ncols):
+        raise ValueError(f"Window {window} is empty or outside of the DEM")
+
+    dirmap = _make_esri_dirmap()
+    flow_directions = normalize_flow_directions(flow_directions)
+    old_conditioned = np.asarray(conditioned_dem.data)
+    old_fdir = np.ascontiguousarray(flow_directions.data)
+
+    with _stage("conditioning"):
+        region = _filled_extent_numba(
+            np.ascontiguousarray(dem.data),
+            np.ascontiguousarray(old_conditioned),
+            row0,
+            row1,
+            col0,
+            col1,
+        )
+        while True:
+            outer, conditioned, fdir = _recondition(
+                dem, conditioned_dem, region, window
+            )
+            r0, r1, c0, c1 = outer
+            lost_outflow = (fdir == 0) & (old_fdir[r0:r1, c0:c1] != 0)
+            # the edge of the region, except where it is the edge of the DEM
+            held = np.zeros(lost_outflow.shape, dtype=bool)
+            held[0, :] |= r0 > 0
+            held[-1, :] |= r1 < nrows
+            held[:, 0] |= c0 > 0
+            held[:, -1] |= c1 < ncols
+            if not (lost_outflow & held).any():
+                break
+            size = max(region[1] - region[0], region[3] - region[2])
+            region = _expand(region, size, dem.shape)
+
+    r0, r1, c0, c1 = outer
+    new_conditioned = np.array(old_conditioned)
+    new_conditioned[r0:r1, c0:c1] = conditioned
+    new_fdir = old_fdir.copy()
+    new_fdir[r0:r1, c0:c1] = fdir
+
+    with _stage("flow_accumulation") as stage:
+        rows, cols = np.nonzero(fdir != old_fdir[r0:r1, c0:c1])
+        acc = np.array(flow_accumulation.data)
+        stage.count = _propagate_accumulation_numba(
+            old_fdir, new_fdir, acc, rows + r0, cols + c0, dirmap
+        )
+
+    return (
+        conditioned_dem.copy(data=new_conditioned),
+        flow_directions.copy(data=new_fdir),
+        flow_accumulation.copy(data=acc),
+    )
+
+
+@_stage("update_streams")
+def update_streams(
+    streams: xr.DataArray,
+    subbasins: xr.DataArray,
+    flow_directions: xr.DataArray,
+    flow_accumulation: xr.DataArray,
+    previous_flow_directions: xr.DataArray,
+    previous_flow_accumulation: xr.DataArray,
+    min_accumulation: float,
+) -> tuple[xr.DataArray, xr.DataArray]:
+    """
+    Update stream links and subbasins after update_hydrology.
+
+    Streams are the cells whose flow accumulation is above min_accumulation,
+    linked as by link_streams (as in dem_pipeline), and subbasins are those
+    of delineate_subbasins. Only the links whose cells or junctions changed
+    are traced again, and only the cells whose downstream pour point may
+    have changed are relabelled.
+
+    Links that did not change keep their IDs, so unlike link_streams the IDs
+    no longer follow the order of the sources. New links take the IDs of
+    the links that were removed, then IDs above the largest one.
+
+    Args:
+        streams: Stream links before the update.
+        subbasins: Subbasins of the stream links before the update.
+        flow_directions: Flow directions returned by update_hydrology.
+        flow_accumulation: Flow accumulation returned by update_hydrology.
+        previous_flow_directions: Flow directions before the update.
+        previous_flow_accumulation: Flow accumulation before the update.
+        min_accumulation: Flow accumulation (in cells) above which a cell
+            is a stream.
+    Returns:
+        (stream links, subbasins) after the update.
+    """
+    dirmap = _make_esri_dirmap()
+    old_fdir = np.asarray(normalize_flow_directions(previous_flow_directions).data)
+    new_fdir = np.ascontiguousarray(normalize_flow_directions(flow_directions).data)
+    acc = np.asarray(flow_accumulation.data)
+    changed = np.flatnonzero(
+        (old_fdir != new_fdir) | (np.asarray(previous_flow_accumulation.data) != acc)
+    )
+
+    old_links = np.ascontiguousarray(streams.data)
+    links = old_links.copy()
+    with _stage("link_streams") as stage:
+        relinked, last_id = _relink_numba(
+            old_links,
+            links,
+            np.ascontiguousarray(old_fdir),
+            new_fdir,
+            np.ascontiguousarray(acc, dtype=np.float64),
+            float(min_accumulation),
+            changed,
+            dirmap,
+            int(old_links.max(initial=0)) + 1,
+        )
+        stage.count = len(relinked)
+    if last_id > np.iinfo(links.dtype).max:
+        raise ValueError(f"Too many stream links for {links.dtype} link IDs")
+
+    labels = np.array(subbasins.data)
+    with _stage("subbasins") as stage:
+        redirected = changed[old_fdir.ravel()[changed] != new_fdir.ravel()[changed]]
+        stage.count = _relabel_subbasins_numba(
+            labels, links, new_fdir, np.concatenate([relinked, redirected]), dirmap
+        )
+
+    return streams.copy(data=links), subbasins.copy(data=labels)
+
+
+def _expand(window, margin, shape):
+    row0, row1, col0, col1 = window
+    nrows, ncols = shape
+    return (
+        max(row0 - margin, 0),
+        min(row1 + margin, nrows),
+        max(col0 - margin, 0),
+        min(col1 + margin, ncols),
+    )
+
+
+def _recondition(dem, conditioned_dem, region, window):
+    """Condition the region of the DEM again, with the cells on its edge
+    held at their conditioned elevations, and compute its flow directions.
+
+    Returns the window of the region and its edge, and the conditioned DEM
+    and flow directions in that window.
+    """
+    outer = _expand(region, 1, dem.shape)
+    r0, r1, c0, c1 = outer
+    sub_dem = dem.isel(y=slice(r0, r1), x=slice(c0, c1)).copy()
+    old_conditioned = np.asarray(conditioned_dem.data)[r0:r1, c0:c1]
+
+    # edited cells on the edge (only where it is the edge of the DEM) keep
+    # their new elevations
+    held = np.ones(sub_dem.shape, dtype=bool)
+    held[1:-1, 1:-1] = False
+    w0, w1, v0, v1 = window
+    held[max(w0 - r0, 0) : w1 - r0, max(v0 - c0, 0) : v1 - c0] = False
+    sub_dem.data[held] = old_conditioned[held]
+    conditioned = np.asarray(condition_dem(sub_dem).data)
+
+    # flow directions of the edge depend on the cells just outside of it
+    b0, b1, a0, a1 = _expand(outer, 1, dem.shape)
+    block = np.array(np.asarray(conditioned_dem.data)[b0:b1, a0:a1])
+    block[r0 - b0 : r1 - b0, c0 - a0 : c1 - a0] = conditioned
+    block = conditioned_dem.isel(y=slice(b0, b1), x=slice(a0, a1)).copy(data=block)
+    pysheds_block, grid = to_pysheds(block)
+    fdir = normalize_flow_directions(from_pysheds(grid.flowdir(pysheds_block))).data
+    fdir = fdir[r0 - b0 : r1 - b0, c0 - a0 : c1 - a0]
+    return outer, conditioned, fdir
+
+
+@_kernel()
+def _downstream_numba(row, col, flow_directions_arr, dirmap):
+    """Return the flat index of the cell (row, col) flows into, or -1."""
+    nrows, ncols = flow_directions_arr.shape
+    current_direction = flow_directions_arr[row, col]
+    drow = dirmap[current_direction, 0]
+    dcol = dirmap[current_direction, 1]
+    if drow == 0 and dcol == 0:
+        return -1
+    next_row = row + drow
+    next_col = col + dcol
+    if not (0 <= next_row < nrows and 0 <= next_col < ncols):
+        return -1
+    return next_row * ncols + next_col
+
+
+@_kernel(
+    *(
+        (dtype[:, ::1], dtype[:, ::1]) + (types.int64,) * 4
+        for dtype in _ELEVATION_DTYPES
+    )
+)
+def _filled_extent_numba(dem, conditioned, row0, row1, col0, col1):
+    """Bounds of the window and of the filled cells (conditioned above the
+    DEM) connected to it."""
+    nrows, ncols = dem.shape
+    seen = dict()
+    stack = []
+    for row in range(row0, row1):
+        for col in range(col0, col1):
+            seen[row * ncols + col] = True
+            stack.append((row, col))
+
+    top, bottom, left, right = row0, row1, col0, col1
+    while stack:
+        row, col = stack.pop()
+        for drow in range(-1, 2):
+            for dcol in range(-1, 2):
+                next_row = row + drow
+                next_col = col + dcol
+                if not (0 <= next_row < nrows and 0 <= next_col < ncols):
+                    continue
+                if next_row * ncols + next_col in seen:
+                    continue
+                if not conditioned[next_row, next_col] > dem[next_row, next_col]:
+                    continue
+                seen[next_row * ncols + next_col] = True
+                stack.append((next_row, next_col))
+                top = min(top, next_row)
+                bottom = max(bottom, next_row + 1)
+                left = min(left, next_col)
+                right = max(right, next_col + 1)
+    return top, bottom, left, right
+
+
+@_kernel(
+    *(
+        (FLOW_DIRECTIONS, FLOW_DIRECTIONS, dtype[:, ::1], INDICES, INDICES, DIRMAP)
+        for dtype in _ELEVATION_DTYPES
+    )
+)
+def _propagate_accumulation_numba(
+    old_flow_directions_arr, flow_directions_arr, acc_arr, rows, cols, dirmap
+):
+    """Update flow accumulation in place after the flow directions of the
+    cells (rows[k], cols[k]) changed.
+
+    The accumulation of a changed cell moves from the cell it used to flow
+    into to the cell it flows into now. The differences are added along the
+    new flow paths, visiting every cell downstream of them once, in
+    topological order (Kahn's algorithm). Returns the number of cells
+    visited.
+    """
+    ncols = acc_arr.shape[1]
+    targets = []
+    amounts = []
+    for k in range(len(rows)):
+        row, col = rows[k], cols[k]
+        old_target = _downstream_numba(row, col, old_flow_directions_arr, dirmap)
+        if old_target >= 0:
+            targets.append(old_target)
+            amounts.append(-acc_arr[row, col])
+        new_target = _downstream_numba(row, col, flow_directions_arr, dirmap)
+        if new_target >= 0:
+            targets.append(new_target)
+            amounts.append(acc_arr[row, col])
+
+    # number the cells downstream of the targets
+    position = dict()
+    cells = []
+    for target in targets:
+        cell = target
+        while cell >= 0 and cell not in position:
+            position[cell] = len(cells)
+            cells.append(cell)
+            cell = _downstream_numba(
+                cell // ncols, cell % ncols, flow_directions_arr, dirmap
+            )
+
+    n = len(cells)
+    downstream = np.full(n, -1, dtype=np.int64)
+    indegree = np.zeros(n, dtype=np.int64)
+    delta = np.zeros(n)
+    for k in range(n):
+        cell = _downstream_numba(
+            cells[k] // ncols, cells[k] % ncols, flow_directions_arr, dirmap
+        )
+        if cell >= 0:
+            downstream[k] = position[cell]
+            indegree[downstream[k]] += 1
+    for k in range(len(targets)):
+        delta[position[targets[k]]] += amounts[k]
+
+    queue = [k for k in range(n) if indegree[k] == 0]
+    while queue:
+        k = queue.pop()
+        acc_arr[cells[k] // ncols, cells[k] % ncols] += delta[k]
+        d = downstream[k]
+        if d < 0:
+            continue
+        delta[d] += delta[k]
+        indegree[d] -= 1
+        if indegree[d] == 0:
+            queue.append(d)
+    return n
+
+
+@_kernel(
+    *(
+        (dtype[:, ::1], dtype[:, ::1], FLOW_DIRECTIONS, FLOW_DIRECTIONS)
+        + (types.float64[:, ::1], types.float64, INDICES, DIRMAP, types.int64)
+        for dtype in _LINK_DTYPES
+    )
+)
+def _relink_numba(
+    old_links,
+    links,
+    old_flow_directions_arr,
+    flow_directions_arr,
+    acc_arr,
+    min_accumulation,
+    changed,
+    dirmap,
+    next_id,
+):
+    """Relabel, in links (a copy of old_links), the links whose cells or
+    junctions may have changed, given the flat indices of the cells whose
+    flow direction or accumulation changed.
+
+    Returns the flat indices of the cells of the removed and of the new
+    links (links traced again with the same cells keep their IDs), and the
+    largest link ID used.
+    """
+    nrows, ncols = old_links.shape
+
+    # stream cells that appeared, disappeared, or changed direction, and
+    # the cells they flow (or flowed) into, whose junctions may change
+    touched = []
+    for cell in changed:
+        row, col = cell // ncols, cell % ncols
+        was_stream = old_links[row, col] != 0
+        is_stream = acc_arr[row, col] > min_accumulation
+        redirected = old_flow_directions_arr[row, col] != flow_directions_arr[row, col]
+        if was_stream == is_stream and not (is_stream and redirected):
+            continue
+        touched.append(cell)
+        for target in (
+            _downstream_numba(row, col, old_flow_directions_arr, dirmap),
+            _downstream_numba(row, col, flow_directions_arr, dirmap),
+        ):
+            if target >= 0:
+                touched.append(target)
+
+    # the links of the touched cells, and the links ending just upstream of
+    # them, with one of their cells
+    affected = dict()
+    for cell in touched:
+        row, col = cell // ncols, cell % ncols
+        if old_links[row, col] != 0:
+            affected[np.int64(old_links[row, col])] = cell
+        for drow in range(-1, 2):
+            for dcol in range(-1, 2):
+                n_row, n_col = row + drow, col + dcol
+                if not (0 <= n_row < nrows and 0 <= n_col < ncols):
+                    continue
+                if old_links[n_row, n_col] == 0:
+                    continue
+                if (
+                    _downstream_numba(n_row, n_col, old_flow_directions_arr, dirmap)
+                    == cell
+                ):
+                    affected[np.int64(old_links[n_row, n_col])] = n_row * ncols + n_col
+
+    # remove the affected links; their cells that are still streams, and the
+    # new stream cells, are traced again
+    removed = []
+    counts = dict()
+    pending = dict()
+    for link_id, cell in affected.items():
+        # walk up to the head of the link, then down to its end
+        while True:
+            row, col = cell // ncols, cell % ncols
+            upstream = -1
+            for drow in range(-1, 2):
+                for dcol in range(-1, 2):
+                    n_row, n_col = row + drow, col + dcol
+                    if not (0 <= n_row < nrows and 0 <= n_col < ncols):
+                        continue
+                    if old_links[n_row, n_col] != link_id:
+                        continue
+                    if (
+                        _downstream_numba(n_row, n_col, old_flow_directions_arr, dirmap)
+                        == cell
+                    ):
+                        upstream = n_row * ncols + n_col
+            if upstream < 0:
+                break
+            cell = upstream
+        count = 0
+        while cell >= 0 and old_links[cell // ncols, cell % ncols] == link_id:
+            links[cell // ncols, cell % ncols] = 0
+            removed.append(cell)
+            count += 1
+            cell = _downstream_numba(
+                cell // ncols, cell % ncols, old_flow_directions_arr, dirmap
+            )
+        counts[link_id] = count
+    for cell in removed + touched:
+        if acc_arr[cell // ncols, cell % ncols] > min_accumulation:
+            if links[cell // ncols, cell % ncols] == 0:
+                pending[cell] = False
+
+    # heads: sources and confluences of the new network, in row-major order
+    heads = []
+    for cell in pending:
+        row, col = cell // ncols, cell % ncols
+        inflows = 0
+        inflow = -1
+        for drow in range(-1, 2):
+            for dcol in range(-1, 2):
+                n_row, n_col = row + drow, col + dcol
+                if not (0 <= n_row < nrows and 0 <= n_col < ncols):
+                    continue
+                if not acc_arr[n_row, n_col] > min_accumulation:
+                    continue
+                if _downstream_numba(n_row, n_col, flow_directions_arr, dirmap) == cell:
+                    inflows += 1
+                    inflow = n_row * ncols + n_col
+        if inflows != 1 or inflow not in pending:
+            heads.append(cell)
+    heads.sort()
+    is_head = dict()
+    for cell in heads:
+        is_head[cell] = True
+
+    # trace the new links, keeping the ID of links whose cells are the same
+    link_cells = []
+    starts = [0]
+    ids = []
+    kept = dict()
+    for head in heads:
+        link_id = np.int64(old_links[head // ncols, head % ncols])
+        same = link_id != 0 and link_id in counts
+        cell = head
+        while True:
+            pending[cell] = True
+            link_cells.append(cell)
+            same = same and old_links[cell // ncols, cell % ncols] == link_id
+            cell = _downstream_numba(
+                cell // ncols, cell % ncols, flow_directions_arr, dirmap
+            )
+            if cell < 0 or cell not in pending or pending[cell] or cell in is_head:
+                break
+        starts.append(len(link_cells))
+        if same and counts[link_id] == starts[-1] - starts[-2]:
+            kept[link_id] = True
+            ids.append(link_id)
+        else:
+            ids.append(np.int64(0))
+
+    freed = sorted([link_id for link_id in counts if link_id not in kept])
+    relinked = []
+    for cell in removed:
+        if np.int64(old_links[cell // ncols, cell % ncols]) not in kept:
+            relinked.append(cell)
+    used = 0
+    last_id = next_id - 1
+    for k in range(len(ids)):
+        if ids[k] == 0:
+            if used < len(freed):
+                ids[k] = freed[used]
+                used += 1
+            else:
+                ids[k] = next_id
+                next_id += 1
+            for i in range(starts[k], starts[k + 1]):
+                relinked.append(link_cells[i])
+        last_id = max(last_id, ids[k])
+        for i in range(starts[k], starts[k + 1]):
+            cell = link_cells[i]
+            links[cell // ncols, cell % ncols] = ids[k]
+    return np.array(relinked, dtype=np.int64), last_id
+
+
+@_kernel()
+def _is_pour_point_numba(row, col, links, flow_directions_arr, dirmap):
+    """Whether (row, col) is the pour point of its link as in
+    delineate_subbasins: the downstream end of a link of at least 2 cells."""
+    nrows, ncols = links.shape
+    link_id = links[row, col]
+    if link_id == 0:
+        return False
+    target = _downstream_numba(row, col, flow_directions_arr, dirmap)
+    if target >= 0 and links[target // ncols, target % ncols] == link_id:
+        return False
+    cell = row * ncols + col
+    for drow in range(-1, 2):
+        for dcol in range(-1, 2):
+            n_row, n_col = row + drow, col + dcol
+            if not (0 <= n_row < nrows and 0 <= n_col < ncols):
+                continue
+            if links[n_row, n_col] != link_id:
+                continue
+            if _downstream_numba(n_row, n_col, flow_directions_arr, dirmap) == cell:
+                return True
+    return False
+
+
+@_kernel()
+def _catchment_downstream_numba(row, col, flow_directions_arr, dirmap):
+    """Like _downstream_numba, but cells on the edge of the raster flow
+    nowhere, as in the catchments of delineate_subbasins (pysheds ignores
+    the flow directions of the edge)."""
+    nrows, ncols = flow_directions_arr.shape
+    if row == 0 or col == 0 or row == nrows - 1 or col == ncols - 1:
+        return -1
+    return _downstream_numba(row, col, flow_directions_arr, dirmap)
+
+
+@_kernel(
+    *(
+        (types.int32[:, ::1], dtype[:, ::1], FLOW_DIRECTIONS, INDICES, DIRMAP)
+        for dtype in _LINK_DTYPES
+    )
+)
+def _relabel_subbasins_numba(subbasins, links, flow_directions_arr, seeds, dirmap):
+    """Relabel, in place, the subbasins of the cells upstream of the seeds
+    (cells of changed links or with changed flow directions), up to the
+    pour points of other links.
+
+    Every cell is labelled with the link of the first pour point on its flow
+    path, as the nested catchments of delineate_subbasins do. Returns the
+    number of cells relabelled.
+    """
+    nrows, ncols = links.shape
+    label = dict()
+    stack = []
+    for cell in seeds:
+        if cell not in label:
+            label[cell] = -1
+            stack.append(cell)
+    while stack:
+        cell = stack.pop()
+        row, col = cell // ncols, cell % ncols
+        for drow in range(-1, 2):
+            for dcol in range(-1, 2):
+                n_row, n_col = row + drow, col + dcol
+                if not (0 <= n_row < nrows and 0 <= n_col < ncols):
+                    continue
+                upstream = n_row * ncols + n_col
+                if upstream in label:
+                    continue
+                if (
+                    _catchment_downstream_numba(
+                        n_row, n_col, flow_directions_arr, dirmap
+                    )
+                    != cell
+                ):
+                    continue
+                if _is_pour_point_numba(
+                    n_row, n_col, links, flow_directions_arr, dirmap
+                ):
+                    continue
+                label[upstream] = -1
+                stack.append(upstream)
+
+    # follow the flow path of every cell to a pour point, a cell whose label
+    # is already known, or a cell outside of the relabelled area
+    path = []
+    for start in label:
+        cell = start
+        while True:
+            row, col = cell // ncols, cell % ncols
+            if cell not in label:
+                value = np.int64(subbasins[row, col])
+                break
+            if label[cell] != -1:
+                value = label[cell]
+                break
+            path.append(cell)
+            if _is_pour_point_numba(row, col, links, flow_directions_arr, dirmap):
+                value = np.int64(links[row, col])
+                break
+            cell = _catchment_downstream_numba(row, col, flow_directions_arr, dirmap)
+            if cell < 0:
+                value = np.int64(0)
+                break
+        for cell in path:
+            label[cell] = value
+            subbasins[cell // ncols, cell % ncols] = value
+        path.clear()
+    return len(label)
@@ -0,0 +1,172 @@
+"""
+Per-stage timing and memory instrumentation, and progress callbacks for
+long-running loops.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+import json
+import sys
+import time
+from typing import Callable, Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_PROFILER = ContextVar("streamkit_profiler", default=None)
+_STAGE = ContextVar("streamkit_stage", default=None)
+_PROGRESS = ContextVar("streamkit_progress", default=None)
+
+
+class Cancelled(Exception):
+    """Raised when a progress callback cancels a running computation."""
+
+
+@dataclass
+class StageRecord:
+    """Timing and memory of one run of a stage.
+
+    Attributes:
+        name: Name of the stage, prefixed by the names of the stages it ran
+            in (e.g. "flow_accumulation_workflow/conditioning").
+        wall_time: Elapsed time in seconds.
+        peak_rss: Peak resident set size of the process at the end of the
+            stage, in bytes. This is a high-water mark over the life of the
+            process, so it is only attributable to the stage when
+            rss_increase is positive. None where unavailable (Windows).
+        rss_increase: How much the stage raised the peak resident set size,
+            in bytes.
+        count: Number of items the stage processed (e.g. links or pour
+            points), if it has a natural unit.
+    """
+
+    name: str
+    wall_time: float
+    peak_rss: Optional[int]
+    rss_increase: Optional[int]
+    count: Optional[int] = None
+
+
+class Profiler:
+    """Record the timing and memory of the streamkit stages run inside it.
+
+    Stages include the main entry points (e.g. flow_accumulation_workflow,
+    vectorize_streams, delineate_subbasins, delineate_reaches) and their
+    sub-steps, nested by name. Only stages run in the current thread or
+    task are recorded; work done in worker processes is timed as part of
+    the stage that waits for it, but its memory is not included.
+
+    Example:
+        with Profiler() as profiler:
+            flow_accumulation_workflow(dem)
+        profiler.to_json("profile.json")
+    """
+
+    def __init__(self):
+        self.records = []
+        self._token = None
+
+    def __repr__(self):
+        return f"Profiler({len(self.records)} records)"
+
+    def __enter__(self):
+        self._token = _PROFILER.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        _PROFILER.reset(self._token)
+        self._token = None
+
+    def to_dict(self) -> list:
+        """Return the records as a list of dictionaries, in the order the
+        stages finished."""
+        return [asdict(record) for record in self.records]
+
+    def to_json(self, path: Optional[str] = None) -> str:
+        """Return the records as JSON, also writing them to path if given."""
+        text = json.dumps(self.to_dict(), indent=2)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+
+@contextmanager
+def progress_callback(callback: Callable[[str, int, Optional[int]], object]):
+    """Report the progress of long per-item loops (e.g. over stream links)
+    to callback, and allow cancelling them.
+
+    callback(stage, done, total) is called after each item with the name of
+    the loop, the number of items done, and the total number of items (None
+    if unknown). If it returns False the computation is stopped by raising
+    Cancelled, e.g. to enforce a time budget. Work already running in worker
+    processes finishes before Cancelled is raised.
+
+    Example:
+        deadline = time.monotonic() + 600
+        with progress_callback(lambda *_: time.monotonic() < deadline):
+            vectorize_streams(streams, flow_directions, flow_accumulation)
+    """
+    token = _PROGRESS.set(callback)
+    try:
+        yield
+    finally:
+        _PROGRESS.reset(token)
+
+
+class _StageState:
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = None
+
+
+@contextmanager
+def _stage(name):
+    """Record a stage in the active Profiler, if any. Yields an object whose
+    count attribute can be set to the number of items processed."""
+    state = _StageState()
+    profiler = _PROFILER.get()
+    if profiler is None:
+        yield state
+        return
+
+    parent = _STAGE.get()
+    path = name if parent is None else f"{parent}/{name}"
+    token = _STAGE.set(path)
+    rss_before = _peak_rss()
+    start = time.perf_counter()
+    try:
+        yield state
+    finally:
+        wall_time = time.perf_counter() - start
+        _STAGE.reset(token)
+        rss_after = _peak_rss()
+        profiler.records.append(
+            StageRecord(
+                name=path,
+                wall_time=wall_time,
+                peak_rss=rss_after,
+                rss_increase=None if rss_after is None else rss_after - rss_before,
+                count=state.count,
+            )
+        )
+
+
+def _report_progress(stage, done, total=None):
+    """Pass progress to the active progress callback, raising Cancelled if
+    it returns False."""
+    callback = _PROGRESS.get()
+    if callback is not None and callback(stage, done, total) is False:
+        raise Cancelled(f"{stage} cancelled after {done} of {total} items")
+
+
+def _peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
@@ -0,0 +1,75 @@
+"""
+Compilation of the numba kernels.
+
+Kernels are compiled with on-disk caching, so a process only compiles a
+kernel for a given set of argument types if no earlier process did. Each
+kernel also declares the argument types streamkit calls it with, which
+warmup() compiles eagerly.
+"""
+
+from importlib import import_module
+
+import numba
+from numba import types
+
+# Argument types shared by the kernel signatures
+FLOW_DIRECTIONS = types.uint8[:, ::1]
+DIRMAP = types.int64[:, ::1]
+MASK = types.boolean[:, ::1]
+INDICES = types.int64[::1]
+LENGTHS = types.float64[::1]
+
+# Modules defining kernels, imported by warmup so every kernel is registered
+_KERNEL_MODULES = (
+    "streamkit._internal.chunked",
+    "streamkit.flow_length",
+    "streamkit.incremental",
+    "streamkit.labelstats",
+    "streamkit.reach",
+    "streamkit.streamlink",
+    "streamkit.streamnodes",
+    "streamkit.streamroute",
+    "streamkit.streamtrace",
+    "streamkit.upstreamindex",
+)
+
+# (dispatcher, signatures) of every kernel
+_KERNELS = []
+
+
+def warmup() -> int:
+    """Compile every numba kernel for the argument types streamkit uses.
+
+    Without it, each kernel is compiled on its first call, which can take
+    longer than the computation itself in short-lived worker processes.
+    Compiled kernels are cached on disk (next to the streamkit sources, or
+    in NUMBA_CACHE_DIR if set), so warmup only compiles once per
+    installation and later calls just load the cache. Calling warmup in
+    the parent process before starting workers fills the cache for them.
+
+    Kernels called with other argument types (e.g. read-only or
+    non-contiguous arrays) are still compiled, and cached, on first call.
+
+    Returns:
+        The number of kernel signatures compiled or loaded.
+    """
+    for module in _KERNEL_MODULES:
+        import_module(module)
+    count = 0
+    for dispatcher, signatures in _KERNELS:
+        for signature in signatures:
+            dispatcher.compile(signature)
+            count += 1
+    return count
+
+
+def _kernel(*signatures):
+    """Decorator compiling a function with numba.njit, cached on disk, and
+    registering the signatures it is called with for warmup."""
+
+    def decorate(func):
+        dispatcher = numba.njit(cache=True)(func)
+        _KERNELS.append((dispatcher, signatures))
+        return dispatcher
+
+    return decorate
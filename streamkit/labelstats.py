@@ -0,0 +1,186 @@
+"""
+Statistics of value rasters over the zones of a label raster (e.g. stream
+links or subbasins).
+"""
+
+from typing import Optional, Sequence
+
+from numba import types
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from streamkit.jit import INDICES, LENGTHS, _kernel
+
+_STATS = ("sum", "mean", "min", "max", "argmin", "argmax")
+
+
+def label_statistics(
+    labels: xr.DataArray,
+    values: Optional[xr.DataArray | dict[str, xr.DataArray]] = None,
+    stats: Sequence[str] = ("mean",),
+    percentiles: Sequence[float] = (),
+) -> pd.DataFrame:
+    """Compute statistics of value rasters for every label of a label raster.
+
+    All labels are processed together with bincounts and a single pass (and
+    one sort per value raster for percentiles), instead of masking the
+    rasters once per label. For example, the area, mean elevation, and mean
+    HAND of every subbasin:
+
+        label_statistics(subbasins, {"elevation": dem, "hand": hand})
+
+    Args:
+        labels: Raster of integer labels. Cells labelled 0 or NaN are
+            ignored.
+        values: Value raster, or dictionary of value rasters by name, on the
+            same grid as labels. A single raster is named by its name
+            attribute, or "value". NaN values are ignored.
+        stats: Statistics of each value raster, from "sum", "mean", "min",
+            "max", "argmin", and "argmax". argmin and argmax are the row and
+            col of the first cell (in row-major order) with the minimum or
+            maximum value.
+        percentiles: Percentiles (0 to 100) of each value raster, linearly
+            interpolated as by np.percentile.
+    Returns:
+        A DataFrame indexed by label with count (number of cells) and area
+        (in squared map units) columns, and for every value raster and
+        statistic a "{name}_{stat}" column ("{name}_{stat}_row" and
+        "{name}_{stat}_col" for argmin and argmax, "{name}_p{percentile}"
+        for percentiles). Statistics of labels without values are NaN, or
+        -1 for argmin and argmax.
+    Raises:
+        ValueError: If a statistic is unknown or a percentile is not between
+            0 and 100.
+    """
+    unknown = [stat for stat in stats if stat not in _STATS]
+    if unknown:
+        raise ValueError(f"Unknown statistics {unknown}, expected some of {_STATS}")
+    if any(not 0 <= q <= 100 for q in percentiles):
+        raise ValueError(f"Percentiles must be between 0 and 100, got {percentiles}")
+    if values is None:
+        values = {}
+    elif isinstance(values, xr.DataArray):
+        values = {values.name or "value": values}
+
+    label_arr = np.asarray(labels.data).ravel()
+    labelled = label_arr != 0
+    if np.issubdtype(label_arr.dtype, np.floating):
+        labelled &= ~np.isnan(label_arr)
+    cells = np.flatnonzero(labelled)
+    ids, bins = _label_bins(label_arr[cells])
+    count = np.bincount(bins, minlength=len(ids))
+    dx, dy = labels.rio.resolution()
+    columns = {"count": count, "area": count * abs(dx * dy)}
+
+    ncols = labels.shape[-1]
+    for name, raster in values.items():
+        value_arr = np.asarray(raster.data).ravel()[cells].astype(np.float64)
+        valid = ~np.isnan(value_arr)
+        n_valid = np.bincount(bins[valid], minlength=len(ids))
+        total = np.bincount(bins[valid], value_arr[valid], minlength=len(ids))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(n_valid > 0, total / n_valid, np.nan)
+        extrema = {}
+        if {"min", "max", "argmin", "argmax"} & set(stats):
+            extrema = dict(
+                zip(
+                    ("min", "max", "argmin", "argmax"),
+                    _label_extrema_numba(bins, value_arr, cells, len(ids)),
+                )
+            )
+        for stat in stats:
+            if stat == "sum":
+                columns[f"{name}_sum"] = total
+            elif stat == "mean":
+                columns[f"{name}_mean"] = mean
+            elif stat in ("min", "max"):
+                columns[f"{name}_{stat}"] = extrema[stat]
+            else:
+                flat = extrema[stat]
+                columns[f"{name}_{stat}_row"] = np.where(flat >= 0, flat // ncols, -1)
+                columns[f"{name}_{stat}_col"] = np.where(flat >= 0, flat % ncols, -1)
+        if percentiles:
+            columns.update(
+                _label_percentiles(
+                    name, bins[valid], value_arr[valid], n_valid, percentiles
+                )
+            )
+
+    return pd.DataFrame(columns, index=pd.Index(ids, name="label"))
+
+
+def _label_bins(label_values):
+    """Return the sorted unique labels and the index of the label of every
+    cell among them."""
+    if (
+        np.issubdtype(label_values.dtype, np.integer)
+        and len(label_values)
+        and label_values.min() > 0
+        and label_values.max() <= 4 * len(label_values)
+    ):
+        # dense enough for a lookup table indexed by label
+        present = np.bincount(label_values.astype(np.int64)) > 0
+        ids = np.flatnonzero(present).astype(label_values.dtype)
+        lookup = np.cumsum(present) - 1
+        return ids, lookup[label_values]
+    ids, bins = np.unique(label_values, return_inverse=True)
+    return ids, bins.astype(np.int64)
+
+
+def _label_percentiles(name, bins, value_arr, n_valid, percentiles):
+    sorted_values = _sort_by_label_numba(bins, value_arr, n_valid)
+    starts = np.concatenate([[0], np.cumsum(n_valid)[:-1]])
+    has_values = n_valid > 0
+    columns = {}
+    for q in percentiles:
+        position = q / 100 * (n_valid - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        result = np.full(len(n_valid), np.nan)
+        lo = sorted_values[(starts + low)[has_values]]
+        hi = sorted_values[(starts + high)[has_values]]
+        result[has_values] = lo + (hi - lo) * (position - low)[has_values]
+        columns[f"{name}_p{q:g}"] = result
+    return columns
+
+
+@_kernel((INDICES, LENGTHS, INDICES, types.int64))
+def _label_extrema_numba(bins, values, cells, n_labels):
+    """Minimum, maximum, and the cells (flat indices) of the first minimum
+    and maximum of the values of every label, skipping NaN values."""
+    minimum = np.full(n_labels, np.nan)
+    maximum = np.full(n_labels, np.nan)
+    argmin = np.full(n_labels, -1, dtype=np.int64)
+    argmax = np.full(n_labels, -1, dtype=np.int64)
+    for k in range(len(bins)):
+        value = values[k]
+        if np.isnan(value):
+            continue
+        b = bins[k]
+        if argmin[b] < 0 or value < minimum[b]:
+            minimum[b] = value
+            argmin[b] = cells[k]
+        if argmax[b] < 0 or value > maximum[b]:
+            maximum[b] = value
+            argmax[b] = cells[k]
+    return minimum, maximum, argmin, argmax
+
+
+@_kernel((INDICES, LENGTHS, INDICES))
+def _sort_by_label_numba(bins, values, counts):
+    """Sort the values by label, then value, with a counting sort on the
+    labels (counts is the number of values of every label)."""
+    starts = np.zeros(len(counts) + 1, dtype=np.int64)
+    for b in range(len(counts)):
+        starts[b + 1] = starts[b] + counts[b]
+    filled = starts[:-1].copy()
+    sorted_values = np.empty(len(values), dtype=np.float64)
+    for k in range(len(values)):
+        sorted_values[filled[bins[k]]] = values[k]
+        filled[bins[k]] += 1
+    for b in range(len(counts)):
+        sorted_values[starts[b] : starts[b + 1]] = np.sort(
+            sorted_values[starts[b] : starts[b + 1]]
+        )
+    return sorted_values
@@ -1,3 +1,5 @@
+import warnings
+
 import networkx as nx
 
 
@@ -73,8 +75,8 @@ def _label_mainstem(G, root):
                 if length == max_length
             ]
             if len(longest_candidates) > 1:
-                print(
-                    f"Warning: Tie in both strahler order and upstream length at node {current_node}. Arbitrarily choosing one."
+                warnings.warn(
+                    f"Tie in both strahler order and upstream length at node {current_node}. Arbitrarily choosing one."
                 )
             mainstem_edge = longest_candidates[0]
 
@@ -0,0 +1,213 @@
+"""
+Spatial index over a stream network, for snapping points to streams and
+finding the links near a point or in a bounding box.
+"""
+
+from typing import Optional
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from rasterio.transform import rowcol, xy
+from scipy.spatial import cKDTree as KDTree
+import shapely
+import xarray as xr
+
+from streamkit.vectorize_streams import vectorize_streams
+
+
+class NetworkIndex:
+    """Index of the stream cells and link geometries of a stream network.
+
+    Stream cells are indexed with a k-d tree on their cell centers, so
+    thousands of points (e.g. gauges or pour points) are snapped to the
+    nearest stream cell in one call. Link geometries are indexed with an
+    STRtree for nearest-link and bounding box queries. Both answer queries
+    in logarithmic time instead of scanning every link.
+
+    The link geometries are the LineStrings of vectorize_streams. If they
+    are not given, they are vectorized on the first query that needs them.
+    Points given as GeoSeries or GeoDataFrames are reprojected to the CRS of
+    the stream raster; other points are assumed to be in it.
+
+    Args:
+        stream_raster: Raster of stream links with unique IDs, 0 off stream.
+        flow_directions: Flow directions raster (ESRI D8 encoding).
+        flow_accumulation: Flow accumulation raster.
+        flowlines: Optional output of vectorize_streams for stream_raster.
+    """
+
+    def __init__(
+        self,
+        stream_raster: xr.DataArray,
+        flow_directions: xr.DataArray,
+        flow_accumulation: xr.DataArray,
+        flowlines: Optional[gpd.GeoDataFrame] = None,
+    ):
+        self.stream_raster = stream_raster
+        self.flow_directions = flow_directions
+        self.flow_accumulation = flow_accumulation
+        self._flowlines = flowlines
+        self._tree = None
+        self._transform = stream_raster.rio.transform()
+
+        links = np.asarray(stream_raster.data)
+        self._links = links
+        self._rows, self._cols = np.nonzero(np.nan_to_num(links) != 0)
+        self._link_ids = links[self._rows, self._cols].astype(np.int64)
+        self._accumulation = np.asarray(flow_accumulation.data)[self._rows, self._cols]
+        xs, ys = xy(self._transform, self._rows, self._cols, offset="center")
+        self._xy = np.column_stack([xs, ys])
+        # k-d trees of the stream cells above each min_accumulation queried
+        self._cell_trees = {}
+
+    def __repr__(self):
+        return f"NetworkIndex({len(self._link_ids)} stream cells)"
+
+    @property
+    def flowlines(self) -> gpd.GeoDataFrame:
+        """Link geometries (the output of vectorize_streams)."""
+        if self._flowlines is None:
+            self._flowlines = vectorize_streams(
+                self.stream_raster, self.flow_directions, self.flow_accumulation
+            )
+        return self._flowlines
+
+    def link_at(self, points) -> np.ndarray:
+        """Return the link ID of the cell containing each point, 0 for
+        points off stream or outside the raster.
+
+        Args:
+            points: GeoSeries or GeoDataFrame of points, or (n, 2) array of
+                x, y coordinates.
+        """
+        x, y = self._points_xy(points)
+        rows, cols = rowcol(self._transform, x, y)
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        height, width = self._links.shape
+        inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+        ids = np.zeros(len(rows), dtype=np.int64)
+        ids[inside] = np.nan_to_num(self._links[rows[inside], cols[inside]])
+        return ids
+
+    def snap(
+        self,
+        points,
+        min_accumulation: float = 0,
+        max_distance: float = np.inf,
+    ) -> gpd.GeoDataFrame:
+        """Snap points to the nearest stream cell with a flow accumulation
+        greater than min_accumulation.
+
+        Args:
+            points: GeoSeries or GeoDataFrame of points, or (n, 2) array of
+                x, y coordinates.
+            min_accumulation: Only snap to stream cells with a greater flow
+                accumulation, e.g. to keep gauges off small tributaries.
+            max_distance: Points farther than this from every such stream
+                cell are not snapped.
+        Returns:
+            A GeoDataFrame with a row per point (with the index of points if
+            it has one) and the snapped cell center as geometry, with row,
+            col, stream_id, flow_accumulation, and snap_distance columns.
+            Points that were not snapped have no geometry, row and col -1,
+            stream_id 0, and infinite snap_distance.
+        """
+        x, y = self._points_xy(points)
+        cells, tree = self._cell_tree(min_accumulation)
+        distances, nearest = tree.query(
+            np.column_stack([x, y]), distance_upper_bound=max_distance
+        )
+        snapped = nearest < len(cells)
+        cells = cells[nearest[snapped]]
+
+        rows = np.full(len(x), -1, dtype=np.int64)
+        cols = np.full(len(x), -1, dtype=np.int64)
+        stream_ids = np.zeros(len(x), dtype=np.int64)
+        accumulation = np.full(len(x), np.nan)
+        rows[snapped] = self._rows[cells]
+        cols[snapped] = self._cols[cells]
+        stream_ids[snapped] = self._link_ids[cells]
+        accumulation[snapped] = self._accumulation[cells]
+        geometry = np.full(len(x), None, dtype=object)
+        geometry[snapped] = shapely.points(self._xy[cells])
+
+        index = points.index if isinstance(points, (pd.Series, pd.DataFrame)) else None
+        return gpd.GeoDataFrame(
+            {
+                "row": rows,
+                "col": cols,
+                "stream_id": stream_ids,
+                "flow_accumulation": accumulation,
+                "snap_distance": distances,
+            },
+            geometry=geometry,
+            index=index,
+            crs=self.stream_raster.rio.crs,
+        )
+
+    def nearest(self, points, max_distance: Optional[float] = None) -> pd.DataFrame:
+        """Find the nearest link geometry to each point.
+
+        Args:
+            points: GeoSeries or GeoDataFrame of points, or (n, 2) array of
+                x, y coordinates.
+            max_distance: Optional search radius. Points with no link within
+                it get stream_id 0 and infinite distance.
+        Returns:
+            A DataFrame with a row per point (with the index of points if it
+            has one) and stream_id and distance columns.
+        """
+        x, y = self._points_xy(points)
+        (point_idx, link_idx), distances = self._strtree().query_nearest(
+            shapely.points(x, y),
+            max_distance=max_distance,
+            return_distance=True,
+            all_matches=False,
+        )
+        stream_ids = np.zeros(len(x), dtype=np.int64)
+        distance = np.full(len(x), np.inf)
+        stream_ids[point_idx] = self.flowlines["stream_id"].to_numpy()[link_idx]
+        distance[point_idx] = distances
+        index = points.index if isinstance(points, (pd.Series, pd.DataFrame)) else None
+        return pd.DataFrame(
+            {"stream_id": stream_ids, "distance": distance}, index=index
+        )
+
+    def query_bbox(self, bbox: tuple[float, float, float, float]) -> np.ndarray:
+        """Return the IDs of the links intersecting a bounding box.
+
+        Args:
+            bbox: (minx, miny, maxx, maxy) in the CRS of the stream raster.
+        Returns:
+            Sorted array of stream IDs.
+        """
+        hits = self._strtree().query(shapely.box(*bbox), predicate="intersects")
+        return np.sort(self.flowlines["stream_id"].to_numpy()[hits])
+
+    def _strtree(self):
+        if self._tree is None:
+            self._tree = shapely.STRtree(self.flowlines.geometry.values)
+        return self._tree
+
+    def _cell_tree(self, min_accumulation):
+        # indices of the stream cells above min_accumulation, and their tree
+        if min_accumulation not in self._cell_trees:
+            cells = np.flatnonzero(self._accumulation > min_accumulation)
+            if len(cells) == 0:
+                raise ValueError(
+                    f"No stream cells with flow accumulation above {min_accumulation}"
+                )
+            self._cell_trees[min_accumulation] = (cells, KDTree(self._xy[cells]))
+        return self._cell_trees[min_accumulation]
+
+    def _points_xy(self, points):
+        if isinstance(points, gpd.GeoDataFrame):
+            points = points.geometry
+        if isinstance(points, gpd.GeoSeries):
+            crs = self.stream_raster.rio.crs
+            if points.crs is not None and crs is not None:
+                points = points.to_crs(crs)
+            return points.x.to_numpy(), points.y.to_numpy()
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        return points[:, 0], points[:, 1]
@@ -5,11 +5,14 @@ import networkx as nx
 import xarray as xr
 
 from streamkit.watershed import flow_accumulation_workflow
-from streamkit.streamtrace import trace_streams
-from streamkit.streamlink import link_streams
+from streamkit.streamlink import _trace_stream_links
 
 
-def rasterize_nhd(nhd_flowlines: gpd.GeoDataFrame, dem: xr.DataArray) -> xr.DataArray:
+def rasterize_nhd(
+    nhd_flowlines: gpd.GeoDataFrame,
+    dem: xr.DataArray,
+    flow_directions: xr.DataArray | None = None,
+) -> xr.DataArray:
     """Create a raster representation of NHD flowlines traced on a DEM.
 
     Converts vector NHD flowlines to a raster stream network by identifying
@@ -22,39 +25,30 @@ def rasterize_nhd(nhd_flowlines: gpd.GeoDataFrame, dem: xr.DataArray) -> xr.Data
             containing stream geometries.
         dem: Digital elevation model raster with spatial reference information.
             Used to determine flow directions for stream tracing.
+        flow_directions: Precomputed flow directions for the DEM (ESRI d8
+            encoding). If None, computed with flow_accumulation_workflow().
 
     Returns:
         A raster DataArray where each pixel value represents a unique stream ID (0 for non-stream pixels, consecutive positive integers for stream segments).
     """
     channel_heads = _nhd_channel_heads(nhd_flowlines)
 
-    xs, ys = zip(*[(pt.x, pt.y) for pt in channel_heads])
-    inverse = ~dem.rio.transform()
-    indices = [inverse * (x, y) for x, y in zip(xs, ys)]
-    points = [
-        (int(row), int(col)) for col, row in indices
-    ]  # note the order of col, row...
+    # note the order of col, row...
+    cols, rows = ~dem.rio.transform() * (channel_heads.x.values, channel_heads.y.values)
+    points = list(zip(rows.astype(np.int64).tolist(), cols.astype(np.int64).tolist()))
 
-    _, flow_directions, _ = flow_accumulation_workflow(dem)
+    if flow_directions is None:
+        _, flow_directions, _ = flow_accumulation_workflow(dem)
 
-    stream_raster = trace_streams(points, flow_directions)
-    stream_raster = link_streams(stream_raster, flow_directions)
+    # trace and link in one pass, which also counts the cells of each link
+    stream_raster, _, link_sizes = _trace_stream_links(points, flow_directions)
 
-    # drop any small streams (< 2 pixels)
-    # find all unique stream IDs where the count is < 2
-    unique, counts = np.unique(stream_raster.data, return_counts=True)
-    small_streams = unique[counts < 2]
-    for stream_id in small_streams:
-        stream_raster.data[stream_raster.data == stream_id] = 0
-
-    # re-label streams to be consecutive integers
-    unique, counts = np.unique(stream_raster.data, return_counts=True)
-    new_id = 1
-    for stream_id in unique:
-        if stream_id == 0:
-            continue
-        stream_raster.data[stream_raster.data == stream_id] = new_id
-        new_id += 1
+    # drop any small streams (< 2 pixels) and re-label the remaining streams
+    # to be consecutive integers, with one lookup table indexed by stream ID
+    keep = np.concatenate([[False], link_sizes >= 2])
+    lookup = np.zeros(len(keep), dtype=stream_raster.dtype)
+    lookup[keep] = np.arange(1, keep.sum() + 1)
+    stream_raster.data = lookup[stream_raster.data]
     return stream_raster
 
 
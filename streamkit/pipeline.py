@@ -0,0 +1,366 @@
+"""
+Declarative pipeline that runs streamkit stages and persists their outputs,
+so unchanged stages are skipped and interrupted runs resume where they
+stopped.
+"""
+
+from dataclasses import dataclass, field
+import hashlib
+import json
+import os
+import pickle
+from typing import Callable, Optional, Sequence
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from streamkit._internal.cache import raster_key
+from streamkit.data import get_huc_data
+from streamkit.mainstem import label_mainstem
+from streamkit.nhd import rasterize_nhd
+from streamkit.nx_convert import vector_streams_to_networkx
+from streamkit.rasterstore import read_raster, write_raster
+from streamkit.strahler import strahler_order
+from streamkit.streamlink import link_streams
+from streamkit.upstream_length import upstream_length
+from streamkit.vectorize_streams import vectorize_streams
+from streamkit.watershed import compute_hand, flow_accumulation_workflow
+from streamkit.xs import network_cross_sections
+
+
+@dataclass
+class Stage:
+    """A single step of a Pipeline.
+
+    The stage calls func(*inputs, **params) and stores the result under the
+    names in outputs (func must return a tuple when there is more than one
+    output).
+
+    Args:
+        name: Unique name of the stage, also used as its directory name.
+        func: Function to run.
+        inputs: Names of the artifacts passed positionally to func. Either
+            pipeline inputs or outputs of earlier stages.
+        outputs: Names given to the values returned by func.
+        params: Keyword arguments passed to func. Part of the cache key.
+    """
+
+    name: str
+    func: Callable
+    inputs: tuple = ()
+    outputs: tuple = ()
+    params: dict = field(default_factory=dict)
+
+
+class Pipeline:
+    """Run a sequence of stages with on-disk caching of every output.
+
+    Each stage is keyed on a hash of its function, parameters, and the keys
+    of its inputs (pipeline inputs are hashed by content), so a stage whose
+    inputs and parameters are unchanged is loaded from workdir instead of
+    recomputed. A stage's outputs are only recorded as complete once all of
+    them are written, so a crashed run resumes at the stage that was
+    interrupted. Changes to the code of a stage function are not detected;
+    use a new workdir after upgrading.
+
+    Rasters are stored as memory-mapped arrays (see RasterStore), and once a
+    stage has written them later stages read them from the page cache rather
+    than holding them in memory. (Geo)DataFrames are stored as (Geo)Parquet,
+    and any other value (e.g. networkx graphs) with pickle.
+
+    Args:
+        stages: Stages in execution order.
+        workdir: Directory where stage outputs are persisted.
+    """
+
+    def __init__(self, stages: Sequence[Stage], workdir: str):
+        names = [stage.name for stage in stages]
+        if len(set(names)) != len(names):
+            raise ValueError("Stage names must be unique")
+        self.stages = list(stages)
+        self.workdir = workdir
+        self.executed = []
+        self.paths = {}
+
+    def run(self, targets: Optional[Sequence[str]] = None, **inputs) -> dict:
+        """Run the pipeline.
+
+        Args:
+            targets: Names of the artifacts to return. If None, all artifacts
+                are returned.
+            **inputs: Values of the pipeline inputs, by name.
+        Returns:
+            Dictionary of artifact name to value. The files backing every
+            stage output are available afterwards in pipeline.paths.
+        """
+        self.executed = []
+        self.paths = paths = {}
+        keys = {name: _value_key(value) for name, value in inputs.items()}
+        values = dict(inputs)
+
+        def get(name):
+            if name not in values:
+                values[name] = _load(paths[name])
+            return values[name]
+
+        for stage in self.stages:
+            missing = [name for name in stage.inputs if name not in keys]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' is missing inputs {missing}")
+
+            key = _stage_key(stage, [keys[name] for name in stage.inputs])
+            stage_dir = os.path.join(self.workdir, stage.name, key)
+            manifest = _read_manifest(stage_dir)
+            if manifest is None:
+                result = stage.func(
+                    *[get(name) for name in stage.inputs], **stage.params
+                )
+                if len(stage.outputs) == 1:
+                    result = (result,)
+                manifest = _write_outputs(stage_dir, stage.outputs, result)
+                for name, value in zip(stage.outputs, result):
+                    if isinstance(value, xr.DataArray):
+                        # swap the in-memory raster for its memory-mapped copy
+                        value = _load(os.path.join(stage_dir, manifest[name]))
+                    values[name] = value
+                self.executed.append(stage.name)
+            else:
+                # outputs of skipped stages are only read when needed
+                for name in stage.outputs:
+                    values.pop(name, None)
+
+            for name in stage.outputs:
+                keys[name] = f"{key}:{name}"
+                paths[name] = os.path.join(stage_dir, manifest[name])
+
+        if targets is None:
+            targets = list(keys)
+        return {name: get(name) for name in targets}
+
+
+def huc_pipeline(
+    workdir: str,
+    nhd_layer: str = "flowline_mr",
+    crs: str = "EPSG:4326",
+    dem_resolution: int = 10,
+    xs_interval: float = 100,
+    xs_width: float = 1000,
+    cache=None,
+) -> Pipeline:
+    """Build the standard pipeline from a HUC ID to stream network products.
+
+    Downloads flowlines and a DEM for the HUC, computes flow directions and
+    accumulation, aligns the NHD flowlines to the DEM, vectorizes the stream
+    links, computes strahler order, upstream length and mainstem labels,
+    cross-sections along every link, and HAND.
+
+    Args:
+        workdir: Directory where stage outputs are persisted.
+        nhd_layer: The National Hydrography Dataset layer name for flowlines.
+        crs: The coordinate reference system for the downloaded data.
+        dem_resolution: The spatial resolution of the DEM in meters.
+        xs_interval: Distance between cross-sections along the streams.
+        xs_width: Width of each cross-section.
+        cache: An optional DataCache for the downloads.
+    Returns:
+        A Pipeline to run with pipeline.run(hucid=...). Its artifacts are
+        flowlines, dem, conditioned_dem, flow_directions, flow_accumulation,
+        streams, stream_lines, network, cross_sections, and hand.
+    """
+    stages = [
+        Stage(
+            "download",
+            get_huc_data,
+            inputs=("hucid",),
+            outputs=("flowlines", "dem"),
+            params={
+                "nhd_layer": nhd_layer,
+                "crs": crs,
+                "dem_resolution": dem_resolution,
+                "cache": cache,
+            },
+        ),
+        Stage(
+            "hydrology",
+            flow_accumulation_workflow,
+            inputs=("dem",),
+            outputs=("conditioned_dem", "flow_directions", "flow_accumulation"),
+        ),
+        Stage(
+            "streams",
+            rasterize_nhd,
+            inputs=("flowlines", "dem", "flow_directions"),
+            outputs=("streams",),
+        ),
+        Stage(
+            "vectorize",
+            vectorize_streams,
+            inputs=("streams", "flow_directions", "flow_accumulation"),
+            outputs=("stream_lines",),
+        ),
+        Stage(
+            "network",
+            _network,
+            inputs=("stream_lines",),
+            outputs=("network",),
+        ),
+        Stage(
+            "cross_sections",
+            _cross_sections,
+            inputs=("stream_lines",),
+            outputs=("cross_sections",),
+            params={"interval_distance": xs_interval, "width": xs_width},
+        ),
+        Stage(
+            "hand",
+            compute_hand,
+            inputs=("conditioned_dem", "flow_directions", "streams"),
+            outputs=("hand",),
+        ),
+    ]
+    return Pipeline(stages, workdir)
+
+
+def dem_pipeline(
+    workdir: str,
+    min_accumulation: float = 1000,
+    xs_interval: float = 100,
+    xs_width: float = 1000,
+) -> Pipeline:
+    """Build the standard pipeline from a DEM to stream network products.
+
+    Like huc_pipeline, but starts from a DEM and derives the stream network
+    from flow accumulation instead of NHD flowlines.
+
+    Args:
+        workdir: Directory where stage outputs are persisted.
+        min_accumulation: Flow accumulation (in cells) above which a cell is
+            considered part of the stream network.
+        xs_interval: Distance between cross-sections along the streams.
+        xs_width: Width of each cross-section.
+    Returns:
+        A Pipeline to run with pipeline.run(dem=...). Its artifacts are dem,
+        conditioned_dem, flow_directions, flow_accumulation, streams,
+        stream_lines, network, cross_sections, and hand.
+    """
+    stages = []
+    for stage in huc_pipeline(
+        workdir, xs_interval=xs_interval, xs_width=xs_width
+    ).stages:
+        if stage.name == "download":
+            continue
+        if stage.name == "streams":
+            stage = Stage(
+                "streams",
+                _accumulation_streams,
+                inputs=("flow_directions", "flow_accumulation"),
+                outputs=("streams",),
+                params={"min_accumulation": min_accumulation},
+            )
+        stages.append(stage)
+    return Pipeline(stages, workdir)
+
+
+def _accumulation_streams(flow_directions, flow_accumulation, min_accumulation):
+    streams = flow_directions.copy(
+        data=(flow_accumulation.data > min_accumulation).astype(np.uint8)
+    )
+    return link_streams(streams, flow_directions)
+
+
+def _network(stream_lines):
+    graph = vector_streams_to_networkx(stream_lines)
+    graph = strahler_order(graph)
+    graph = upstream_length(graph)
+    return label_mainstem(graph)
+
+
+def _cross_sections(stream_lines, interval_distance, width):
+    return network_cross_sections(
+        stream_lines.geometry,
+        interval_distance,
+        width,
+        linestring_ids=stream_lines["stream_id"].values,
+    )
+
+
+def _value_key(value):
+    if isinstance(value, xr.DataArray):
+        return raster_key(value)
+    if isinstance(value, (str, int, float, bool, type(None))):
+        payload = repr(value).encode()
+    else:
+        payload = pickle.dumps(value)
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _stage_key(stage, input_keys):
+    payload = json.dumps(
+        {
+            "name": stage.name,
+            "func": f"{stage.func.__module__}.{stage.func.__qualname__}",
+            "params": stage.params,
+            "inputs": input_keys,
+            "outputs": list(stage.outputs),
+        },
+        sort_keys=True,
+        default=repr,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def _read_manifest(stage_dir):
+    path = os.path.join(stage_dir, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_outputs(stage_dir, names, values):
+    if len(values) != len(names):
+        raise ValueError(f"Expected {len(names)} outputs, got {len(values)}")
+    os.makedirs(stage_dir, exist_ok=True)
+    manifest = {}
+    for name, value in zip(names, values):
+        manifest[name] = _save(os.path.join(stage_dir, name), value)
+
+    # the manifest is written last, marking the stage as complete
+    tmp_path = os.path.join(stage_dir, ".manifest.json")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(stage_dir, "manifest.json"))
+    return manifest
+
+
+def _save(path, value):
+    """Write value next to path with a suffix for its type, returning the
+    file name."""
+    if isinstance(value, xr.DataArray):
+        path += ".npy"
+        write_raster(path, value)
+    elif isinstance(value, pd.DataFrame):
+        path += ".parquet"
+        value.to_parquet(path)
+    else:
+        path += ".pickle"
+        with open(path, "wb") as f:
+            pickle.dump(value, f)
+    return os.path.basename(path)
+
+
+def _load(path):
+    if path.endswith(".npy"):
+        # copy-on-write, so callers can modify the values without touching
+        # the stored stage output
+        return read_raster(path, mode="c")
+    if path.endswith(".parquet"):
+        try:
+            return gpd.read_parquet(path)
+        except ValueError:
+            # not a GeoParquet file
+            return pd.read_parquet(path)
+    with open(path, "rb") as f:
+        return pickle.load(f)
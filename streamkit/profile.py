@@ -1,8 +1,13 @@
+from typing import Iterator, Sequence
+
 import numpy as np
 import geopandas as gpd
 import pandas as pd
 
+from streamkit.instrument import _report_progress, _stage
+
 
+@_stage("sample_cross_sections")
 def sample_cross_sections(
     xs_linestrings: gpd.GeoDataFrame, point_interval: float
 ) -> gpd.GeoDataFrame:
@@ -32,8 +37,34 @@ def sample_cross_sections(
     if "xs_id" not in xs_linestrings.columns:
         xs_linestrings["xs_id"] = np.arange(1, len(xs_linestrings) + 1)
 
-    xs_points = []
-    for xs_id, xs_linestring in xs_linestrings.groupby("xs_id"):
+    return gpd.GeoDataFrame(
+        pd.concat(iter_sample_cross_sections(xs_linestrings, point_interval)),
+        crs=xs_linestrings.crs,
+        geometry="geometry",
+    ).reset_index(drop=True)
+
+
+def iter_sample_cross_sections(
+    xs_linestrings: gpd.GeoDataFrame, point_interval: float
+) -> Iterator[gpd.GeoDataFrame]:
+    """Generate profile points one cross-section at a time.
+
+    Like sample_cross_sections, but yields the points of each cross-section
+    as they are created, e.g. to stream them to a file with
+    write_geoparquet. xs_linestrings must have an 'xs_id' column.
+
+    Args:
+        xs_linestrings: GeoDataFrame containing LineString geometries representing
+            cross-sections.
+        point_interval: Spacing between points along each cross-section, in the
+            units of the GeoDataFrame's CRS.
+
+    Yields:
+        GeoDataFrames of Point geometries with the columns of
+        sample_cross_sections.
+    """
+    groups = xs_linestrings.groupby("xs_id")
+    for i, (xs_id, xs_linestring) in enumerate(groups):
         for _, linestring in xs_linestring.iterrows():
             points = _points_along_linestring(
                 linestring.geometry, point_interval, crs=xs_linestrings.crs
@@ -43,11 +74,8 @@ def sample_cross_sections(
             for col in xs_linestring.columns:
                 if col != "geometry":
                     points[col] = linestring[col]
-            xs_points.append(points)
-
-    return gpd.GeoDataFrame(
-        pd.concat(xs_points), crs=xs_linestrings.crs, geometry="geometry"
-    ).reset_index(drop=True)
+            yield points
+        _report_progress("sample_cross_sections", i + 1, groups.ngroups)
 
 
 def _points_along_linestring(linestring, interval, crs=None):
@@ -75,3 +103,132 @@ def _points_along_linestring(linestring, interval, crs=None):
         },
         crs=crs,
     )
+
+
+@_stage("cross_section_metrics")
+def cross_section_metrics(
+    profiles: pd.DataFrame, stages: Sequence[float], value_column: str = "hand"
+) -> pd.DataFrame:
+    """Compute valley geometry metrics of every cross-section from its
+    sampled profile.
+
+    Heights are measured from the value at the center of each cross-section
+    (the point closest to distance 0, normally on the channel). At each
+    stage height, the flooded section is the run of points around the
+    center lower than the stage, with its edges linearly interpolated
+    between the last point below and the first point above the stage. Its
+    width reaches the end of the profile on a side where no point rises
+    above the stage.
+
+    All cross-sections are processed together with segmented NumPy
+    reductions over the long-format table, so millions of profile points
+    take seconds.
+
+    Args:
+        profiles: Long-format profile table with an xs_id, a distance (from
+            the center, as from sample_cross_sections), and a value column,
+            one row per profile point. Rows with a NaN value are ignored.
+        stages: Stage heights above the center, in the units of the values.
+        value_column: Column of the sampled values, e.g. HAND or elevation.
+    Returns:
+        A DataFrame indexed by xs_id with columns:
+            - left_bank_height, right_bank_height: Height of the highest
+              point on the negative and positive side of the center (NaN if
+              the side has no points)
+            - width_{stage}: Width of the flooded section at each stage (0 if
+              the center is above the stage)
+            - area_{stage}: Cross-sectional area of the flooded section below
+              each stage
+    """
+    profiles = profiles[profiles[value_column].notna()]
+    codes, xs_ids = pd.factorize(profiles["xs_id"], sort=True)
+    distance = profiles["distance"].to_numpy(dtype=np.float64)
+    order = np.lexsort((distance, codes))
+    codes = codes[order]
+    distance = distance[order]
+    values = profiles[value_column].to_numpy(dtype=np.float64)[order]
+
+    # cross-sections are contiguous runs of rows, sorted by distance
+    n = len(codes)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if n else codes
+    ends = np.r_[starts[1:], n]
+    segment = np.repeat(np.arange(len(starts)), ends - starts)
+
+    # center: first point with the smallest absolute distance
+    abs_distance = np.abs(distance)
+    closest = np.minimum.reduceat(abs_distance, starts) if n else abs_distance
+    candidates = np.flatnonzero(abs_distance == closest[segment])
+    _, first = np.unique(segment[candidates], return_index=True)
+    center = candidates[first]
+    heights = values - values[center][segment]
+
+    index = np.arange(n)
+    left = index < center[segment]
+    right = index > center[segment]
+    columns = {}
+    for side, mask in (("left", left), ("right", right)):
+        highest = (
+            np.maximum.reduceat(np.where(mask, heights, -np.inf), starts)
+            if n
+            else heights
+        )
+        columns[f"{side}_bank_height"] = np.where(highest > -np.inf, highest, np.nan)
+
+    # pairs of consecutive points of the same cross-section
+    pairs = np.flatnonzero(codes[1:] == codes[:-1]) if n else codes
+    step = distance[pairs + 1] - distance[pairs]
+
+    for stage in stages:
+        above = heights > stage
+        # nearest point above the stage at or before / at or after each point
+        last_above = np.maximum.accumulate(np.where(above, index, -1))
+        next_above = np.minimum.accumulate(np.where(above, index, n)[::-1])[::-1]
+        low = last_above[center]
+        high = next_above[center]
+        closed_low = low >= starts
+        closed_high = high < ends
+        low = np.where(closed_low, low, starts)
+        high = np.where(closed_high, high, ends - 1)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            left_edge = np.where(
+                closed_low,
+                _crossing(distance, heights, low + closed_low, low, stage),
+                distance[low],
+            )
+            right_edge = np.where(
+                closed_high,
+                _crossing(distance, heights, high - closed_high, high, stage),
+                distance[high],
+            )
+        flooded = ~above[center]
+        columns[f"width_{stage:g}"] = np.where(flooded, right_edge - left_edge, 0.0)
+
+        # depth below the stage at both ends of each pair; pairs in the
+        # flooded section have at least one end under water
+        depth0 = stage - heights[pairs]
+        depth1 = stage - heights[pairs + 1]
+        wet = np.maximum(depth0, depth1)
+        dry = np.minimum(depth0, depth1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            pair_area = np.where(
+                dry >= 0,
+                (depth0 + depth1) / 2 * step,
+                wet / 2 * wet / (wet - dry) * step,
+            )
+        in_section = (pairs >= low[segment[pairs]]) & (pairs < high[segment[pairs]])
+        in_section &= wet > 0
+        columns[f"area_{stage:g}"] = np.bincount(
+            segment[pairs[in_section]],
+            weights=pair_area[in_section],
+            minlength=len(starts),
+        )
+
+    return pd.DataFrame(columns, index=pd.Index(xs_ids, name="xs_id"))
+
+
+def _crossing(distance, heights, inside, outside, stage):
+    # distance where the height crosses the stage between the points inside
+    # (at or below it) and outside (above it)
+    fraction = (stage - heights[inside]) / (heights[outside] - heights[inside])
+    return distance[inside] + fraction * (distance[outside] - distance[inside])
@@ -0,0 +1,161 @@
+"""
+Memory-mapped storage for intermediate rasters.
+"""
+
+import json
+import os
+
+from affine import Affine
+import numpy as np
+import rioxarray  # noqa: F401
+import xarray as xr
+
+_SIDECAR_SUFFIX = ".json"
+
+
+class RasterStore:
+    """Directory of rasters stored as raw memory-mappable arrays.
+
+    Each raster is written as an uncompressed .npy file with a JSON sidecar
+    holding its georeferencing (dims, transform, CRS, and nodata). Rasters
+    read from the store are backed by np.memmap, so their values are paged
+    in from disk on access instead of being loaded into memory, numba
+    kernels can operate on them directly, and processes reading the same
+    raster share its pages through the operating system's page cache.
+
+    Args:
+        directory: Directory where the rasters are stored.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def __repr__(self):
+        return f"RasterStore({self.directory!r})"
+
+    def __contains__(self, name: str) -> bool:
+        return os.path.exists(self.path(name) + _SIDECAR_SUFFIX)
+
+    def path(self, name: str) -> str:
+        """Return the path of the .npy file of a raster."""
+        return os.path.join(self.directory, f"{name}.npy")
+
+    def write(self, name: str, raster: xr.DataArray) -> xr.DataArray:
+        """Write a raster to the store and return it memory-mapped."""
+        write_raster(self.path(name), raster)
+        return self.read(name)
+
+    def read(self, name: str, mode: str = "r") -> xr.DataArray:
+        """Open a raster of the store as a memory-mapped DataArray.
+
+        Args:
+            name: Name of the raster.
+            mode: np.memmap mode. "r" is read-only, "c" allows in-memory
+                changes that are never written back, "r+" writes changes to
+                the store.
+        """
+        if name not in self:
+            raise KeyError(f"{name} is not in {self}")
+        return read_raster(self.path(name), mode)
+
+    def create(
+        self, name: str, like: xr.DataArray, dtype=None, nodata=None
+    ) -> xr.DataArray:
+        """Create a zero-filled raster with the grid of like, memory-mapped
+        for writing (e.g. as the output array of a numba kernel).
+
+        Changes are written to the store as the array is modified; call
+        .data.flush() to make sure they are on disk.
+
+        Args:
+            name: Name of the raster.
+            like: Raster whose dims, transform, and CRS are used.
+            dtype: Data type of the raster. Defaults to the dtype of like.
+            nodata: Nodata value of the raster.
+        """
+        path = self.path(name)
+        dtype = like.dtype if dtype is None else dtype
+        arr = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=like.shape)
+        del arr
+        _write_sidecar(path, like, nodata)
+        return read_raster(path, "r+")
+
+    def delete(self, name: str):
+        """Remove a raster from the store."""
+        for path in (self.path(name) + _SIDECAR_SUFFIX, self.path(name)):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def write_raster(path: str, raster: xr.DataArray):
+    """Write a 2D raster to a .npy file with a JSON georeferencing sidecar.
+
+    Chunked (dask-backed) rasters are written one chunk at a time.
+
+    Args:
+        path: Path of the .npy file.
+        raster: Raster to write.
+    """
+    if raster.ndim != 2:
+        raise ValueError("Only 2D rasters can be stored")
+
+    # write then rename so an interrupted write never leaves a partial raster
+    directory, filename = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{filename}")
+    arr = np.lib.format.open_memmap(
+        tmp_path, mode="w+", dtype=raster.dtype, shape=raster.shape
+    )
+    if raster.chunks is not None:
+        raster.data.store(arr, lock=False)
+    else:
+        arr[:] = raster.data
+    arr.flush()
+    del arr
+    os.replace(tmp_path, path)
+    # the sidecar is written last, marking the raster as complete
+    _write_sidecar(path, raster, raster.rio.nodata)
+
+
+def read_raster(path: str, mode: str = "r") -> xr.DataArray:
+    """Open a raster written by write_raster as a memory-mapped DataArray.
+
+    Args:
+        path: Path of the .npy file.
+        mode: np.memmap mode ("r", "c", or "r+").
+    Returns:
+        DataArray backed by np.memmap, with its CRS, transform, and nodata.
+    """
+    with open(path + _SIDECAR_SUFFIX) as f:
+        meta = json.load(f)
+
+    arr = np.load(path, mmap_mode=mode)
+    a, b, c, d, e, f = meta["transform"]
+    nrows, ncols = arr.shape
+    coords = {
+        meta["dims"][0]: f + e * (np.arange(nrows) + 0.5),
+        meta["dims"][1]: c + a * (np.arange(ncols) + 0.5),
+    }
+    raster = xr.DataArray(arr, dims=meta["dims"], coords=coords, name=meta["name"])
+    # in place, since copying the DataArray would load the memmap
+    raster.rio.write_transform(Affine(a, b, c, d, e, f), inplace=True)
+    if meta["crs"] is not None:
+        raster.rio.write_crs(meta["crs"], inplace=True)
+    if meta["nodata"] is not None:
+        raster.rio.write_nodata(meta["nodata"], inplace=True)
+    return raster
+
+
+def _write_sidecar(path, raster, nodata):
+    crs = raster.rio.crs
+    meta = {
+        "name": raster.name,
+        "dims": list(raster.dims),
+        "transform": list(raster.rio.transform())[:6],
+        "crs": crs.to_wkt() if crs is not None else None,
+        "nodata": None if nodata is None else np.asarray(nodata).item(),
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, path + _SIDECAR_SUFFIX)
@@ -1,13 +1,33 @@
+from concurrent.futures import as_completed
+import os
+
+from numba import types
 import numpy as np
 import pandas as pd
 from rasterio.transform import xy
-import ruptures as rpt
 import xarray as xr
 
-from streamkit.streamroute import route_stream
+from streamkit._internal.parallel import process_pool
+from streamkit.instrument import Cancelled, _report_progress, _stage
+from streamkit.jit import INDICES, LENGTHS, _kernel
+from streamkit.streamroute import route_links
 from streamkit.watershed import flow_accumulation_workflow
 
-
+_REACH_TABLE_COLUMNS = [
+    "reach_id",
+    "stream_id",
+    "reach_number",
+    "n_cells",
+    "length",
+    "median_slope",
+    "start_row",
+    "start_col",
+    "end_row",
+    "end_col",
+]
+
+
+@_stage("delineate_reaches")
 def delineate_reaches(
     stream_raster: xr.DataArray,
     dem: xr.DataArray,
@@ -15,7 +35,11 @@ def delineate_reaches(
     min_length: float = 500,
     smooth_window: int | None = None,
     threshold_degrees: float = 1.0,
-) -> xr.DataArray:
+    flow_directions: xr.DataArray | None = None,
+    flow_accumulation: xr.DataArray | None = None,
+    n_workers: int | None = 1,
+    return_table: bool = False,
+) -> xr.DataArray | tuple[xr.DataArray, pd.DataFrame]:
     """Segment stream networks into reaches based on slope change points.
 
     Uses the PELT (Pruned Exact Linear Time) changepoint detection algorithm
@@ -33,39 +57,179 @@ def delineate_reaches(
             If None, no smoothing is applied.
         threshold_degrees: Merge adjacent reaches if slope difference is below this
             threshold in degrees.
+        flow_directions: Precomputed flow directions for the DEM (ESRI d8
+            encoding). If None, computed with flow_accumulation_workflow().
+        flow_accumulation: Precomputed flow accumulation for the DEM. If None,
+            computed with flow_accumulation_workflow().
+        n_workers: Number of processes used for the changepoint fits. Links
+            are independent, so they are fitted in parallel when greater than
+            1. If None, uses all available cores.
+        return_table: Whether to also return a table of reach attributes.
 
     Returns:
-        A raster where each pixel value represents a unique reach ID (0 for non-stream pixels). Reach IDs are computed as reach_number + stream_id * 1000.
+        A raster where each pixel value represents a unique reach ID (0 for non-stream pixels). Reach IDs are consecutive integers starting at 1, ordered by stream ID and position along the stream.
+        If return_table is True, a tuple of the raster and a DataFrame with one row per reach containing:
+            - reach_id: ID of the reach in the raster
+            - stream_id: ID of the stream segment the reach belongs to
+            - reach_number: Position of the reach along its stream segment (from 0)
+            - n_cells: Number of cells in the reach
+            - length: Length of the reach along the stream in map units
+            - median_slope: Median slope of the reach in degrees
+            - start_row, start_col, end_row, end_col: First and last cell of the reach
     """
 
-    _, flow_dir, flow_acc = flow_accumulation_workflow(dem)
+    if flow_directions is None or flow_accumulation is None:
+        _, flow_directions, flow_accumulation = flow_accumulation_workflow(dem)
+    flow_dir, flow_acc = flow_directions, flow_accumulation
+
+    # roughly convert min_length in meters to number of points
+    min_size = int(min_length / flow_dir.rio.resolution()[0])
+
+    with _stage("routing") as stage:
+        paths = route_links(stream_raster, flow_dir, flow_acc)
+        stage.count = len(paths)
+    with _stage("profiles") as stage:
+        profiles = {
+            stream_val: _create_stream_points(path, flow_acc.rio.transform(), dem)
+            for stream_val, path in paths.items()
+        }
+        stage.count = len(profiles)
+    with _stage("segmentation") as stage:
+        reach_ids = _segment_profiles(
+            {val: df["slope_degrees"].values for val, df in profiles.items()},
+            n_workers,
+            penalty=penalty,
+            min_size=min_size,
+            smooth_window=smooth_window,
+            threshold_degrees=threshold_degrees,
+        )
+        stage.count = len(reach_ids)
+
+    with _stage("outputs"):
+        points = [
+            df.assign(stream_id=val, reach_number=reach_ids[val])
+            for val, df in profiles.items()
+        ]
+        reaches, reach_table = _reach_outputs(stream_raster, points)
+    if return_table:
+        return reaches, reach_table
+    return reaches
 
+
+def _reach_outputs(stream_raster, points):
+    """Build the reach raster and reach table from the segmented profiles of
+    every link."""
     reaches = stream_raster.copy(data=np.zeros_like(stream_raster, dtype=np.uint32))
-    for stream_val in np.unique(stream_raster):
-        if stream_val == 0 or np.isnan(stream_val):
-            continue
-        else:
-            stream_df = _create_stream_points(
-                stream_raster == stream_val, flow_dir, flow_acc, dem
-            )
-            # roughly convert min_length in meters to number of points
-            min_size = int(min_length / flow_dir.rio.resolution()[0])
-            stream_df = _pelt_reaches(
-                stream_df,
-                penalty=penalty,
-                min_size=min_size,
-                smooth_window=smooth_window,
-            )
-            stream_df = _merge_reaches_by_threshold(
-                stream_df, threshold_degrees=threshold_degrees
-            )
-            stream_df["reach_val"] = stream_df["reach_id"] + stream_val * 1000
-            rows, cols = stream_df["row"].values, stream_df["col"].values
-            reaches.data[rows, cols] = stream_df["reach_val"].values
-    return reaches
+    if len(points) == 0:
+        return reaches, pd.DataFrame(columns=_REACH_TABLE_COLUMNS)
+    points = pd.concat(points, ignore_index=True)
+    rows, cols = points["row"].values, points["col"].values
+
+    # the profile of a link may end with the first cell of the next link; it
+    # counts towards the slope statistics of the last reach but is not part of
+    # the link
+    in_link = stream_raster.data[rows, cols] == points["stream_id"].values
+    points["reach_number"] = points["reach_number"].where(in_link).ffill()
+    points["reach_number"] = points["reach_number"].astype(np.int64)
+
+    # sequential reach IDs, in order of stream ID and position along the stream
+    key = points[["stream_id", "reach_number"]]
+    points["reach_id"] = key.ne(key.shift()).any(axis=1).cumsum()
+    reaches.data[rows[in_link], cols[in_link]] = points["reach_id"].values[in_link]
+
+    grouped = points.groupby("reach_id")
+    cells = points[in_link].groupby("reach_id")
+    reach_table = pd.DataFrame(
+        {
+            "stream_id": grouped["stream_id"].first(),
+            "reach_number": grouped["reach_number"].first(),
+            "n_cells": cells.size(),
+            "start_distance": grouped["distance"].first(),
+            "end_distance": grouped["distance"].last(),
+            "median_slope": grouped["slope_degrees"].median(),
+            "start_row": cells["row"].first(),
+            "start_col": cells["col"].first(),
+            "end_row": cells["row"].last(),
+            "end_col": cells["col"].last(),
+        }
+    )
+    # a reach runs up to where the next reach on the same stream starts
+    same_stream = reach_table["stream_id"].eq(reach_table["stream_id"].shift(-1))
+    end_distance = reach_table["end_distance"].where(
+        ~same_stream, reach_table["start_distance"].shift(-1)
+    )
+    reach_table["length"] = end_distance - reach_table["start_distance"]
+    reach_table = reach_table.reset_index()[_REACH_TABLE_COLUMNS]
+    return reaches, reach_table
+
+
+def _segment_profiles(slopes, n_workers, **params):
+    """Run the changepoint segmentation for every link, fanning the links out
+    across a process pool in chunks of roughly equal total length."""
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    reach_ids = {}
+    if n_workers <= 1 or len(slopes) <= 1:
+        for val, s in slopes.items():
+            reach_ids[val] = _segment_slopes(s, **params)
+            _report_progress("segment_reaches", len(reach_ids), len(slopes))
+        return reach_ids
+
+    chunks = _chunk_by_size(slopes, n_chunks=4 * n_workers)
+    with process_pool(n_workers) as executor:
+        futures = [executor.submit(_segment_chunk, chunk, params) for chunk in chunks]
+        try:
+            for future in as_completed(futures):
+                reach_ids.update(future.result())
+                _report_progress("segment_reaches", len(reach_ids), len(slopes))
+        except Cancelled:
+            # don't wait for the chunks that have not started
+            for future in futures:
+                future.cancel()
+            raise
+    return reach_ids
+
+
+def _chunk_by_size(slopes, n_chunks):
+    # largest links first, so the long fits start early and the small ones
+    # fill in the gaps; small links are grouped to amortize task overhead
+    order = sorted(slopes, key=lambda val: len(slopes[val]), reverse=True)
+    target = sum(len(s) for s in slopes.values()) / n_chunks
+    chunks = []
+    chunk, chunk_size = {}, 0
+    for val in order:
+        chunk[val] = slopes[val]
+        chunk_size += len(slopes[val])
+        if chunk_size >= target:
+            chunks.append(chunk)
+            chunk, chunk_size = {}, 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _segment_chunk(chunk, params):
+    return {val: _segment_slopes(s, **params) for val, s in chunk.items()}
+
+
+def _segment_slopes(slopes, penalty, min_size, smooth_window, threshold_degrees):
+    stream_df = pd.DataFrame({"slope_degrees": slopes})
+    stream_df = _pelt_reaches(
+        stream_df,
+        penalty=penalty,
+        min_size=min_size,
+        smooth_window=smooth_window,
+    )
+    stream_df = _merge_reaches_by_threshold(
+        stream_df, threshold_degrees=threshold_degrees
+    )
+    return stream_df["reach_id"].values
 
 
 def _pelt_reaches(stream_df, penalty, min_size, smooth_window, model="rbf"):
+    # ruptures pulls in scipy.stats, which is slow to import
+    import ruptures as rpt
+
     if len(stream_df) < min_size:
         stream_df["reach_id"] = 0
         return stream_df
@@ -100,6 +264,15 @@ def _merge_reaches_by_threshold(stream_df, threshold_degrees=1.0):
     """
     Merge adjacent reaches if slope change is less than threshold.
 
+    Boundaries are visited in order along the stream. Merging a reach into
+    its upstream neighbour only changes the median of that neighbour, so
+    after a merge only the boundary just before it needs another look and the
+    scan never has to restart from the beginning. Every reach is a run of
+    consecutive slope values (grouped by reach), and so is a merged reach, so
+    its median is a range median query, answered in O(log n) by a wavelet
+    matrix over the ranks of the values. Merging k reaches of n points takes
+    O(n log n) to build the index and O(k log n) for the scan.
+
     Parameters:
     -----------
     stream_df : pd.DataFrame
@@ -112,50 +285,147 @@ def _merge_reaches_by_threshold(stream_df, threshold_degrees=1.0):
     stream_df : pd.DataFrame
         DataFrame with updated reach_id column
     """
-    # Calculate median slope for each reach
-    reach_stats = stream_df.groupby("reach_id")["slope_degrees"].median()
-
-    # Keep merging until all boundaries meet threshold
-    while True:
-        merged = False
-
-        # Check each boundary between adjacent reaches
-        for reach_id in sorted(reach_stats.index[:-1]):
-            next_reach_id = reach_id + 1
-
-            if next_reach_id not in reach_stats.index:
-                continue
-
-            slope_diff = abs(reach_stats[reach_id] - reach_stats[next_reach_id])
-
-            # If difference is below threshold, merge
-            if slope_diff < threshold_degrees:
-                # Merge next_reach_id into reach_id
-                stream_df.loc[stream_df["reach_id"] == next_reach_id, "reach_id"] = (
-                    reach_id
-                )
+    reach_ids, inverse = np.unique(stream_df["reach_id"].values, return_inverse=True)
+    n_reaches = len(reach_ids)
+    if n_reaches == 0:
+        return stream_df
 
-                # Recalculate median slope for merged reach
-                reach_stats[reach_id] = stream_df[stream_df["reach_id"] == reach_id][
-                    "slope_degrees"
-                ].median()
-                reach_stats = reach_stats.drop(next_reach_id)
+    # slope values grouped by reach; reach i is values[bounds[i]:bounds[i + 1]]
+    order = np.argsort(inverse, kind="stable")
+    values = stream_df["slope_degrees"].values[order].astype(np.float64)
+    bounds = np.zeros(n_reaches + 1, dtype=np.int64)
+    bounds[1:] = np.cumsum(np.bincount(inverse, minlength=n_reaches))
 
-                merged = True
-                break  # Restart the loop after a merge
+    # rank of every value, NaNs last
+    sorter = np.argsort(values, kind="stable")
+    ranks = np.empty(len(values), dtype=np.int64)
+    ranks[sorter] = np.arange(len(values))
 
-        if not merged:
-            break  # No more merges possible
+    alive = _merge_reaches_numba(
+        values[sorter], ranks, bounds, float(threshold_degrees)
+    )
 
     # Renumber reach_ids to be sequential from 0
-    unique_reaches = sorted(stream_df["reach_id"].unique())
-    reach_map = {old_id: new_id for new_id, old_id in enumerate(unique_reaches)}
-    stream_df["reach_id"] = stream_df["reach_id"].map(reach_map)
+    new_ids = np.cumsum(alive) - 1
+    stream_df["reach_id"] = new_ids[inverse]
 
     return stream_df
 
 
-def _create_stream_points(stream_mask, flow_dir, flow_acc, dem):
+@_kernel((LENGTHS, INDICES, INDICES, types.float64))
+def _merge_reaches_numba(sorted_values, ranks, bounds, threshold):
+    """Whether each reach is kept after merging, in a single scan over the
+    boundaries, the reaches whose median values differ by less than the
+    threshold."""
+    n_reaches = len(bounds) - 1
+    zeros, n_zeros = _wavelet_matrix_numba(ranks)
+    # number of non-NaN values before each position; NaNs have the highest
+    # ranks, so the k-th smallest rank of a range is a value while k is
+    # below the number of values of the range
+    n_valid = 0
+    for k in range(len(sorted_values)):
+        if not np.isnan(sorted_values[k]):
+            n_valid += 1
+    valid = np.zeros(len(ranks) + 1, dtype=np.int64)
+    for k in range(len(ranks)):
+        valid[k + 1] = valid[k] + (ranks[k] < n_valid)
+
+    ends = bounds[1:].copy()
+    medians = np.empty(n_reaches)
+    for i in range(n_reaches):
+        medians[i] = _range_median_numba(
+            zeros, n_zeros, valid, sorted_values, bounds[i], ends[i]
+        )
+    alive = np.ones(n_reaches, dtype=np.bool_)
+
+    i = 0
+    while i < n_reaches - 1:
+        # a boundary is only considered while both of its reaches exist, a
+        # reach that absorbed its downstream neighbour is not compared with
+        # the next one
+        if alive[i] and alive[i + 1]:
+            if abs(medians[i] - medians[i + 1]) < threshold:
+                # merge reach i + 1 into reach i
+                ends[i] = ends[i + 1]
+                medians[i] = _range_median_numba(
+                    zeros, n_zeros, valid, sorted_values, bounds[i], ends[i]
+                )
+                alive[i + 1] = False
+                if i > 0:
+                    i -= 1
+                continue
+        i += 1
+    return alive
+
+
+@_kernel()
+def _wavelet_matrix_numba(ranks):
+    """Wavelet matrix of a permutation of 0..n-1: for every bit, from the
+    highest, the number of zero bits before each position (in the order of
+    that level) and the total number of zero bits."""
+    n = len(ranks)
+    levels = 1
+    while (1 << levels) < n:
+        levels += 1
+    zeros = np.empty((levels, n + 1), dtype=np.int32)
+    n_zeros = np.empty(levels, dtype=np.int64)
+    current = ranks.copy()
+    following = np.empty_like(current)
+    for level in range(levels):
+        bit = levels - 1 - level
+        count = 0
+        zeros[level, 0] = 0
+        for k in range(n):
+            if not (current[k] >> bit) & 1:
+                count += 1
+            zeros[level, k + 1] = count
+        n_zeros[level] = count
+        # stable partition on the bit: zeros first, then ones
+        z, o = 0, count
+        for k in range(n):
+            if (current[k] >> bit) & 1:
+                following[o] = current[k]
+                o += 1
+            else:
+                following[z] = current[k]
+                z += 1
+        current, following = following, current
+    return zeros, n_zeros
+
+
+@_kernel()
+def _range_kth_numba(zeros, n_zeros, lo, hi, k):
+    """k-th smallest (from 0) rank of positions lo to hi (exclusive)."""
+    levels = len(n_zeros)
+    rank = 0
+    for level in range(levels):
+        zeros_lo = zeros[level, lo]
+        zeros_hi = zeros[level, hi]
+        if k < zeros_hi - zeros_lo:
+            lo, hi = zeros_lo, zeros_hi
+        else:
+            k -= zeros_hi - zeros_lo
+            lo = n_zeros[level] + lo - zeros_lo
+            hi = n_zeros[level] + hi - zeros_hi
+            rank |= 1 << (levels - 1 - level)
+    return rank
+
+
+@_kernel()
+def _range_median_numba(zeros, n_zeros, valid, sorted_values, lo, hi):
+    """Median of the values of positions lo to hi (exclusive) ignoring NaNs,
+    NaN if there are none (matches pandas)."""
+    count = valid[hi] - valid[lo]
+    if count == 0:
+        return np.nan
+    upper = sorted_values[_range_kth_numba(zeros, n_zeros, lo, hi, count // 2)]
+    if count % 2:
+        return upper
+    lower = sorted_values[_range_kth_numba(zeros, n_zeros, lo, hi, count // 2 - 1)]
+    return (lower + upper) / 2
+
+
+def _create_stream_points(path, transform, dem):
     def calculate_gradient(elevations, distances):
         gradient = np.gradient(elevations, distances)
         slope_degrees = np.degrees(np.arctan(gradient))
@@ -167,12 +437,11 @@ def _create_stream_points(stream_mask, flow_dir, flow_acc, dem):
         distances = np.sqrt(dx**2 + dy**2)
         return np.cumsum(distances)
 
-    path = route_stream(stream_mask, flow_dir, flow_acc)
     rows, cols = zip(*path)
     rows = np.array(rows)
     cols = np.array(cols)
 
-    xs, ys = xy(flow_acc.rio.transform(), rows, cols, offset="center")
+    xs, ys = xy(transform, rows, cols, offset="center")
     stream_df = pd.DataFrame({"x": xs, "y": ys, "row": rows, "col": cols})
     stream_df["point_id"] = range(len(stream_df))
     stream_df["distance"] = calculate_distance_along_stream(xs, ys)
@@ -10,7 +10,8 @@ def gaussian_smooth_raster(
 
     Performs NaN-aware Gaussian filtering that conserves intensity by only
     redistributing values between non-NaN pixels. NaN pixels remain NaN in
-    the output.
+    the output. Chunked (dask-backed) rasters are smoothed lazily, chunk by
+    chunk, with an overlap of the kernel radius.
 
     Args:
         raster: Input raster to smooth.
@@ -25,6 +26,19 @@ def gaussian_smooth_raster(
     resolution = raster.rio.resolution()[0]
     radius_pixels = int(round(spatial_radius / resolution))
 
+    if raster.chunks is not None:
+        # cells beyond the edges are nan, which the filter treats like the
+        # constant padding it uses for in-memory arrays
+        smoothed = raster.data.map_overlap(
+            _filter_nan_gaussian_conserving,
+            depth=radius_pixels,
+            boundary=np.nan,
+            dtype=raster.dtype,
+            radius_pixels=radius_pixels,
+            sigma=sigma,
+        )
+        return raster.copy(data=smoothed)
+
     raster_copy = raster.copy(deep=True)
     raster_copy.data = _filter_nan_gaussian_conserving(
         raster_copy.data, radius_pixels, sigma
@@ -1,9 +1,16 @@
-import numba
 import numpy as np
+import pandas as pd
 import xarray as xr
 
-from streamkit._internal.dirmap import _make_numba_esri_dirmap
-from streamkit.streamnodes import find_stream_nodes
+from streamkit._internal import chunked
+from streamkit._internal.chunked import NO_EXIT
+from streamkit._internal.dirmap import _make_esri_dirmap
+from streamkit.flowdir import normalize_flow_directions
+from streamkit.jit import DIRMAP, FLOW_DIRECTIONS, INDICES, MASK, _kernel
+from streamkit.streamnodes import _stream_node_arrays
+from streamkit.streamtrace import trace_streams
+
+_NODE_KINDS = ("source", "confluence", "outlet")
 
 
 def link_streams(
@@ -11,52 +18,141 @@ def link_streams(
 ) -> xr.DataArray:
     """Assign unique IDs to stream segments between junctions.
 
+    If the rasters are chunked (dask-backed), they are read one chunk at a
+    time and the result is a lazy raster with the same chunks and the same
+    IDs as for in-memory rasters.
+
     Args:
         stream_raster: Binary or labeled stream network (non-zero values are
             streams, zero values are non-stream pixels).
         flow_directions: Flow direction raster in D8 format (ESRI convention).
 
     Returns:
-        A raster where each stream segment between junctions has a unique positive integer ID, with non-stream pixels as 0.
+        A uint32 raster where each stream segment between junctions has a unique positive integer ID, with non-stream pixels as 0.
     """
-    dirmap = _make_numba_esri_dirmap()
-    sources, confluences, _ = find_stream_nodes(stream_raster, flow_directions)
+    dirmap = _make_esri_dirmap()
+    flow_directions = normalize_flow_directions(flow_directions)
+    if chunked.is_chunked(flow_directions):
+        return _link_streams_chunked(stream_raster, flow_directions, dirmap)
+
+    sources, confluences, _ = _stream_node_arrays(stream_raster, flow_directions)
     link_arr = _link_streams_numba(
-        stream_raster.data, flow_directions.data, dirmap, sources, confluences
+        stream_raster.data != 0,
+        flow_directions.data,
+        dirmap,
+        *sources,
+        *confluences,
     )
     link_raster = flow_directions.copy(data=link_arr)
     return link_raster
 
 
-@numba.njit
-def _link_streams_numba(stream_arr, flow_directions_arr, dirmap, sources, confluences):
+def trace_stream_links(
+    points: list[tuple[int, int]], flow_directions: xr.DataArray
+) -> tuple[xr.DataArray, pd.DataFrame]:
+    """Trace streams from channel heads and assign link IDs in one pass.
+
+    Same result as trace_streams followed by link_streams, but the paths
+    are traced, their inflows counted, and their confluences found in a
+    single walk from the points, so the raster is not scanned for nodes.
+    If flow_directions is chunked (dask-backed), trace_streams and
+    link_streams are used instead.
+
+    Args:
+        points: List of (row, col) tuples of the starting points (i.e.
+            channel head locations).
+        flow_directions: Flow direction raster in D8 format (ESRI
+            convention).
+
+    Returns:
+        The link raster (as link_streams) and a DataFrame of the stream
+        nodes with kind ("source", "confluence", or "outlet"), row, col,
+        and stream_id columns, in row-major order within each kind.
+    """
+    link_raster, node_ids, _ = _trace_stream_links(points, flow_directions)
+    ncols = link_raster.shape[1]
+    ids = np.concatenate(node_ids)
+    kinds = np.repeat(np.arange(len(_NODE_KINDS)), [len(k) for k in node_ids])
+    stream_ids = link_raster.data.ravel()[ids]
+    if chunked.is_chunked(link_raster):
+        stream_ids = stream_ids.compute()
+    nodes = pd.DataFrame(
+        {
+            "kind": pd.Categorical.from_codes(kinds, _NODE_KINDS),
+            "row": ids // ncols,
+            "col": ids % ncols,
+            "stream_id": stream_ids.astype(np.int64),
+        }
+    )
+    return link_raster, nodes
+
+
+def _trace_stream_links(points, flow_directions):
+    """Like trace_stream_links, but return the link raster, the flat indices
+    of the sources, confluences, and outlets, and the number of cells of
+    every link, indexed by link ID - 1."""
+    dirmap = _make_esri_dirmap()
+    flow_directions = normalize_flow_directions(flow_directions)
+    points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+    if chunked.is_chunked(flow_directions):
+        link_raster = link_streams(
+            trace_streams(points, flow_directions), flow_directions
+        )
+        ncols = flow_directions.shape[1]
+        node_ids = [
+            rows * ncols + cols
+            for rows, cols in _stream_node_arrays(link_raster, flow_directions)
+        ]
+        link_sizes = np.bincount(np.asarray(link_raster.data).ravel())[1:]
+        return link_raster, node_ids, link_sizes
+
+    link_arr, *node_ids, link_sizes = _trace_link_streams_numba(
+        np.ascontiguousarray(points[:, 0]),
+        np.ascontiguousarray(points[:, 1]),
+        flow_directions.data,
+        dirmap,
+    )
+    return flow_directions.copy(data=link_arr), node_ids, link_sizes
+
+
+@_kernel((MASK, FLOW_DIRECTIONS, DIRMAP) + (INDICES,) * 4)
+def _link_streams_numba(
+    stream_mask,
+    flow_directions_arr,
+    dirmap,
+    source_rows,
+    source_cols,
+    confluence_rows,
+    confluence_cols,
+):
     """Assign unique IDs to stream links (segments between junctions)"""
     nrows, ncols = flow_directions_arr.shape
 
     # Create confluence lookup for faster checking
     confluence_arr = np.zeros((nrows, ncols), dtype=np.uint8)
-    for row, col in confluences:
-        confluence_arr[row, col] = 1
+    for k in range(len(confluence_rows)):
+        confluence_arr[confluence_rows[k], confluence_cols[k]] = 1
 
     # Assign link IDs starting from each source
     link_id = 1
-    link_arr = np.zeros((nrows, ncols), dtype=np.uint16)
+    link_arr = np.zeros((nrows, ncols), dtype=np.uint32)
 
-    for source_row, source_col in sources:
-        row, col = source_row, source_col
+    for k in range(len(source_rows)):
+        row, col = source_rows[k], source_cols[k]
 
         while True:
-            if link_arr[row, col] != 0 or stream_arr[row, col] == 0:
+            if link_arr[row, col] != 0 or not stream_mask[row, col]:
                 break
 
             link_arr[row, col] = link_id
 
             current_direction = flow_directions_arr[row, col]
-            if current_direction in (-1, -2, 0):
+            drow = dirmap[current_direction, 0]
+            dcol = dirmap[current_direction, 1]
+            if drow == 0 and dcol == 0:
                 link_id += 1
                 break
 
-            drow, dcol = dirmap[current_direction]
             next_row = row + drow
             next_col = col + dcol
 
@@ -78,3 +174,287 @@ def _link_streams_numba(stream_arr, flow_directions_arr, dirmap, sources, conflu
             row, col = next_row, next_col
 
     return link_arr
+
+
+@_kernel((INDICES, INDICES, FLOW_DIRECTIONS, DIRMAP))
+def _trace_link_streams_numba(rows, cols, flow_directions_arr, dirmap):
+    """Trace the streams downstream of the points (rows[k], cols[k]) and
+    assign link IDs as _link_streams_numba does.
+
+    Every stream cell is reached once, when its inflows are counted, so the
+    sources, confluences, and outlets are known when the tracing ends.
+    Returns the link raster, the flat indices of the sources, confluences,
+    and outlets (each sorted), and the number of cells of every link.
+    """
+    nrows, ncols = flow_directions_arr.shape
+    # 1 + the number of stream cells flowing into each stream cell, 0 off
+    # stream
+    state = np.zeros((nrows, ncols), dtype=np.uint8)
+    confluences = []
+    outlets = []
+
+    for k in range(len(rows)):
+        row, col = rows[k], cols[k]
+        if state[row, col] != 0:
+            continue
+        state[row, col] = 1
+
+        while True:
+            current_direction = flow_directions_arr[row, col]
+            drow = dirmap[current_direction, 0]
+            dcol = dirmap[current_direction, 1]
+            if drow == 0 and dcol == 0:
+                outlets.append(row * ncols + col)
+                break
+
+            next_row = row + drow
+            next_col = col + dcol
+
+            if not (0 <= next_row < nrows and 0 <= next_col < ncols):
+                break
+
+            if state[next_row, next_col] != 0:
+                state[next_row, next_col] += 1
+                if state[next_row, next_col] == 3:
+                    confluences.append(next_row * ncols + next_col)
+                break
+
+            state[next_row, next_col] = 2
+            row, col = next_row, next_col
+
+    # sources are the points nothing flows into, linked in row-major order
+    # as by link_streams
+    sources = []
+    for k in range(len(rows)):
+        if state[rows[k], cols[k]] == 1:
+            sources.append(rows[k] * ncols + cols[k])
+    sources = np.unique(np.array(sources, dtype=np.int64))
+
+    link_id = 1
+    n_cells = 0
+    link_sizes = []
+    link_arr = np.zeros((nrows, ncols), dtype=np.uint32)
+
+    for k in range(len(sources)):
+        row, col = sources[k] // ncols, sources[k] % ncols
+
+        while True:
+            if link_arr[row, col] != 0:
+                break
+
+            link_arr[row, col] = link_id
+            n_cells += 1
+
+            current_direction = flow_directions_arr[row, col]
+            drow = dirmap[current_direction, 0]
+            dcol = dirmap[current_direction, 1]
+            next_row = row + drow
+            next_col = col + dcol
+            if (
+                (drow == 0 and dcol == 0)
+                or not (0 <= next_row < nrows and 0 <= next_col < ncols)
+                or link_arr[next_row, next_col] != 0
+            ):
+                link_sizes.append(n_cells)
+                n_cells = 0
+                link_id += 1
+                break
+
+            # a confluence starts a new link
+            if state[next_row, next_col] > 2:
+                link_sizes.append(n_cells)
+                n_cells = 0
+                link_id += 1
+
+            row, col = next_row, next_col
+
+    return (
+        link_arr,
+        sources,
+        np.sort(np.array(confluences, dtype=np.int64)),
+        np.sort(np.array(outlets, dtype=np.int64)),
+        np.array(link_sizes, dtype=np.int64),
+    )
+
+
+@_kernel((MASK, FLOW_DIRECTIONS, DIRMAP, INDICES, INDICES, MASK))
+def _link_segments_numba(stream_mask, flow_directions_arr, dirmap, rows, cols, is_head):
+    """Label the stream segments of a block, one per head cell.
+
+    A segment runs downstream from its head until the next head, the edge of
+    the block, or the end of the stream. Segment k is labelled k + 1.
+    Returns the labels and the local (row, col) where each segment flows to
+    (chunked.NO_EXIT if it ends inside the block without reaching a head).
+    """
+    nrows, ncols = flow_directions_arr.shape
+    labels = np.zeros((nrows, ncols), dtype=np.uint32)
+    exit_rows = np.full(len(rows), NO_EXIT, dtype=np.int64)
+    exit_cols = np.full(len(rows), NO_EXIT, dtype=np.int64)
+
+    for k in range(len(rows)):
+        row, col = rows[k], cols[k]
+        while True:
+            labels[row, col] = k + 1
+
+            current_direction = flow_directions_arr[row, col]
+            drow = dirmap[current_direction, 0]
+            dcol = dirmap[current_direction, 1]
+            if drow == 0 and dcol == 0:
+                break
+
+            next_row = row + drow
+            next_col = col + dcol
+
+            outside = not (0 <= next_row < nrows and 0 <= next_col < ncols)
+            if outside or is_head[next_row, next_col]:
+                exit_rows[k] = next_row
+                exit_cols[k] = next_col
+                break
+
+            if not stream_mask[next_row, next_col] or labels[next_row, next_col]:
+                break
+
+            row, col = next_row, next_col
+
+    return labels, exit_rows, exit_cols
+
+
+@_kernel((INDICES, INDICES, INDICES))
+def _chain_segments_numba(kinds, next_segment, head_ids):
+    """Chain segments across chunks into links.
+
+    A link starts at a source or confluence segment (kinds 0 and 1) and
+    continues through entry segments (kind 3). Returns the first segment of
+    the link of every segment and, for the first segments, the id of the
+    first (row-major) source upstream of the link and the number of links
+    between the link and its outlet.
+    """
+    n = len(kinds)
+    link_start = np.full(n, -1, dtype=np.int64)
+    downstream = np.full(n, -1, dtype=np.int64)
+    for s in range(n):
+        if kinds[s] == 3:
+            continue
+        segment = s
+        while True:
+            link_start[segment] = s
+            after = next_segment[segment]
+            if after < 0:
+                break
+            if kinds[after] != 3:
+                downstream[s] = after
+                break
+            segment = after
+
+    # first source upstream of each link, in topological order
+    indegree = np.zeros(n, dtype=np.int64)
+    for s in range(n):
+        if downstream[s] >= 0:
+            indegree[downstream[s]] += 1
+    first_source = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+    queue = []
+    for s in range(n):
+        if kinds[s] == 0:
+            first_source[s] = head_ids[s]
+        if kinds[s] != 3 and indegree[s] == 0:
+            queue.append(s)
+    order = []
+    while queue:
+        s = queue.pop()
+        order.append(s)
+        d = downstream[s]
+        if d >= 0:
+            first_source[d] = min(first_source[d], first_source[s])
+            indegree[d] -= 1
+            if indegree[d] == 0:
+                queue.append(d)
+
+    # number of links between each link and its outlet
+    depth = np.zeros(n, dtype=np.int64)
+    for i in range(len(order) - 1, -1, -1):
+        s = order[i]
+        if downstream[s] >= 0:
+            depth[s] = depth[downstream[s]] + 1
+
+    return link_start, first_source, depth
+
+
+def _link_streams_chunked(stream_raster, flow_directions, dirmap):
+    stream_raster = chunked.align_chunks(stream_raster, flow_directions)
+    stream_data = stream_raster.data
+    fdir = flow_directions.data
+    tables, _, _, _ = chunked.stream_nodes(stream_raster, flow_directions, dirmap)
+
+    # first pass: split each chunk into segments that start at a source, a
+    # confluence, or where a stream enters the chunk
+    heads = {}
+    kinds, head_ids, exit_ids = [], [], []
+    offset = 0
+    for index, (window, node_rows, node_cols, node_kinds) in tables.items():
+        row0, row1, col0, col1 = window
+        stream_block, _, _ = chunked.read_window(stream_data, window)
+        fdir_block, _, _ = chunked.read_window(fdir, window)
+        is_head = node_kinds != 2
+        rows, cols = node_rows[is_head], node_cols[is_head]
+        _, exit_rows, exit_cols = _link_segments_numba(
+            stream_block != 0,
+            fdir_block,
+            dirmap,
+            rows,
+            cols,
+            _head_mask(window, rows, cols),
+        )
+        block_exits = chunked.exit_ids(exit_rows, exit_cols, window, fdir.shape)
+
+        heads[index] = (window, rows, cols, offset)
+        offset += len(rows)
+        kinds.append(node_kinds[is_head])
+        head_ids.append(chunked.cell_ids(rows + row0, cols + col0, fdir.shape))
+        exit_ids.append(block_exits)
+
+    kinds = np.concatenate(kinds)
+    head_ids = np.concatenate(head_ids)
+    exit_ids = np.concatenate(exit_ids)
+    if len(head_ids) == 0:
+        return flow_directions.copy(data=np.zeros_like(stream_data, dtype=np.uint32))
+    order = np.argsort(head_ids)
+    position = np.searchsorted(head_ids[order], exit_ids).clip(max=len(order) - 1)
+    found = (exit_ids >= 0) & (head_ids[order][position] == exit_ids)
+    next_segment = np.where(found, order[position], -1)
+    link_start, first_source, depth = _chain_segments_numba(
+        kinds, next_segment, head_ids
+    )
+    # number the links in the order link_streams visits them: by their first
+    # upstream source, then from upstream to downstream
+    starts = np.flatnonzero(kinds != 3)
+    ranks = np.lexsort((-depth[starts], first_source[starts]))
+    link_ids = np.zeros(len(kinds), dtype=np.int64)
+    link_ids[starts[ranks]] = np.arange(1, len(starts) + 1)
+    segment_links = link_ids[link_start]
+    if segment_links.max(initial=0) > np.iinfo(np.uint32).max:
+        raise ValueError("Too many stream links for uint32 link IDs")
+
+    # second pass (lazy): relabel the segments of each chunk with link IDs
+    def link_block(stream_block, fdir_block, block_id=None):
+        window, rows, cols, offset = heads[block_id]
+        labels, _, _ = _link_segments_numba(
+            stream_block != 0,
+            np.ascontiguousarray(fdir_block),
+            dirmap,
+            rows,
+            cols,
+            _head_mask(window, rows, cols),
+        )
+        lookup = np.zeros(len(rows) + 1, dtype=np.uint32)
+        lookup[1:] = segment_links[offset : offset + len(rows)]
+        return lookup[labels]
+
+    link_arr = stream_data.map_blocks(link_block, fdir, dtype=np.uint32)
+    return flow_directions.copy(data=link_arr)
+
+
+def _head_mask(window, rows, cols):
+    row0, row1, col0, col1 = window
+    is_head = np.zeros((row1 - row0, col1 - col0), dtype=np.bool_)
+    is_head[rows, cols] = True
+    return is_head
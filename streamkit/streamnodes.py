@@ -1,14 +1,17 @@
-import numba
 import numpy as np
 import xarray as xr
 
-from streamkit._internal.dirmap import _make_numba_esri_dirmap
+from streamkit._internal import chunked
+from streamkit._internal.dirmap import _make_esri_dirmap
+from streamkit.flowdir import normalize_flow_directions
+from streamkit.jit import DIRMAP, FLOW_DIRECTIONS, MASK, _kernel
 
 
 def find_stream_nodes(
     stream_raster: xr.DataArray, flow_directions: xr.DataArray
 ) -> tuple:
     """Identify source points and confluence points in a stream network
+    Chunked (dask-backed) rasters are read one chunk at a time.
     Args:
         stream_raster: Raster representing the stream network (non-zero values indicate streams)
         flow_directions: Raster representing flow directions using ESRI convention
@@ -16,60 +19,86 @@ def find_stream_nodes(
         Tuple containing lists of source points, confluence points, and outlet points
     """
 
-    dirmap = _make_numba_esri_dirmap()
-    sources, confluences, outlets = _find_stream_nodes_numba(
-        stream_raster.data, flow_directions.data, dirmap
+    nodes = _stream_node_arrays(stream_raster, flow_directions)
+    return tuple(list(zip(rows.tolist(), cols.tolist())) for rows, cols in nodes)
+
+
+def _stream_node_arrays(stream_raster, flow_directions):
+    """Like find_stream_nodes, but return (rows, cols) int64 arrays of the
+    sources, confluences, and outlets, in row-major order."""
+    dirmap = _make_esri_dirmap()
+    flow_directions = normalize_flow_directions(flow_directions)
+    if chunked.is_chunked(flow_directions):
+        stream_raster = chunked.align_chunks(stream_raster, flow_directions)
+        _, *nodes = chunked.stream_nodes(stream_raster, flow_directions, dirmap)
+        return tuple(nodes)
+
+    rows, cols, kinds = _find_stream_nodes_numba(
+        stream_raster.data != 0, flow_directions.data, dirmap
     )
-    return sources, confluences, outlets
+    return tuple((rows[kinds == kind], cols[kinds == kind]) for kind in (0, 1, 2))
+
 
+@_kernel((MASK, FLOW_DIRECTIONS, DIRMAP))
+def _find_stream_nodes_numba(stream_mask, flow_directions_arr, dirmap):
+    """Find source points (headwaters), confluence points, and outlet points
+    in stream network.
 
-@numba.njit
-def _find_stream_nodes_numba(stream_arr, flow_directions_arr, dirmap):
-    """Find source points (headwaters) and confluence points in stream network"""
+    Returns (rows, cols, kinds), where kind is 0 for sources, 1 for
+    confluences, and 2 for outlets, in row-major order within each kind.
+    """
     nrows, ncols = flow_directions_arr.shape
     inflow_count = np.zeros((nrows, ncols), dtype=np.uint8)
 
     # Count how many stream cells flow into each cell
     for row in range(nrows):
         for col in range(ncols):
-            if stream_arr[row, col] == 0:
+            if not stream_mask[row, col]:
                 continue
 
             current_direction = flow_directions_arr[row, col]
-            if current_direction in (-1, -2, 0):
+            drow = dirmap[current_direction, 0]
+            dcol = dirmap[current_direction, 1]
+            if drow == 0 and dcol == 0:
                 continue
 
-            drow, dcol = dirmap[current_direction]
             next_row = row + drow
             next_col = col + dcol
 
             if 0 <= next_row < nrows and 0 <= next_col < ncols:
-                if stream_arr[next_row, next_col] != 0:
+                if stream_mask[next_row, next_col]:
                     inflow_count[next_row, next_col] += 1
 
-    # Find source points (no inflow) and confluence points (multiple inflows)
-    sources = []
-    confluences = []
+    node_rows = []
+    node_cols = []
+    kinds = []
 
+    # Find source points (no inflow) and confluence points (multiple inflows)
     for row in range(nrows):
         for col in range(ncols):
-            if stream_arr[row, col] == 0:
+            if not stream_mask[row, col]:
                 continue
 
             if inflow_count[row, col] == 0:
-                sources.append((row, col))
+                kind = 0
             elif inflow_count[row, col] > 1:
-                confluences.append((row, col))
+                kind = 1
+            else:
+                continue
+            node_rows.append(row)
+            node_cols.append(col)
+            kinds.append(kind)
 
     # Find outlet points (no outflow)
-    outlets = []
     for row in range(nrows):
         for col in range(ncols):
-            if stream_arr[row, col] == 0:
+            if not stream_mask[row, col]:
                 continue
 
             current_direction = flow_directions_arr[row, col]
-            if current_direction in (-1, -2, 0):
-                outlets.append((row, col))
+            if dirmap[current_direction, 0] == 0 and dirmap[current_direction, 1] == 0:
+                node_rows.append(row)
+                node_cols.append(col)
+                kinds.append(2)
 
-    return sources, confluences, outlets
+    return np.array(node_rows), np.array(node_cols), np.array(kinds)
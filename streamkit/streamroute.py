@@ -1,8 +1,21 @@
-import numba
+from numba import types
 import numpy as np
 import xarray as xr
 
-from streamkit._internal.dirmap import _make_numba_esri_dirmap
+from streamkit._internal.dirmap import _make_esri_dirmap
+from streamkit.flowdir import normalize_flow_directions
+from streamkit.instrument import _report_progress, _stage
+from streamkit.jit import DIRMAP, FLOW_DIRECTIONS, MASK, _kernel
+
+# dtypes of the link rasters _path_in_link_numba is compiled for by warmup
+_LINK_DTYPES = (
+    types.uint16,
+    types.uint32,
+    types.int32,
+    types.int64,
+    types.float32,
+    types.float64,
+)
 
 
 def route_stream(
@@ -23,7 +36,8 @@ def route_stream(
         List of (row, col) tuples representing the traced path.
     """
 
-    dirmap = _make_numba_esri_dirmap()
+    dirmap = _make_esri_dirmap()
+    flow_directions = normalize_flow_directions(flow_directions)
     start, end = _determine_start_and_end(stream_mask, flow_accumulation)
     break_conditions_arr = stream_mask.data <= 0
     path = _path_numba(
@@ -40,8 +54,8 @@ def route_stream(
 
     # if the final cell points somewhere else, add that cell to the path
     final_direction = flow_directions.data[path[-1][0], path[-1][1]]
-    if final_direction not in (-1, -2, 0):
-        drow, dcol = dirmap[final_direction]
+    drow, dcol = dirmap[final_direction]
+    if drow != 0 or dcol != 0:
         next_row = path[-1][0] + drow
         next_col = path[-1][1] + dcol
         if (
@@ -52,7 +66,120 @@ def route_stream(
     return path
 
 
-@numba.njit
+def route_links(
+    link_raster: xr.DataArray,
+    flow_directions: xr.DataArray,
+    flow_accumulation: xr.DataArray,
+) -> dict:
+    """
+    Trace the path of every link in a labeled stream raster. Equivalent to
+    calling route_stream on a mask of each link, but groups the cells of all
+    links in one pass instead of scanning the full raster once per link.
+
+    Args:
+        link_raster: array of stream links with unique IDs (0 or NaN for
+            non-stream cells).
+        flow_directions: array of flow directions (ESRI style).
+        flow_accumulation: array of flow accumulation values.
+    Returns:
+        Dictionary mapping each link ID to its list of (row, col) tuples.
+    """
+    return dict(iter_link_paths(link_raster, flow_directions, flow_accumulation))
+
+
+def iter_link_paths(
+    link_raster: xr.DataArray,
+    flow_directions: xr.DataArray,
+    flow_accumulation: xr.DataArray,
+):
+    """Like route_links, but yield (link ID, path) pairs one link at a time
+    so the paths of all links never need to be held at once."""
+    dirmap = _make_esri_dirmap()
+    flow_directions = normalize_flow_directions(flow_directions)
+    link_arr = link_raster.data
+    flow_dir_arr = flow_directions.data
+    flow_acc_arr = flow_accumulation.data
+    nrows, ncols = link_arr.shape
+
+    with _stage("group_link_cells") as stage:
+        link_ids, link_cells = _group_link_cells(link_arr)
+        stage.count = len(link_ids)
+
+    for i, (link_id, cells) in enumerate(zip(link_ids, link_cells)):
+        rows, cols = np.divmod(cells, ncols)
+        flow_acc_values = flow_acc_arr[rows, cols]
+        min_idx = np.argmin(flow_acc_values)
+        max_idx = np.argmax(flow_acc_values)
+        end = (rows[max_idx], cols[max_idx])
+
+        path = _path_in_link_numba(
+            rows[min_idx], cols[min_idx], flow_dir_arr, dirmap, link_arr, link_id
+        )
+        # a D8 path never revisits a cell, so matching the cell count means
+        # the path covers the whole link
+        if path[-1] != end:
+            raise ValueError("Traced path does not match start and end points")
+        if len(path) != len(cells):
+            raise ValueError("Traced path does not cover all stream cells")
+
+        final_direction = flow_dir_arr[path[-1][0], path[-1][1]]
+        drow, dcol = dirmap[final_direction]
+        if drow != 0 or dcol != 0:
+            next_row = path[-1][0] + drow
+            next_col = path[-1][1] + dcol
+            if 0 <= next_row < nrows and 0 <= next_col < ncols:
+                path.append((next_row, next_col))
+        _report_progress("route_links", i + 1, len(link_ids))
+        yield link_id, path
+
+
+def _group_link_cells(link_arr):
+    """Return the unique link IDs and the flat indices of each link's cells
+    (in row-major order)."""
+    flat = link_arr.ravel()
+    cells = np.flatnonzero((flat != 0) & ~np.isnan(flat))
+    values = flat[cells]
+    order = np.argsort(values, kind="stable")
+    cells = cells[order]
+    values = values[order]
+    link_ids, starts = np.unique(values, return_index=True)
+    return link_ids, np.split(cells, starts[1:])
+
+
+@_kernel(
+    *(
+        (types.int64, types.int64, FLOW_DIRECTIONS, DIRMAP, dtype[:, ::1], dtype)
+        for dtype in _LINK_DTYPES
+    )
+)
+def _path_in_link_numba(row, col, flow_directions_arr, dirmap, link_arr, link_id):
+    """Trace the path from a starting cell while it stays within a link"""
+    nrows, ncols = flow_directions_arr.shape
+    path = [(row, col)]
+
+    while True:
+        current_direction = flow_directions_arr[row, col]
+        drow = dirmap[current_direction, 0]
+        dcol = dirmap[current_direction, 1]
+        if drow == 0 and dcol == 0:
+            break
+
+        next_row = row + drow
+        next_col = col + dcol
+
+        if not (0 <= next_row < nrows and 0 <= next_col < ncols):
+            break
+
+        if link_arr[next_row, next_col] != link_id:
+            break
+
+        path.append((next_row, next_col))
+        row, col = next_row, next_col
+
+    return path
+
+
+@_kernel((types.int64, types.int64, FLOW_DIRECTIONS, DIRMAP, MASK))
 def _path_numba(row, col, flow_directions_arr, dirmap, break_conditions_arr):
     """Trace the path from a starting cell until a break condition or outlet/pit is met"""
     nrows, ncols = flow_directions_arr.shape
@@ -60,17 +187,18 @@ def _path_numba(row, col, flow_directions_arr, dirmap, break_conditions_arr):
 
     while True:
         current_direction = flow_directions_arr[row, col]
-        if current_direction in (-1, -2, 0):
+        drow = dirmap[current_direction, 0]
+        dcol = dirmap[current_direction, 1]
+        if drow == 0 and dcol == 0:
             break
 
-        drow, dcol = dirmap[current_direction]
         next_row = row + drow
         next_col = col + dcol
 
         if not (0 <= next_row < nrows and 0 <= next_col < ncols):
             break
 
-        if break_conditions_arr[next_row, next_col] == 1:
+        if break_conditions_arr[next_row, next_col]:
             break
 
         path.append((next_row, next_col))
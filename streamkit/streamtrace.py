@@ -1,8 +1,10 @@
-import numba
 import numpy as np
 import xarray as xr
 
-from streamkit._internal.dirmap import _make_numba_esri_dirmap
+from streamkit._internal import chunked
+from streamkit._internal.dirmap import _make_esri_dirmap
+from streamkit.flowdir import normalize_flow_directions
+from streamkit.jit import DIRMAP, FLOW_DIRECTIONS, INDICES, _kernel
 
 
 def trace_streams(
@@ -10,26 +12,37 @@ def trace_streams(
 ) -> xr.DataArray:
     """
     Trace streams from a list of starting points based on flow directions.
+    If flow_directions is chunked (dask-backed), it is read one chunk at a time and the result is a lazy raster with the same chunks.
     Args:
         points: List of (row, col) tuples representing starting points (i.e. channel head locations).
         flow_directions: xarray DataArray of flow directions (ESRI style).
     Returns:
         Binary stream raster where 1 indicates stream cells and 0 indicates non-stream cells. Can be used as input to `streamroute.streamlink` to label individual stream segments.
     """
-    dirmap = _make_numba_esri_dirmap()
-    stream_arr = _trace_streams_numba(points, flow_directions.data, dirmap)
+    dirmap = _make_esri_dirmap()
+    flow_directions = normalize_flow_directions(flow_directions)
+    points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+    if chunked.is_chunked(flow_directions):
+        return _trace_streams_chunked(points, flow_directions, dirmap)
+    stream_arr = _trace_streams_numba(
+        np.ascontiguousarray(points[:, 0]),
+        np.ascontiguousarray(points[:, 1]),
+        flow_directions.data,
+        dirmap,
+    )
     stream_raster = flow_directions.copy(data=stream_arr)
     return stream_raster
 
 
-@numba.njit
-def _trace_streams_numba(points, flow_directions_arr, dirmap):
-    """Mark all stream cells (binary stream network)"""
+@_kernel((INDICES, INDICES, FLOW_DIRECTIONS, DIRMAP))
+def _trace_streams_numba(rows, cols, flow_directions_arr, dirmap):
+    """Mark all stream cells (binary stream network) downstream of the
+    points (rows[k], cols[k])"""
     nrows, ncols = flow_directions_arr.shape
     stream_arr = np.zeros((nrows, ncols), dtype=np.uint8)
 
-    for point in points:
-        row, col = point
+    for k in range(len(rows)):
+        row, col = rows[k], cols[k]
         if stream_arr[row, col] != 0:
             continue
 
@@ -37,10 +50,11 @@ def _trace_streams_numba(points, flow_directions_arr, dirmap):
             stream_arr[row, col] = 1
 
             current_direction = flow_directions_arr[row, col]
-            if current_direction in (-1, -2, 0):
+            drow = dirmap[current_direction, 0]
+            dcol = dirmap[current_direction, 1]
+            if drow == 0 and dcol == 0:
                 break
 
-            drow, dcol = dirmap[current_direction]
             next_row = row + drow
             next_col = col + dcol
 
@@ -53,3 +67,60 @@ def _trace_streams_numba(points, flow_directions_arr, dirmap):
             row, col = next_row, next_col
 
     return stream_arr
+
+
+_NO_STREAMS = np.zeros((0, 0), dtype=np.bool_)
+
+
+def _trace_streams_chunked(points, flow_directions, dirmap):
+    fdir = flow_directions.data
+    point_groups = chunked.group_by_chunk(points[:, 0], points[:, 1], fdir.chunks)
+
+    # first pass: where the paths from the points and from every cell on the
+    # edge of a chunk leave that chunk
+    keys = []
+    exits = []
+    starts = []
+    windows = {}
+    for index, window in chunked.chunk_windows(fdir.chunks):
+        row0, row1, col0, col1 = window
+        windows[index] = window
+        block, _, _ = chunked.read_window(fdir, window)
+        edge_rows, edge_cols = chunked.perimeter_cells(row1 - row0, col1 - col0)
+        point_rows, point_cols = point_groups.get(index, (edge_rows[:0], edge_cols[:0]))
+        rows = np.concatenate([edge_rows, point_rows - row0])
+        cols = np.concatenate([edge_cols, point_cols - col0])
+        # stream cells are not known yet, so the stream mask is not read
+        exit_rows, exit_cols, _ = chunked._walk_to_exit_numba(
+            block, _NO_STREAMS, rows, cols, dirmap, False
+        )
+        exit_ids = chunked.exit_ids(exit_rows, exit_cols, window, fdir.shape)
+        n_edge = len(edge_rows)
+        keys.append(chunked.cell_ids(edge_rows + row0, edge_cols + col0, fdir.shape))
+        exits.append(exit_ids[:n_edge])
+        starts.append(exit_ids[n_edge:])
+
+    keys = np.concatenate(keys)
+    exits = np.concatenate(exits)
+    order = np.argsort(keys)
+    keys, exits = keys[order], exits[order]
+    entered = keys[chunked._follow_exits_numba(keys, exits, np.concatenate(starts))]
+
+    # second pass (lazy): trace each chunk from its points and the cells
+    # where traced paths enter it
+    ncols = fdir.shape[1]
+    seeds = chunked.group_by_chunk(
+        np.concatenate([points[:, 0], entered // ncols]),
+        np.concatenate([points[:, 1], entered % ncols]),
+        fdir.chunks,
+    )
+
+    def trace_block(block, block_id=None):
+        row0, _, col0, _ = windows[block_id]
+        rows, cols = seeds.get(block_id, (np.empty(0, np.int64),) * 2)
+        return _trace_streams_numba(
+            rows - row0, cols - col0, np.ascontiguousarray(block), dirmap
+        )
+
+    stream_arr = fdir.map_blocks(trace_block, dtype=np.uint8)
+    return flow_directions.copy(data=stream_arr)
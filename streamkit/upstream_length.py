@@ -2,7 +2,9 @@ import numpy as np
 import networkx as nx
 import xarray as xr
 
-from streamkit._internal.dirmap import _make_numba_esri_dirmap
+from streamkit._internal import chunked
+from streamkit._internal.dirmap import _make_esri_dirmap
+from streamkit.flowdir import normalize_flow_directions
 from streamkit.streamnodes import find_stream_nodes
 
 
@@ -12,29 +14,38 @@ def upstream_length_raster(
     """
     For each cell in the stream raster, compute the maximum upstream length
 
+    If the rasters are chunked (dask-backed), they are read one chunk at a
+    time and the result is a lazy raster with the same chunks.
+
     Args:
         streams: A binary raster where stream cells are 1 and non-stream cells are 0.
         flow_direction: A raster representing flow direction using ESRI convention.
     Returns:
         A raster where each stream cell contains the maximum upstream length in map units.
     """
-    dirmap = _make_numba_esri_dirmap()
-    sources, _, _ = find_stream_nodes(streams, flow_direction)
-    distance_arr = _distance_from_head(
-        streams.data, sources, flow_direction.data, dirmap
-    )
-    distance_raster = flow_direction.copy(data=distance_arr)
+    dirmap = _make_esri_dirmap()
+    flow_direction = normalize_flow_directions(flow_direction)
+    if chunked.is_chunked(flow_direction):
+        distance_raster = _distance_from_head_chunked(streams, flow_direction, dirmap)
+    else:
+        sources, _, _ = find_stream_nodes(streams, flow_direction)
+        distance_arr = _distance_from_head(
+            streams.data, sources, flow_direction.data, dirmap
+        )
+        distance_raster = flow_direction.copy(data=distance_arr)
     distance_raster *= np.abs(flow_direction.rio.resolution()[0])
     return distance_raster
 
 
-def _distance_from_head(stream_arr, headwater_points, flow_dir_arr, dirmap):
+def _distance_from_head(
+    stream_arr, headwater_points, flow_dir_arr, dirmap, start_distances=None
+):
     nrows, ncols = flow_dir_arr.shape
     distance_arr = np.zeros((nrows, ncols), dtype=np.float32)
 
-    for point in headwater_points:
+    for k, point in enumerate(headwater_points):
         row, col = point
-        distance = 0.0
+        distance = 0.0 if start_distances is None else start_distances[k]
 
         while True:
             if distance >= distance_arr[row, col]:
@@ -43,10 +54,11 @@ def _distance_from_head(stream_arr, headwater_points, flow_dir_arr, dirmap):
                 break
 
             current_direction = flow_dir_arr[row, col]
-            if current_direction in (-1, -2, 0):
+            drow = dirmap[current_direction, 0]
+            dcol = dirmap[current_direction, 1]
+            if drow == 0 and dcol == 0:
                 break
 
-            drow, dcol = dirmap[current_direction]
             next_row = row + drow
             next_col = col + dcol
 
@@ -63,6 +75,80 @@ def _distance_from_head(stream_arr, headwater_points, flow_dir_arr, dirmap):
     return distance_arr
 
 
+def _distance_from_head_chunked(streams, flow_direction, dirmap):
+    streams = chunked.align_chunks(streams, flow_direction)
+    stream_data = streams.data
+    fdir = flow_direction.data
+    tables, _, _, _ = chunked.stream_nodes(streams, flow_direction, dirmap)
+
+    # first pass: where the stream paths from the sources and from the stream
+    # cells on the edge of each chunk leave that chunk, and their lengths
+    keys, exits, lengths = [], [], []
+    start_exits, start_lengths = [], []
+    heads = {}
+    for index, (window, node_rows, node_cols, kinds) in tables.items():
+        row0, row1, col0, col1 = window
+        stream_block, _, _ = chunked.read_window(stream_data, window)
+        fdir_block, _, _ = chunked.read_window(fdir, window)
+        source_rows = node_rows[kinds == 0]
+        source_cols = node_cols[kinds == 0]
+        edge_rows, edge_cols = chunked.perimeter_cells(row1 - row0, col1 - col0)
+        on_stream = stream_block[edge_rows, edge_cols] != 0
+        edge_rows, edge_cols = edge_rows[on_stream], edge_cols[on_stream]
+
+        rows = np.concatenate([source_rows, edge_rows])
+        cols = np.concatenate([source_cols, edge_cols])
+        exit_rows, exit_cols, path_lengths = chunked._walk_to_exit_numba(
+            fdir_block, stream_block != 0, rows, cols, dirmap, True
+        )
+        exit_ids = chunked.exit_ids(exit_rows, exit_cols, window, fdir.shape)
+
+        n_sources = len(source_rows)
+        start_exits.append(exit_ids[:n_sources])
+        start_lengths.append(path_lengths[:n_sources])
+        keys.append(chunked.cell_ids(edge_rows + row0, edge_cols + col0, fdir.shape))
+        exits.append(exit_ids[n_sources:])
+        lengths.append(path_lengths[n_sources:])
+        heads[index] = (window, source_rows, source_cols)
+
+    keys = np.concatenate(keys)
+    order = np.argsort(keys)
+    keys = keys[order]
+    distances = chunked._longest_paths_numba(
+        keys,
+        np.concatenate(exits)[order],
+        np.concatenate(lengths)[order],
+        np.concatenate(start_exits),
+        np.concatenate(start_lengths),
+    )
+    reached = distances > -np.inf
+    entries = chunked.group_by_chunk(
+        keys[reached] // fdir.shape[1], keys[reached] % fdir.shape[1], fdir.chunks
+    )
+    entry_distances = dict(zip(keys[reached].tolist(), distances[reached].tolist()))
+
+    # second pass (lazy): walk each chunk from its sources and from the
+    # cells where longer paths enter it
+    def distance_block(stream_block, fdir_block, block_id=None):
+        window, source_rows, source_cols = heads[block_id]
+        row0, _, col0, _ = window
+        entry_rows, entry_cols = entries.get(block_id, (source_rows[:0],) * 2)
+        starts = [0.0] * len(source_rows) + [
+            entry_distances[row * fdir.shape[1] + col]
+            for row, col in zip(entry_rows.tolist(), entry_cols.tolist())
+        ]
+        points = list(
+            zip(
+                np.concatenate([source_rows, entry_rows - row0]).tolist(),
+                np.concatenate([source_cols, entry_cols - col0]).tolist(),
+            )
+        )
+        return _distance_from_head(stream_block, points, fdir_block, dirmap, starts)
+
+    distance_arr = stream_data.map_blocks(distance_block, fdir, dtype=np.float32)
+    return flow_direction.copy(data=distance_arr)
+
+
 def upstream_length(G: nx.DiGraph) -> nx.DiGraph:
     """
     Compute the maximum upstream length for each edge in a directed graph G. Uses the length attribute of the edge geometry.
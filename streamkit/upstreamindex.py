@@ -0,0 +1,199 @@
+"""
+Index of the upstream cells of every cell of a D8 flow grid.
+"""
+
+import numpy as np
+import xarray as xr
+
+from streamkit._internal.dirmap import _make_esri_dirmap
+from streamkit.flowdir import normalize_flow_directions
+from streamkit.jit import DIRMAP, FLOW_DIRECTIONS, INDICES, _kernel
+
+
+class UpstreamIndex:
+    """Nested interval index over the D8 flow tree.
+
+    The cells are numbered in depth-first pre-order from every outlet,
+    walking upstream, so the catchment of a cell (the cell and every cell
+    draining into it) is the interval of numbers from its own to its own
+    plus its catchment size. Whether a cell drains into another and the
+    catchment area of a cell are then answered in O(1), and the cells of a
+    catchment are found in O(catchment size), without flooding the grid
+    for every pour point. Building the index takes two linear passes.
+
+    Chunked (dask-backed) flow directions are loaded in full. Cells on flow
+    direction cycles, which valid D8 grids do not have, are in no catchment.
+
+    Args:
+        flow_directions: Flow direction raster (ESRI D8 encoding).
+    """
+
+    def __init__(self, flow_directions: xr.DataArray):
+        flow_directions = normalize_flow_directions(flow_directions)
+        self.flow_directions = flow_directions
+        self.shape = flow_directions.shape
+        self._pre, self._size, self._order = _upstream_index_numba(
+            np.ascontiguousarray(flow_directions.values), _make_esri_dirmap()
+        )
+
+    def __repr__(self):
+        return f"UpstreamIndex({self.shape[0]} x {self.shape[1]} cells)"
+
+    def drains_to(self, rows, cols, outlet_rows, outlet_cols) -> np.ndarray:
+        """Return whether each cell (rows, cols) is in the catchment of the
+        matching outlet cell, i.e. is upstream of it or is the cell itself.
+
+        Args:
+            rows, cols: Row and column indices of the cells.
+            outlet_rows, outlet_cols: Row and column indices of the outlets,
+                broadcast against rows and cols.
+        """
+        pre = self._pre[self._cell_ids(rows, cols)]
+        outlet = self._cell_ids(outlet_rows, outlet_cols)
+        start = self._pre[outlet]
+        return (start >= 0) & (pre >= start) & (pre < start + self._size[outlet])
+
+    def catchment_size(self, rows, cols) -> np.ndarray:
+        """Return the number of cells in the catchment of each cell."""
+        return self._size[self._cell_ids(rows, cols)]
+
+    def catchment_area(self, rows, cols) -> np.ndarray:
+        """Return the area of the catchment of each cell, in squared map
+        units."""
+        dx, dy = self.flow_directions.rio.resolution()
+        return self.catchment_size(rows, cols) * abs(dx * dy)
+
+    def catchment_cells(self, row: int, col: int) -> tuple[np.ndarray, np.ndarray]:
+        """Return the (rows, cols) of the cells of the catchment of a cell,
+        the cell first."""
+        outlet = self._cell_ids(row, col)
+        start = self._pre[outlet]
+        cells = self._order[start : start + self._size[outlet]]
+        return np.divmod(cells, self.shape[1])
+
+    def catchment(self, row: int, col: int) -> xr.DataArray:
+        """Return the catchment of a cell as a boolean raster."""
+        mask = np.zeros(self.shape, dtype=bool)
+        mask[self.catchment_cells(row, col)] = True
+        return self.flow_directions.copy(data=mask)
+
+    def label_catchments(self, rows, cols, values) -> xr.DataArray:
+        """Label every cell with the value of the first of the pour points
+        (rows, cols) on its flow path, as when delineating the catchment of
+        every pour point from the largest to the smallest and letting nested
+        catchments overwrite the catchments containing them.
+
+        Takes one pass over the grid, whatever the number of pour points.
+
+        Args:
+            rows, cols: Row and column indices of the pour points.
+            values: Label of each pour point. Cells draining to no pour point
+                are 0.
+        Returns:
+            Raster of labels with the dtype of values.
+        """
+        values = np.asarray(values)
+        point_labels = np.zeros(np.prod(self.shape), dtype=np.int64)
+        point_labels[self._cell_ids(rows, cols)] = np.arange(1, len(values) + 1)
+        labels = _label_catchments_numba(
+            self._order, self._pre, self._size, point_labels
+        )
+        lookup = np.zeros(len(values) + 1, dtype=values.dtype)
+        lookup[1:] = values
+        return self.flow_directions.copy(data=lookup[labels].reshape(self.shape))
+
+    def _cell_ids(self, rows, cols):
+        nrows, ncols = self.shape
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        if np.any((rows < 0) | (rows >= nrows) | (cols < 0) | (cols >= ncols)):
+            raise ValueError(f"Cells outside of the {nrows} x {ncols} raster")
+        return rows * ncols + cols
+
+
+@_kernel((FLOW_DIRECTIONS, DIRMAP))
+def _upstream_index_numba(flow_directions_arr, dirmap):
+    """Depth-first pre-order number of every cell, walking upstream from
+    every outlet in row-major order, with the catchment size of every cell
+    and the cell of every number.
+
+    Cells that are not reached (on cycles) have number -1 and size 0.
+    """
+    nrows, ncols = flow_directions_arr.shape
+    n = nrows * ncols
+    fdir = flow_directions_arr.ravel()
+
+    # flat index of the cell each cell flows to (-1 if none), and the cells
+    # flowing into each cell, grouped by that cell
+    target = np.full(n, -1, dtype=np.int64)
+    start = np.zeros(n + 1, dtype=np.int64)
+    for cell in range(n):
+        drow = dirmap[fdir[cell], 0]
+        dcol = dirmap[fdir[cell], 1]
+        if drow == 0 and dcol == 0:
+            continue
+        next_row = cell // ncols + drow
+        next_col = cell % ncols + dcol
+        if 0 <= next_row < nrows and 0 <= next_col < ncols:
+            target[cell] = next_row * ncols + next_col
+            start[target[cell] + 1] += 1
+    for cell in range(n):
+        start[cell + 1] += start[cell]
+    inflows = np.empty(start[n], dtype=np.int64)
+    filled = start[:n].copy()
+    for cell in range(n):
+        if target[cell] >= 0:
+            inflows[filled[target[cell]]] = cell
+            filled[target[cell]] += 1
+
+    pre = np.full(n, -1, dtype=np.int64)
+    order = np.empty(n, dtype=np.int64)
+    stack = np.empty(n, dtype=np.int64)
+    number = 0
+    for outlet in range(n):
+        if target[outlet] >= 0:
+            continue
+        stack[0] = outlet
+        top = 1
+        while top > 0:
+            top -= 1
+            cell = stack[top]
+            pre[cell] = number
+            order[number] = cell
+            number += 1
+            for k in range(start[cell], start[cell + 1]):
+                stack[top] = inflows[k]
+                top += 1
+
+    # catchment sizes, from upstream to downstream
+    size = np.zeros(n, dtype=np.int64)
+    for k in range(number - 1, -1, -1):
+        cell = order[k]
+        size[cell] += 1
+        if target[cell] >= 0:
+            size[target[cell]] += size[cell]
+
+    return pre, size, order[:number]
+
+
+@_kernel((INDICES, INDICES, INDICES, INDICES))
+def _label_catchments_numba(order, pre, size, point_labels):
+    """Label every cell with the point label of the first labelled cell on
+    its flow path (including itself), 0 if there is none."""
+    n = len(pre)
+    labels = np.zeros(n, dtype=np.int64)
+    # in pre-order every cell comes after the cell it flows to, which is the
+    # cell before it whose interval contains it. A stack of the intervals
+    # enclosing the current cell finds it.
+    stack = np.empty(len(order), dtype=np.int64)
+    top = 0
+    for k in range(len(order)):
+        cell = order[k]
+        while top > 0 and k >= pre[stack[top - 1]] + size[stack[top - 1]]:
+            top -= 1
+        if point_labels[cell] != 0:
+            labels[cell] = point_labels[cell]
+        elif top > 0:
+            labels[cell] = labels[stack[top - 1]]
+        stack[top] = cell
+        top += 1
+    return labels
@@ -1,10 +1,13 @@
+from typing import Iterator
+
 import geopandas as gpd
-import numpy as np
+import pandas as pd
 from rasterio.transform import xy
 from shapely.geometry import LineString
 import xarray as xr
 
-from streamkit.streamroute import route_stream
+from streamkit.instrument import _stage
+from streamkit.streamroute import iter_link_paths
 
 
 def vectorize_streams(
@@ -21,29 +24,60 @@ def vectorize_streams(
     Returns:
         A GeoDataFrame with LineString geometries representing the streams with stream_id column (from the raster values).
     """
-    flowlines = []
-    for stream_id in np.unique(stream_raster.values):
-        if stream_id == 0 or np.isnan(stream_id):
-            continue
+    with _stage("vectorize_streams") as stage:
+        frames = list(
+            iter_vectorize_streams(stream_raster, flow_directions, flow_accumulation)
+        )
+        stage.count = sum(len(frame) for frame in frames)
+    if not frames:
+        return gpd.GeoDataFrame([], crs=stream_raster.rio.crs)
+    return pd.concat(frames, ignore_index=True)
 
-        stream_mask = stream_raster == stream_id
-        flow_acc = flow_accumulation * stream_mask.data
-        flow_dir = flow_directions * stream_mask.data
 
-        # skip any empty streams or those with one cell
-        if np.sum(stream_mask) < 2:
+def iter_vectorize_streams(
+    stream_raster: xr.DataArray,
+    flow_directions: xr.DataArray,
+    flow_accumulation: xr.DataArray,
+    batch_size: int = 1000,
+) -> Iterator[gpd.GeoDataFrame]:
+    """
+    Vectorize streams one batch at a time, e.g. to stream them to a file
+    with write_geoparquet instead of holding every LineString in memory.
+    Args:
+        stream_raster: A raster of stream segments with unique IDs.
+        flow_directions: A raster of flow directions (ESRI D8 encoding).
+        flow_accumulation: A raster of flow accumulation values.
+        batch_size: Maximum number of streams per yielded GeoDataFrame.
+    Yields:
+        GeoDataFrames with the rows vectorize_streams would return, in the same order.
+    """
+    stream_arr = stream_raster.data
+    transform = stream_raster.rio.transform()
+    flowlines = []
+    for stream_id, path in iter_link_paths(
+        stream_raster, flow_directions, flow_accumulation
+    ):
+        # skip streams with one cell (the path also holds the cell the stream
+        # drains into, if any)
+        n_cells = len(path) - (stream_arr[path[-1]] != stream_id)
+        if n_cells < 2:
             continue
 
-        line = _vectorize_single_stream(stream_mask, flow_dir, flow_acc)
-        flowlines.append({"geometry": line, "stream_id": int(stream_id)})
-
-    gdf = gpd.GeoDataFrame(flowlines, crs=stream_raster.rio.crs)
-    return gdf
+        flowlines.append(
+            {
+                "geometry": _path_to_linestring(path, transform),
+                "stream_id": int(stream_id),
+            }
+        )
+        if len(flowlines) == batch_size:
+            yield gpd.GeoDataFrame(flowlines, crs=stream_raster.rio.crs)
+            flowlines = []
+    if flowlines:
+        yield gpd.GeoDataFrame(flowlines, crs=stream_raster.rio.crs)
 
 
-def _vectorize_single_stream(stream_mask, flow_dir, flow_acc):
-    path = route_stream(stream_mask, flow_dir, flow_acc)
+def _path_to_linestring(path, transform):
     rows, cols = zip(*path)
-    xs, ys = xy(stream_mask.rio.transform(), rows, cols, offset="center")
+    xs, ys = xy(transform, rows, cols, offset="center")
     line = LineString(zip(xs, ys))
     return line
@@ -1,3 +1,4 @@
+import os
 import tempfile
 import warnings
 
@@ -5,12 +6,23 @@ import numpy as np
 import pandas as pd
 import rioxarray as rxr
 import xarray as xr
-import whitebox
 
 from streamkit._internal.adapters import to_pysheds, from_pysheds
+from streamkit._internal.cache import MemoCache, raster_key
+from streamkit.flowdir import normalize_flow_directions
+from streamkit.instrument import _report_progress, _stage
+from streamkit.labelstats import label_statistics
+from streamkit.rasterstore import RasterStore
+from streamkit.upstreamindex import UpstreamIndex
+
+# results of flow_accumulation_workflow for the most recently used DEMs
+_HYDROLOGY_CACHE = MemoCache(maxsize=2)
+_HYDROLOGY_NAMES = ("conditioned_dem", "flow_directions", "flow_accumulation")
 
 
 def condition_dem(dem):
+    import whitebox
+
     wbt = whitebox.WhiteboxTools()
     working_dir = tempfile.mkdtemp()
     wbt.set_working_dir(working_dir)
@@ -27,43 +39,107 @@ def condition_dem(dem):
     return conditioned_dem
 
 
+@_stage("compute_hand")
 def compute_hand(dem, flow_directions, streams):
+    """Compute the height above nearest drainage (HAND) with pysheds.
+
+    pysheds works on in-memory arrays, so chunked (dask-backed) inputs are
+    loaded in full.
+
+    Args:
+        dem: DEM raster, typically the conditioned DEM.
+        flow_directions: Flow direction raster (ESRI D8 encoding).
+        streams: Stream raster, non-zero values are stream cells.
+    Returns:
+        HAND raster.
+    """
     # note ESRI d8 flow direction encoding
     dem, grid = to_pysheds(dem)
-    flow_directions, _ = to_pysheds(flow_directions)
+    flow_directions, _ = to_pysheds(normalize_flow_directions(flow_directions))
     streams, _ = to_pysheds(streams)
     dirmap = (64, 128, 1, 2, 32, 16, 8, 4)
     hand = grid.compute_hand(flow_directions, dem, streams > 0, dirmap=dirmap)
     return from_pysheds(hand)
 
 
+@_stage("flow_accumulation_workflow")
 def flow_accumulation_workflow(
     dem: xr.DataArray,
+    cache: bool = True,
+    cache_dir: str | None = None,
 ) -> tuple[xr.DataArray, xr.DataArray, xr.DataArray]:
     """
     Given a DEM, compute the conditioned DEM, flow directions, and flow
     accumulation. Uses d8 flow directions, wraps around whiteboxtools 'fill
     depression with fix flats' algorithm. Flow direction and accumulation done
-    with pysheds. Uses ESRI flow direction encoding.
+    with pysheds. Flow directions use the ESRI encoding, stored as uint8 with
+    0 for pits, outlets, and nodata (see normalize_flow_directions).
+
+    Results are memoized on a hash of the DEM values and georeferencing, so
+    repeated calls on the same DEM within a process skip recomputation. If
+    cache_dir is given, results are also written there (see RasterStore) and
+    reused, memory-mapped, across runs. Chunked (dask-backed) DEMs are loaded
+    in full.
 
     Args:
         dem: DEM raster
+        cache: Whether to reuse previously computed results for the same DEM.
+        cache_dir: Optional directory for persisting results between runs.
     Returns:
         (conditioned DEM, flow directions, and flow accumulation)
 
     """
+    key = raster_key(dem) if cache else None
+    if key is not None:
+        result = _HYDROLOGY_CACHE.get(key)
+        if result is not None:
+            return tuple(raster.copy() for raster in result)
+        if cache_dir is not None:
+            result = _read_cached_hydrology(cache_dir, key)
+            if result is not None:
+                return result
+
     # wbt condition
-    conditioned_dem = condition_dem(dem)
+    with _stage("conditioning"):
+        conditioned_dem = condition_dem(dem)
     pysheds_conditioned_dem, grid = to_pysheds(conditioned_dem)
-    flow_directions = grid.flowdir(pysheds_conditioned_dem)
-    flow_accumulation = grid.accumulation(flow_directions)
-    return (
+    with _stage("flow_directions"):
+        flow_directions = grid.flowdir(pysheds_conditioned_dem)
+    with _stage("flow_accumulation"):
+        flow_accumulation = grid.accumulation(flow_directions)
+    result = (
         from_pysheds(pysheds_conditioned_dem),
-        from_pysheds(flow_directions),
+        normalize_flow_directions(from_pysheds(flow_directions)),
         from_pysheds(flow_accumulation),
     )
 
+    if key is not None:
+        _HYDROLOGY_CACHE.put(key, tuple(raster.copy() for raster in result))
+        if cache_dir is not None:
+            _write_cached_hydrology(cache_dir, key, result)
+    return result
+
+
+def _read_cached_hydrology(cache_dir, key):
+    store = RasterStore(os.path.join(cache_dir, key))
+    if not all(name in store for name in _HYDROLOGY_NAMES):
+        return None
+    # copy-on-write memmaps: pages are read on demand and callers can modify
+    # the values without touching the cache
+    dem, flow_directions, flow_accumulation = (
+        store.read(name, mode="c") for name in _HYDROLOGY_NAMES
+    )
+    # entries written by earlier versions hold int64 flow directions
+    return dem, normalize_flow_directions(flow_directions), flow_accumulation
+
+
+def _write_cached_hydrology(cache_dir, key, rasters):
+    store = RasterStore(os.path.join(cache_dir, key))
+    for name, raster in zip(_HYDROLOGY_NAMES, rasters):
+        store.write(name, raster)
 
+
+@_stage("delineate_subbasins")
 def delineate_subbasins(
     stream_raster: xr.DataArray,
     flow_directions: xr.DataArray,
@@ -72,7 +148,9 @@ def delineate_subbasins(
     """
     Delineate all subbasins given a channel network raster. Detects pour points
     for each unique stream segment by finding the cell with the highest flow
-    accumulation for that segment (based on ID).
+    accumulation for that segment (based on ID). Every cell is assigned to the
+    subbasin of the nearest pour point downstream with an UpstreamIndex, in
+    one pass over the grid.
 
     Args:
         stream_raster: Raster of channel network with unique IDs for each
@@ -83,58 +161,55 @@ def delineate_subbasins(
         Raster of subbasins with same IDs as stream_raster
     """
     # get pour points from channel network raster
-    # these are sorted so that nested basins are handled correctly
-    pour_points = _identify_pour_points(stream_raster, flow_accumulation)
-
-    subbasins = stream_raster.copy(
-        data=np.zeros_like(stream_raster.data, dtype=np.int32)
-    )
-
-    pysheds_fdir, grid = to_pysheds(flow_directions)
-
-    for _, row in pour_points.iterrows():
-        pour_row = row["row"]
-        pour_col = row["col"]
-
-        catchment = grid.catchment(
-            x=pour_col,
-            y=pour_row,
-            fdir=pysheds_fdir,
-            xytype="index",
+    with _stage("pour_points") as stage:
+        pour_points = _identify_pour_points(stream_raster, flow_accumulation)
+        stage.count = len(pour_points)
+
+    # as with pysheds catchments, cells on the edge of the raster drain
+    # nowhere, so catchments only include them as their pour point
+    with _stage("upstream_index"):
+        index = UpstreamIndex(_without_rim(flow_directions))
+
+    with _stage("catchments") as stage:
+        stage.count = len(pour_points)
+        # every cell takes the stream value of the nearest pour point
+        # downstream, so nested basins are handled correctly
+        subbasins = index.label_catchments(
+            pour_points["row"].to_numpy(),
+            pour_points["col"].to_numpy(),
+            pour_points["stream_value"].to_numpy().astype(np.int32),
         )
+        _report_progress("delineate_subbasins", len(pour_points), len(pour_points))
 
-        subbasins.data[catchment] = row["stream_value"]
+    return stream_raster.copy(data=subbasins.data)
 
-    return subbasins
+
+def _without_rim(flow_directions):
+    flow_directions = normalize_flow_directions(flow_directions)
+    fdir = flow_directions.values.copy()
+    fdir[[0, -1], :] = 0
+    fdir[:, [0, -1]] = 0
+    return flow_directions.copy(data=fdir)
 
 
 def _identify_pour_points(stream_raster, flow_accumulation):
-    pour_points = []
-    for stream_val in np.unique(stream_raster.data):
-        if stream_val == 0:
-            continue
-        if np.isnan(stream_val):
-            continue
-        rows, cols = np.where(stream_raster.data == stream_val)
-
-        # if less than 2 cells, skip
-        if len(rows) < 2:
-            warnings.warn(
-                f"Stream segment {stream_val} has less than 2 cells, skipping."
-            )
-            continue
-
-        acc_vals = flow_accumulation.data[rows, cols]
-        max_idx = np.argmax(acc_vals)
-        pour_points.append(
-            {
-                "row": rows[max_idx],
-                "col": cols[max_idx],
-                "flow_accumulation": acc_vals[max_idx],
-                "stream_value": stream_val,
-            }
-        )
-    pour_points = pd.DataFrame.from_records(pour_points)
+    stats = label_statistics(
+        stream_raster, {"flow_accumulation": flow_accumulation}, stats=("max", "argmax")
+    )
+
+    # if less than 2 cells, skip
+    for stream_val in stats.index[stats["count"] < 2]:
+        warnings.warn(f"Stream segment {stream_val} has less than 2 cells, skipping.")
+    stats = stats[stats["count"] >= 2]
+
+    pour_points = pd.DataFrame(
+        {
+            "row": stats["flow_accumulation_argmax_row"].to_numpy(),
+            "col": stats["flow_accumulation_argmax_col"].to_numpy(),
+            "flow_accumulation": stats["flow_accumulation_max"].to_numpy(),
+            "stream_value": stats.index.to_numpy(),
+        }
+    )
     # sort by flow accumulation descending
     pour_points = pour_points.sort_values("flow_accumulation", ascending=False)
     return pour_points
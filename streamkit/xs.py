@@ -1,13 +1,14 @@
-from typing import Optional, Sequence
+from typing import Iterator, Optional, Sequence
 
 import pandas as pd
 import geopandas as gpd
 import numpy as np
 from shapely.geometry import LineString
-from shapelysmooth import chaikin_smooth
-from shapelysmooth import taubin_smooth
 
+from streamkit.instrument import _report_progress, _stage
 
+
+@_stage("network_cross_sections")
 def network_cross_sections(
     linestrings: gpd.GeoSeries,
     interval_distance: float,
@@ -27,14 +28,42 @@ def network_cross_sections(
     Returns:
         cross section linestrings
     """
+    return pd.concat(
+        iter_network_cross_sections(
+            linestrings, interval_distance, width, linestring_ids, smoothed
+        )
+    )
+
+
+def iter_network_cross_sections(
+    linestrings: gpd.GeoSeries,
+    interval_distance: float,
+    width: float,
+    linestring_ids: Optional[Sequence] = None,
+    smoothed: bool = False,
+) -> Iterator[gpd.GeoDataFrame]:
+    """
+    Create cross-sections along linestrings one linestring at a time, e.g. to
+    stream them to a file with write_geoparquet.
+
+    Args:
+        linestrings: Linestring geometries.
+        interval_distance: Distance between cross-sections along the linestrings.
+        width: Width of each cross-section.
+        linestring_ids: Optional identifiers for each linestring. If None, the index of linestrings is used.
+        smoothed: Whether to use smoothed angles for cross-sections.
+    Yields:
+        The cross sections of each linestring, with the columns and xs_id
+        numbering of network_cross_sections.
+    """
     if linestring_ids is None:
         linestring_ids = linestrings.index
     else:
         if len(linestring_ids) != len(linestrings):
             raise ValueError("provided ids must match the length of linestrings")
 
-    xsections = []
-    for cid, linestring in zip(linestring_ids, linestrings):
+    next_xs_id = 1
+    for i, (cid, linestring) in enumerate(zip(linestring_ids, linestrings)):
         channel_xsections = _create_cross_sections(
             linestring, interval_distance, width, crs=linestrings.crs, smoothed=smoothed
         )
@@ -43,10 +72,12 @@ def network_cross_sections(
             geometry=channel_xsections, crs=linestrings.crs
         )
         channel_xsections["linestring_id"] = cid
-        xsections.append(channel_xsections)
-    xsections = pd.concat(xsections)
-    xsections["xs_id"] = np.arange(1, len(xsections) + 1)
-    return xsections
+        channel_xsections["xs_id"] = np.arange(
+            next_xs_id, next_xs_id + len(channel_xsections)
+        )
+        next_xs_id += len(channel_xsections)
+        _report_progress("network_cross_sections", i + 1, len(linestrings))
+        yield channel_xsections
 
 
 def _create_cross_sections(
@@ -107,6 +138,8 @@ def _compute_perpendicular_angles_smoothed(linestring, interval_distance):
     positions the actual cross-section lines on the original linestring (to
     maintain accurate spatial relationships).
     """
+    from shapelysmooth import chaikin_smooth, taubin_smooth
+
     smoothed_linestring = chaikin_smooth(taubin_smooth(linestring))
     angles, points = _compute_perpendicular_angles(
         smoothed_linestring, interval_distance
@@ -0,0 +1,50 @@
+"""
+Shared fixtures of the test suite: a small synthetic basin built with the
+terrain generators of the benchmark suite.
+"""
+
+import glob
+import os
+import sys
+
+import numpy as np
+import pytest
+import whitebox
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "benchmarks"))
+
+from terrain import dendritic_dem, hydrology  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def basin():
+    """A dendritic basin of about 100 links: dem, flow_directions,
+    flow_accumulation, and the min_accumulation of its streams."""
+    dem, min_accumulation = dendritic_dem(100, cells_per_link=1000)
+    flow_directions, flow_accumulation = hydrology(dem)
+    return {
+        "dem": dem,
+        "flow_directions": flow_directions,
+        "flow_accumulation": flow_accumulation,
+        "min_accumulation": min_accumulation,
+    }
+
+
+@pytest.fixture(scope="session")
+def stream_mask(basin):
+    """Stream cells (1) of the basin."""
+    acc = basin["flow_accumulation"]
+    return acc.copy(data=(acc.data > basin["min_accumulation"]).astype(np.uint8))
+
+
+@pytest.fixture(scope="session")
+def whitebox_tools():
+    """Skip tests that need the WhiteboxTools binary if it has not been
+    downloaded, since WhiteboxTools would try to download it."""
+    if os.environ.get("WBT_PATH") is None:
+        package_dir = os.path.dirname(whitebox.__file__)
+        found = glob.glob(os.path.join(package_dir, "whitebox_tools*")) + glob.glob(
+            os.path.join(package_dir, "WBT", "whitebox_tools*")
+        )
+        if not [path for path in found if not path.endswith(".py")]:
+            pytest.skip("WhiteboxTools binary is not installed")
@@ -0,0 +1,51 @@
+"""Chunked (dask-backed) entry points give the in-memory results."""
+
+import numpy as np
+import pytest
+
+from streamkit.streamlink import link_streams
+from streamkit.streamnodes import find_stream_nodes
+from streamkit.streamtrace import trace_streams
+from streamkit.upstream_length import upstream_length_raster
+
+# chunk sizes that do not divide the grid, so paths leave chunks through
+# every edge, including the top and left ones
+CHUNKS = [(37, 41), (64, 29)]
+
+
+def _chunk(raster, chunks):
+    assert raster.shape[0] % chunks[0] and raster.shape[1] % chunks[1]
+    return raster.chunk(dict(zip(raster.dims, chunks)))
+
+
+@pytest.mark.parametrize("chunks", CHUNKS)
+def test_trace_streams(basin, stream_mask, chunks):
+    fdir = basin["flow_directions"]
+    heads = find_stream_nodes(stream_mask, fdir)[0]
+    expected = trace_streams(heads, fdir)
+    result = trace_streams(heads, _chunk(fdir, chunks))
+    np.testing.assert_array_equal(np.asarray(result.data), expected.data)
+
+
+@pytest.mark.parametrize("chunks", CHUNKS)
+def test_link_streams(basin, stream_mask, chunks):
+    fdir = basin["flow_directions"]
+    expected = link_streams(stream_mask, fdir)
+    result = link_streams(_chunk(stream_mask, chunks), _chunk(fdir, chunks))
+    np.testing.assert_array_equal(np.asarray(result.data), expected.data)
+
+
+@pytest.mark.parametrize("chunks", CHUNKS)
+def test_find_stream_nodes(basin, stream_mask, chunks):
+    fdir = basin["flow_directions"]
+    expected = find_stream_nodes(stream_mask, fdir)
+    result = find_stream_nodes(_chunk(stream_mask, chunks), _chunk(fdir, chunks))
+    assert result == expected
+
+
+@pytest.mark.parametrize("chunks", CHUNKS)
+def test_upstream_length_raster(basin, stream_mask, chunks):
+    fdir = basin["flow_directions"]
+    expected = upstream_length_raster(stream_mask, fdir)
+    result = upstream_length_raster(_chunk(stream_mask, chunks), _chunk(fdir, chunks))
+    np.testing.assert_allclose(np.asarray(result.data), expected.data)
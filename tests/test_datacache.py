@@ -0,0 +1,167 @@
+"""DataCache with local stand-ins for the WBD, NHD, and 3DEP clients."""
+
+import os
+import pickle
+import threading
+
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import LineString, box
+import xarray as xr
+
+from streamkit.data import get_huc_data
+from streamkit.datacache import DataCache
+
+CRS = "EPSG:5070"
+
+
+class FakeWBD:
+    def __init__(self):
+        self.calls = 0
+
+    def byids(self, level, huc):
+        self.calls += 1
+        # HUCs ending in 0 to 4 share one boundary, 5 to 9 another
+        width = 400 if int(huc[-1]) < 5 else 500
+        geometry = [box(0, 0, width, 400)]
+        return gpd.GeoDataFrame({"huc": [huc]}, geometry=geometry, crs=CRS)
+
+
+class FakeNHD:
+    def __init__(self):
+        self.calls = 0
+
+    def bygeom(self, boundary):
+        self.calls += 1
+        lines = [
+            LineString([(50, 50), (250, 200)]),
+            LineString([(250, 200), (450, 350)]),
+        ]
+        return gpd.GeoDataFrame({"comid": [1, 2]}, geometry=lines, crs=CRS)
+
+
+class FakeDEM:
+    def __init__(self):
+        self.calls = 0
+
+    def static_3dep_dem(self, geometry, resolution, crs):
+        self.calls += 1
+        return _raster(geometry.bounds, resolution, crs)
+
+
+def _raster(bounds, resolution, crs, value=None):
+    minx, miny, maxx, maxy = bounds
+    x = np.arange(minx + resolution / 2, maxx, resolution)
+    y = np.arange(maxy - resolution / 2, miny, -resolution)
+    data = np.add.outer(y, x).astype(np.float32) if value is None else value
+    return xr.DataArray(
+        np.broadcast_to(data, (len(y), len(x))).astype(np.float32),
+        dims=("y", "x"),
+        coords={"y": y, "x": x},
+    ).rio.write_crs(crs)
+
+
+def _clients():
+    return {"wbd": FakeWBD(), "nhd": FakeNHD(), "dem_client": FakeDEM()}
+
+
+def _get(cache, clients, hucid="18020104"):
+    return get_huc_data(hucid, crs=CRS, dem_resolution=10, cache=cache, **clients)
+
+
+def _entry(i):
+    return gpd.GeoDataFrame({"i": [i]}, geometry=[box(0, 0, 1, 1)], crs=CRS)
+
+
+def test_miss_then_hit(tmp_path):
+    cache = DataCache(str(tmp_path))
+    clients = _clients()
+    flowlines, dem = _get(cache, clients)
+    assert [c.calls for c in clients.values()] == [1, 1, 1]
+
+    # a hit never calls the clients
+    clients = _clients()
+    cached_flowlines, cached_dem = _get(cache, clients)
+    assert [c.calls for c in clients.values()] == [0, 0, 0]
+    assert cached_flowlines.geometry.equals(flowlines.geometry)
+    np.testing.assert_array_equal(cached_dem.values, dem.values)
+
+    # flowlines and DEMs are keyed on the boundary, not the HUC ID
+    clients = _clients()
+    _get(cache, clients, hucid="18020103")
+    assert [c.calls for c in clients.values()] == [1, 0, 0]
+    clients = _clients()
+    _get(cache, clients, hucid="18020105")
+    assert [c.calls for c in clients.values()] == [1, 1, 1]
+
+
+def test_offline_miss(tmp_path):
+    _get(DataCache(str(tmp_path)), _clients())
+    offline = DataCache(str(tmp_path), offline=True)
+    clients = _clients()
+    _get(offline, clients)
+    with pytest.raises(LookupError):
+        _get(offline, clients, hucid="18020105")
+    assert [c.calls for c in clients.values()] == [0, 0, 0]
+
+
+def test_lru_eviction(tmp_path):
+    cache = DataCache(str(tmp_path))
+    keys = [cache.key("test", i=i) for i in range(4)]
+    for t, key in enumerate(keys[:3]):
+        cache.store(key, _entry(0))
+        # distinct access times, oldest first
+        path = cache._path(key, "vector")
+        os.utime(path, (t + 1, t + 1))
+    size = os.path.getsize(cache._path(keys[0], "vector"))
+
+    # using the oldest entry makes the second one least recently used
+    assert cache.load(keys[0]) is not None
+    cache.max_size = 3 * size
+    cache.store(keys[3], _entry(0))
+    assert [cache.load(key) is not None for key in keys] == [True, False, True, True]
+
+
+def test_entry_larger_than_max_size(tmp_path):
+    cache = DataCache(str(tmp_path), max_size=1)
+    key = cache.key("test", i=0)
+    cache.store(key, _entry(0))
+    assert cache.load(key) is not None
+    # evicted once another entry is stored
+    cache.store(cache.key("test", i=1), _entry(1))
+    assert cache.load(key) is None
+
+
+def test_concurrent_stores(tmp_path):
+    size = len(pickle.dumps(_entry(0)))
+    cache = DataCache(str(tmp_path), max_size=4 * size)
+    errors = []
+
+    def work(thread):
+        try:
+            for i in range(20):
+                # distinct entries, and one shared by every thread
+                cache.store(cache.key("test", thread=thread, i=i), _entry(i))
+                cache.store(cache.key("test", shared=True), _entry(-1))
+                cache.load(cache.key("test", thread=thread, i=i - 1))
+        except Exception as e:  # noqa: BLE001
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(t,)) for t in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    leftovers = [
+        name for _, _, files in os.walk(tmp_path) for name in files if name[0] == "."
+    ]
+    assert leftovers == []
+
+
+def test_pickle(tmp_path):
+    cache = DataCache(str(tmp_path), max_size=10)
+    copy = pickle.loads(pickle.dumps(cache))
+    assert repr(copy) == repr(cache)
+    copy.store(copy.key("test", i=0), _entry(0))
@@ -0,0 +1,115 @@
+"""download_dem with a local stand-in for the 3DEP client."""
+
+import threading
+
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import LineString, box
+import xarray as xr
+
+from streamkit import data
+from streamkit.data import download_dem
+
+CRS = "EPSG:5070"
+RESOLUTION = 10
+
+
+class FakeDEM:
+    """Returns a plane of known values, failing the requests that fail(bounds)
+    is True for."""
+
+    def __init__(self, fail=lambda bounds, attempt: False):
+        self.fail = fail
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def static_3dep_dem(self, geometry, resolution, crs):
+        bounds = geometry.bounds
+        with self._lock:
+            attempt = self.requests.count(bounds)
+            self.requests.append(bounds)
+        if self.fail(bounds, attempt):
+            raise RuntimeError(f"request for {bounds} failed")
+        minx, miny, maxx, maxy = bounds
+        x = np.arange(minx + resolution / 2, maxx, resolution)
+        y = np.arange(maxy - resolution / 2, miny, -resolution)
+        return xr.DataArray(
+            _plane(*np.meshgrid(x, y)), dims=("y", "x"), coords={"y": y, "x": x}
+        ).rio.write_crs(crs)
+
+
+def _plane(x, y):
+    return (x + 2 * y).astype(np.float32)
+
+
+def _download(client, boundary=box(0, 0, 1280, 640), **kwargs):
+    gdf = gpd.GeoDataFrame(geometry=[boundary], crs=CRS)
+    return download_dem(gdf, RESOLUTION, crs=CRS, client=client, **kwargs)
+
+
+def _check_mosaic(dem, shape=(64, 128)):
+    assert dem.shape == shape
+    x, y = np.meshgrid(dem.x.values, dem.y.values)
+    np.testing.assert_array_equal(dem.values, _plane(x, y))
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    calls = []
+    monkeypatch.setattr(data.time, "sleep", calls.append)
+    return calls
+
+
+def test_mosaic(sleeps):
+    # 2 x 1 tiles of 64 pixels
+    client = FakeDEM()
+    _check_mosaic(_download(client, tile_size=64))
+    assert sorted(client.requests) == [(0, 0, 640, 640), (640, 0, 1280, 640)]
+    assert sleeps == []
+
+
+def test_retry_backoff(sleeps):
+    client = FakeDEM(fail=lambda bounds, attempt: attempt < 2)
+    _check_mosaic(_download(client, tile_size=128, retries=3))
+    assert len(client.requests) == 3
+    assert sleeps == [1, 2]
+
+
+def test_split_failing_tile(sleeps):
+    # tiles wider than 32 pixels fail
+    client = FakeDEM(fail=lambda bounds, attempt: bounds[2] - bounds[0] > 320)
+    _check_mosaic(_download(client, tile_size=64, min_tile_size=16, retries=1))
+    widths = {bounds[2] - bounds[0] for bounds in client.requests}
+    assert widths == {640, 320}
+    # every tile is split into its own quadrants
+    assert len(client.requests) == 2 + 2 * 4
+
+
+def test_split_skips_quadrants_without_area(sleeps):
+    # two squares touching at a corner: half of the quadrants of the whole
+    # extent only touch the boundary at that corner
+    boundary = box(0, 0, 320, 320).union(box(320, 320, 640, 640))
+    client = FakeDEM(fail=lambda bounds, attempt: bounds[2] - bounds[0] > 320)
+    dem = _download(client, boundary, tile_size=64, min_tile_size=16, retries=1)
+    assert dem.shape == (64, 64)
+    assert all(
+        box(*bounds).intersection(boundary).area > 0 for bounds in client.requests
+    )
+    assert len(client.requests) == 1 + 2
+
+
+def test_min_tile_size(sleeps):
+    client = FakeDEM(fail=lambda bounds, attempt: True)
+    with pytest.raises(RuntimeError, match="failed"):
+        _download(client, tile_size=64, min_tile_size=16, retries=2)
+    widths = {bounds[2] - bounds[0] for bounds in client.requests}
+    # tiles are split while their halves are at least min_tile_size pixels
+    assert min(widths) == 160
+
+
+def test_boundary_without_area(sleeps):
+    client = FakeDEM()
+    with pytest.raises(ValueError, match="no area"):
+        _download(client, LineString([(0, 0), (100, 100)]))
+    assert client.requests == []
@@ -0,0 +1,121 @@
+"""update_hydrology and update_streams against a full recompute."""
+
+import numpy as np
+import pytest
+
+from streamkit.incremental import update_hydrology, update_streams
+from streamkit.streamlink import link_streams
+from streamkit.watershed import delineate_subbasins, flow_accumulation_workflow
+from terrain import fill_depressions, hydrology
+
+# (quantile of the flow accumulation of the edited stream cell, half width
+# of the window, change of elevation in m)
+EDITS = {"burn": (0.5, 4, -2), "dam": (0.75, 3, 20), "edge": (1, 4, 5)}
+
+
+def _edit(basin, stream_mask, kind):
+    """Edit the DEM of the basin on one of its streams.
+
+    burn lowers 9 x 9 cells by 2 m on the stream cell of median flow
+    accumulation; dam raises 7 x 7 cells by 20 m on the stream cell at 3/4
+    of the flow accumulations, filling the valley upstream of it; edge
+    raises the cells within 4 cells of the outlet, on the edge of the DEM,
+    by 5 m, so the basin drains elsewhere.
+
+    Returns the edited DEM and the window of the edit.
+    """
+    acc = basin["flow_accumulation"].data
+    rows, cols = np.nonzero(stream_mask.data)
+    order = np.argsort(acc[rows, cols], kind="stable")
+    quantile, half, change = EDITS[kind]
+    k = order[min(int(quantile * len(order)), len(order) - 1)]
+    row, col = rows[k], cols[k]
+    nrows, ncols = acc.shape
+    window = (
+        max(row - half, 0),
+        min(row + half + 1, nrows),
+        max(col - half, 0),
+        min(col + half + 1, ncols),
+    )
+    if kind == "edge":
+        assert 0 in window[::2] or window[1] == nrows or window[3] == ncols
+    dem = basin["dem"].copy(deep=True)
+    dem.data[window[0] : window[1], window[2] : window[3]] += change
+    return dem, window
+
+
+def _streams(flow_directions, flow_accumulation, min_accumulation):
+    """Stream links and subbasins, computed from scratch."""
+    mask = flow_accumulation.copy(
+        data=(flow_accumulation.data > min_accumulation).astype(np.uint8)
+    )
+    streams = link_streams(mask, flow_directions)
+    return streams, delineate_subbasins(streams, flow_directions, flow_accumulation)
+
+
+def _assert_same_partition(labels, expected):
+    """Assert two label rasters group the cells the same way, whatever the
+    labels."""
+    labels = np.asarray(labels).ravel()
+    expected = np.asarray(expected).ravel()
+    np.testing.assert_array_equal(labels == 0, expected == 0)
+    pairs = np.unique(np.stack([labels, expected]), axis=1)
+    assert len(np.unique(pairs[0])) == pairs.shape[1]
+    assert len(np.unique(pairs[1])) == pairs.shape[1]
+
+
+@pytest.mark.parametrize("kind", EDITS)
+def test_update_streams(basin, stream_mask, kind):
+    min_accumulation = basin["min_accumulation"]
+    streams, subbasins = _streams(
+        basin["flow_directions"], basin["flow_accumulation"], min_accumulation
+    )
+    dem, _ = _edit(basin, stream_mask, kind)
+    flow_directions, flow_accumulation = hydrology(fill_depressions(dem))
+    assert (flow_directions.data != basin["flow_directions"].data).any()
+
+    new_streams, new_subbasins = update_streams(
+        streams,
+        subbasins,
+        flow_directions,
+        flow_accumulation,
+        basin["flow_directions"],
+        basin["flow_accumulation"],
+        min_accumulation,
+    )
+    expected_streams, expected_subbasins = _streams(
+        flow_directions, flow_accumulation, min_accumulation
+    )
+    _assert_same_partition(new_streams.data, expected_streams.data)
+    _assert_same_partition(new_subbasins.data, expected_subbasins.data)
+
+
+@pytest.mark.parametrize("kind", EDITS)
+def test_update_hydrology(basin, stream_mask, kind, whitebox_tools):
+    min_accumulation = basin["min_accumulation"]
+    conditioned, flow_directions, flow_accumulation = flow_accumulation_workflow(
+        basin["dem"], cache=False
+    )
+    streams, subbasins = _streams(flow_directions, flow_accumulation, min_accumulation)
+    dem, window = _edit(basin, stream_mask, kind)
+
+    _, new_flow_directions, new_flow_accumulation = update_hydrology(
+        dem, conditioned, flow_directions, flow_accumulation, window
+    )
+    new_streams, new_subbasins = update_streams(
+        streams,
+        subbasins,
+        new_flow_directions,
+        new_flow_accumulation,
+        flow_directions,
+        flow_accumulation,
+        min_accumulation,
+    )
+    _, expected_flow_directions, expected_flow_accumulation = (
+        flow_accumulation_workflow(dem, cache=False)
+    )
+    expected_streams, expected_subbasins = _streams(
+        expected_flow_directions, expected_flow_accumulation, min_accumulation
+    )
+    _assert_same_partition(new_streams.data, expected_streams.data)
+    _assert_same_partition(new_subbasins.data, expected_subbasins.data)
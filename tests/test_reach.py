@@ -0,0 +1,65 @@
+"""Reach merging against the restart loop it replaced."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from streamkit.reach import _merge_reaches_by_threshold
+
+
+def _restart_merge(reach_id, slopes, threshold):
+    """Merge the first adjacent reaches whose median slopes differ by less
+    than threshold, then start over from the first boundary, until no
+    boundary is below threshold. Returns reach IDs renumbered from 0."""
+    df = pd.DataFrame({"reach_id": reach_id, "slope_degrees": slopes})
+    medians = df.groupby("reach_id")["slope_degrees"].median()
+    merged = True
+    while merged:
+        merged = False
+        for reach in medians.index[:-1]:
+            following = reach + 1
+            if following not in medians.index:
+                continue
+            if abs(medians[reach] - medians[following]) < threshold:
+                df.loc[df["reach_id"] == following, "reach_id"] = reach
+                medians[reach] = df.loc[
+                    df["reach_id"] == reach, "slope_degrees"
+                ].median()
+                medians = medians.drop(following)
+                merged = True
+                break
+    return np.unique(df["reach_id"].values, return_inverse=True)[1]
+
+
+def _profile(rng, kind):
+    """Random reach IDs (consecutive from 0, in order along the stream) and
+    slopes of a stream profile."""
+    n = rng.integers(1, 200)
+    n_reaches = rng.integers(1, min(n, 40) + 1)
+    breaks = np.sort(rng.choice(np.arange(1, n), size=n_reaches - 1, replace=False))
+    reach_id = np.searchsorted(breaks, np.arange(n), side="right")
+    if kind == "ties":
+        # slopes and their differences equal to the thresholds
+        slopes = rng.integers(0, 6, n) * 0.5
+    else:
+        slopes = rng.random(n) * rng.choice([1, 3, 10])
+    if kind == "nan":
+        slopes[rng.random(n) < 0.3] = np.nan
+        if rng.random() < 0.5:
+            # reaches without any slope
+            slopes[reach_id == rng.integers(n_reaches)] = np.nan
+    return reach_id, slopes
+
+
+@pytest.mark.parametrize("kind", ["random", "nan", "ties"])
+def test_merge_reaches_by_threshold(kind):
+    rng = np.random.default_rng(0)
+    for _ in range(1000):
+        reach_id, slopes = _profile(rng, kind)
+        threshold = rng.choice([0.1, 0.5, 1.0, 2.0])
+        merged = _merge_reaches_by_threshold(
+            pd.DataFrame({"reach_id": reach_id, "slope_degrees": slopes}), threshold
+        )
+        np.testing.assert_array_equal(
+            merged["reach_id"].values, _restart_merge(reach_id, slopes, threshold)
+        )
@@ -0,0 +1,60 @@
+"""trace_stream_links gives the results of the separate stages."""
+
+import numpy as np
+import pytest
+
+from streamkit.streamlink import link_streams, trace_stream_links
+from streamkit.streamnodes import find_stream_nodes
+from streamkit.streamtrace import trace_streams
+
+
+def _points(stream_mask, fdir, extra):
+    heads = find_stream_nodes(stream_mask, fdir)[0]
+    if not extra:
+        return heads
+    # also start from stream cells below the heads, in shuffled order
+    rng = np.random.default_rng(0)
+    rows, cols = np.nonzero(stream_mask.data)
+    picked = rng.choice(len(rows), 50, replace=False)
+    points = heads + list(zip(rows[picked].tolist(), cols[picked].tolist()))
+    return [points[i] for i in rng.permutation(len(points))]
+
+
+@pytest.mark.parametrize("chunks", [None, (37, 41)])
+@pytest.mark.parametrize("extra", [False, True])
+def test_trace_stream_links(basin, stream_mask, extra, chunks):
+    fdir = basin["flow_directions"]
+    points = _points(stream_mask, fdir, extra)
+    expected = link_streams(trace_streams(points, fdir), fdir)
+    sources, confluences, outlets = find_stream_nodes(expected, fdir)
+
+    if chunks is not None:
+        fdir = fdir.chunk(dict(zip(fdir.dims, chunks)))
+    links, nodes = trace_stream_links(points, fdir)
+
+    np.testing.assert_array_equal(np.asarray(links.data), expected.data)
+    assert links.dtype == expected.dtype
+    for kind, cells in [
+        ("source", sources),
+        ("confluence", confluences),
+        ("outlet", outlets),
+    ]:
+        table = nodes[nodes["kind"] == kind]
+        assert list(zip(table["row"], table["col"])) == cells
+        rows, cols = np.array(cells, dtype=np.int64).reshape(-1, 2).T
+        np.testing.assert_array_equal(table["stream_id"], expected.data[rows, cols])
+
+
+@pytest.mark.parametrize("chunks", [None, (100, 128)])
+def test_link_ids_past_uint16(basin, chunks):
+    # every cell is a pit, so every stream cell is a link of its own
+    fdir = basin["flow_directions"]
+    fdir = fdir.isel(y=np.arange(300) % fdir.shape[0], x=np.arange(256) % fdir.shape[1])
+    fdir = fdir.copy(data=np.zeros(fdir.shape, dtype=np.uint8))
+    stream_mask = fdir.copy(data=np.ones(fdir.shape, dtype=np.uint8))
+    if chunks is not None:
+        fdir = fdir.chunk(dict(zip(fdir.dims, chunks)))
+        stream_mask = stream_mask.chunk(dict(zip(fdir.dims, chunks)))
+    links = np.asarray(link_streams(stream_mask, fdir).data)
+    assert links.max() == fdir.size
+    assert len(np.unique(links)) == fdir.size